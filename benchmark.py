@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark game scanning against synthetic libraries of various sizes
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Each library is generated by C{test/synthetic.py} and scanned in a fresh
+subprocess, since the providers resolve C{$HOME} and the XDG paths at
+import time.
+
+The "cold" run only has the tree's file contents evicted from the page
+cache. (Dropping cached dentries and inodes requires root.)
+
+With C{--prefetch}, it instead measures how long a cold launch spends
+reading each game's files, with and without a prefetch having been issued
+when the game was selected a moment earlier. (Results are only meaningful
+on a real disk. On tmpfs, everything is always "cached".)
+
+With C{--blacklist}, it instead times matching generated paths against a
+generated blacklist, both as the single regex the fallback provider used to
+compile on every call and with the cached L{src.util.blacklist.GlobMatcher}.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__appname__ = "Game scanning benchmark"
+__version__ = "0.0pre0"
+__license__ = "GNU GPL 3.0 or later"
+
+import json, logging, os, random, shutil, subprocess, sys, tempfile, time
+log = logging.getLogger(__name__)
+
+# TODO: Decide on a name for the project and rename "src"
+from test.synthetic import drop_caches, generate_library
+
+def run_worker(base, repeat):
+    """Scan the library in C{base} and print the timings as JSON.
+
+    (Must run in a fresh process so the environment is set before the
+     providers get imported.)
+    """
+    with open(os.path.join(base, 'manifest.json')) as fobj:
+        manifest = json.load(fobj)
+    os.environ.update(manifest['env'])
+
+    from src.game_providers import fallback, get_games, instrument
+    from src.util.profiling import Profiler
+    fallback.GAMES_DIRS[:] = manifest['roots']
+
+    runs = []
+    for idx in range(repeat + 1):
+        if idx == 0:
+            drop_caches(base)
+        with Profiler() as profiler:
+            instrument(profiler)
+            games = profiler.wrap(get_games, 'get_games', 'entries')()
+        runs.append({
+            'cold': idx == 0,
+            'found': len(games),
+            'profiles': json.loads(profiler.to_json())['profiles'],
+        })
+
+    print(json.dumps({'count': manifest['count'], 'counts': manifest['counts'],
+                      'runs': runs}))
+
+def read_files(plan):
+    """Read the files in a prefetch plan as a launching game would"""
+    for path, length in plan:
+        with open(path, 'rb') as fobj:
+            while length > 0:
+                chunk = fobj.read(min(length, 1024 * 1024))
+                if not chunk:
+                    break
+                length -= len(chunk)
+
+def run_prefetch(base, manifest, games, think_time):
+    """Time cold launch I/O for some games with and without prefetching
+
+    @param think_time: Seconds between selecting a game and launching it
+    @returns: A dict of total seconds spent in launch I/O per mode
+    """
+    from src.game_providers import fallback
+    from src.util.prefetch import plan_prefetch, prefetch_file
+
+    entries = [x for x in fallback.get_games(roots=manifest['roots'])
+               if x.default_launcher][:games]
+    plans = [plan_prefetch(x.default_launcher.argv[0], x.base_path)
+             for x in entries]
+
+    results = {'games': len(plans), 'think_time': think_time,
+               'bytes': sum(y[1] for x in plans for y in x)}
+    for mode in ('without', 'with'):
+        drop_caches(base)
+        elapsed = 0.0
+        for plan in plans:
+            if mode == 'with':
+                for path, length in plan:
+                    prefetch_file(path, length)
+                time.sleep(think_time)
+            start = time.time()
+            read_files(plan)
+            elapsed += time.time() - start
+        results[mode] = elapsed
+    return results
+
+def run_blacklist(patterns, paths, seed=0):
+    """Time blacklist matching with a single regex and a L{GlobMatcher}
+
+    @returns: A dict of seconds taken per method, including compilation
+    """
+    from src.util.blacklist import GlobMatcher
+    from src.util.common import multiglob_compile
+
+    rand = random.Random(seed)
+    words = ['%s%d' % (rand.choice(('game', 'tool', 'demo', 'sdk', 'old')), x)
+             for x in range(patterns)]
+    roots = ['/mnt/ext%d/games' % x for x in range(4)] + [
+        '/home/user/opt', '/usr/games', '/usr/local/games']
+
+    # Mostly */name globs like BLACKLIST, plus rooted and wildcard ones
+    globs = []
+    for word in words:
+        shape = rand.random()
+        if shape < 0.6:
+            globs.append('*/' + word)
+        elif shape < 0.9:
+            globs.append('%s/%s*' % (rand.choice(roots), word))
+        else:
+            globs.append('*/%s[_-]*' % word)
+
+    names = words + ['Game %d' % x for x in range(patterns * 4)]
+    paths = ['%s/%s' % (rand.choice(roots), rand.choice(names))
+             for _ in range(paths)]
+
+    results = {'patterns': len(globs), 'paths': len(paths)}
+    for method, build in (('regex', lambda: multiglob_compile(globs,
+                                                                prefix=True)),
+                          ('matcher', lambda: GlobMatcher(globs))):
+        start = time.time()
+        matcher = build()
+        matched = sum(1 for x in paths if matcher.match(x))
+        results[method] = time.time() - start
+        results[method + '_matched'] = matched
+    assert results['regex_matched'] == results['matcher_matched']
+    return results
+
+def summarize(result):
+    """Reduce a worker's result to C{{section: (cold, best warm)}} wall times"""
+    sections = {}
+    for run in result['runs']:
+        for profile in run['profiles']:
+            cold, warm = sections.get(profile['name'], (None, None))
+            if run['cold']:
+                cold = profile['wall_time']
+            elif warm is None or profile['wall_time'] < warm:
+                warm = profile['wall_time']
+            sections[profile['name']] = (cold, warm)
+    return sections
+
+def format_table(results):
+    """Return a human-readable table of cold/warm times per section and size"""
+    names = []
+    for result in results:
+        for run in result['runs']:
+            for profile in run['profiles']:
+                if profile['name'] not in names:
+                    names.append(profile['name'])
+
+    headers = ['Section']
+    for result in results:
+        headers.extend(x % result['count'] for x in ('%d cold', '%d warm'))
+    summaries = [summarize(x) for x in results]
+    rows = []
+    for name in names:
+        row = [name]
+        for summary in summaries:
+            row.extend('-' if x is None else '%.4f' % x
+                       for x in summary.get(name, (None, None)))
+        rows.append(row)
+    rows.append(['(games found)'] + [str(x['runs'][0]['found'])
+                                     for x in results for _ in (0, 1)])
+
+    widths = [max(len(row[idx]) for row in [headers] + rows)
+              for idx in range(len(headers))]
+    lines = ['  '.join(cell.ljust(width) if idx == 0 else cell.rjust(width)
+                       for idx, (cell, width) in enumerate(zip(row, widths)))
+             for row in [headers] + rows]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+def main():
+    """The main entry point, compatible with setuptools entry points."""
+    # pylint: disable=bad-continuation
+    from optparse import OptionParser, SUPPRESS_HELP
+    parser = OptionParser(version="%%prog v%s" % __version__,
+            usage="%prog [options]",
+            description=__doc__.replace('\r\n', '\n').split('\n--snip--\n')[0])
+    parser.add_option('-v', '--verbose', action="count", dest="verbose",
+        default=2, help="Increase the verbosity. Use twice for extra effect")
+    parser.add_option('-q', '--quiet', action="count", dest="quiet",
+        default=0, help="Decrease the verbosity. Use twice for extra effect")
+    parser.add_option('--sizes', action="store", default="100,1000,10000",
+        help="Comma-separated library sizes to benchmark (default: %default)")
+    parser.add_option('--repeat', action="store", type="int", default=3,
+        help="Number of warm runs per size (default: %default)")
+    parser.add_option('--seed', action="store", type="int", default=0,
+        help="Random seed for generating game names (default: %default)")
+    parser.add_option('--json', action="store", default=None, metavar="PATH",
+        help="Also write the raw results as JSON to PATH ('-' for stdout)")
+    parser.add_option('--keep', action="store_true", default=False,
+        help="Don't delete the generated libraries when done")
+    parser.add_option('--prefetch', action="store_true", default=False,
+        help="Benchmark cold launch I/O with and without prefetching instead "
+        "of scanning")
+    parser.add_option('--prefetch-games', action="store", type="int",
+        default=10, dest="prefetch_games", metavar="NUM",
+        help="Number of games to launch per prefetch run (default: %default)")
+    parser.add_option('--think-time', action="store", type="float",
+        default=0.5, dest="think_time", metavar="SECS",
+        help="Delay between selecting and launching a game when prefetching "
+        "(default: %default)")
+    parser.add_option('--blacklist', action="store_true", default=False,
+        help="Benchmark blacklist matching instead of scanning")
+    parser.add_option('--patterns', action="store", type="int", default=500,
+        metavar="NUM", help="Number of globs in the blacklist benchmark's "
+        "blacklist (default: %default)")
+    parser.add_option('--paths', action="store", type="int", default=50000,
+        metavar="NUM", help="Number of paths to match in the blacklist "
+        "benchmark (default: %default)")
+    parser.add_option('--asset-size', action="store", type="int",
+        default=4096, dest="asset_size", metavar="BYTES",
+        help="Size of the larger fake asset files (default: %default)")
+    parser.add_option('--worker', action="store", default=None,
+        metavar="DIR", help=SUPPRESS_HELP)
+
+    # Allow pre-formatted descriptions
+    parser.formatter.format_description = lambda description: description
+
+    opts, _ = parser.parse_args()
+
+    # Set up clean logging to stderr
+    log_levels = [logging.CRITICAL, logging.ERROR, logging.WARNING,
+                  logging.INFO, logging.DEBUG]
+    opts.verbose = min(opts.verbose - opts.quiet, len(log_levels) - 1)
+    opts.verbose = max(opts.verbose, 0)
+    logging.basicConfig(level=log_levels[opts.verbose],
+                        format='%(levelname)s: %(message)s')
+
+    if opts.worker:
+        # Keep provider chatter about the fake games out of the results
+        logging.getLogger().setLevel(logging.ERROR)
+        run_worker(opts.worker, opts.repeat)
+        return
+    elif opts.blacklist:
+        result = run_blacklist(opts.patterns, opts.paths, opts.seed)
+        print("%d globs, %d paths (%d matched): %.4fs as one regex, "
+              "%.4fs with GlobMatcher" % (result['patterns'], result['paths'],
+              result['matcher_matched'], result['regex'], result['matcher']))
+        return
+
+    results = []
+    for size in [int(x) for x in opts.sizes.split(',') if x.strip()]:
+        base = tempfile.mkdtemp(prefix='game_launcher_bench_%d_' % size)
+        try:
+            start = time.time()
+            manifest = generate_library(base, size, seed=opts.seed,
+                                        asset_size=opts.asset_size)
+            log.info("Generated %d games in %s (%.2fs)", size, base,
+                     time.time() - start)
+
+            if opts.prefetch:
+                result = run_prefetch(base, manifest, opts.prefetch_games,
+                                      opts.think_time)
+                result['count'] = size
+                results.append(result)
+                print("%d games: %d bytes in %d launches: %.4fs without "
+                      "prefetch, %.4fs with" % (size, result['bytes'],
+                      result['games'], result['without'], result['with']))
+                continue
+
+            output = subprocess.check_output([sys.executable,
+                os.path.abspath(__file__), '--worker', base,
+                '--repeat', str(opts.repeat)],
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+            results.append(json.loads(output.decode('utf-8')))
+        finally:
+            if opts.keep:
+                log.info("Keeping %s", base)
+            else:
+                shutil.rmtree(base, ignore_errors=True)
+
+    if not opts.prefetch:
+        print(format_table(results))
+    if opts.json:
+        data = json.dumps({'version': __version__, 'timestamp': time.time(),
+                           'python': sys.version.split()[0],
+                           'results': results}, indent=2)
+        if opts.json == '-':
+            print(data)
+        else:
+            with open(opts.json, 'w') as fobj:
+                fobj.write(data)
+
+if __name__ == '__main__':
+    main()
+
+# vim: set sw=4 sts=4 expandtab :
@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 """An advanced GUI for organizing and launching games on Linux, regardless of
 how they were installed.
+
+--snip--
+
+(C{--launch} and C{--list} only read the index written by the last scan so
+ they can C{exec()} a game without importing any toolkit or game provider.
+ C{--pick} also consults the library database for play history and tags.)
 """
 
 from __future__ import (absolute_import, division, print_function,
@@ -12,13 +18,45 @@ __appname__ = "Unified Game Launcher"
 __version__ = "0.0pre0"
 __license__ = "GNU GPL 3.0 or later"
 
-import sys
-from PyQt5 import QtWidgets
+import errno, os, random, sys
 
 # -- Code Here --
 
-def main():
-    """The main entry point, compatible with setuptools entry points."""
+def exec_record(record):
+    """Replace this process with the given L{IndexRecord}'s launcher"""
+    if record.cwd:
+        os.chdir(record.cwd)
+    try:
+        os.execvp(record.argv[0], record.argv)
+    except OSError as err:
+        if err.errno != errno.ENOEXEC:
+            raise
+        # A shellscript with no shebang (See GameLauncher.run)
+        os.execv('/bin/sh', ['/bin/sh'] + record.argv)
+
+def pick_game(parser, query):
+    """Return the name of a random game matching a (saved) query"""
+    from src.library.queries import QueryEngine
+    from src.library.store import LibraryStore
+    from src.library.tags import FilterSyntaxError
+
+    store = LibraryStore()
+    engine = QueryEngine(store)
+    try:
+        if query in engine.queries:
+            identity = engine.pick(query)
+        else:
+            identity = random.choice(engine.evaluate(query) or [None])
+    except FilterSyntaxError as err:
+        parser.error("Invalid query: %s" % err)
+
+    if identity is None:
+        parser.error("No game matches %r" % query)
+    return store.get_name(identity)
+
+def run_gui():
+    """Start the graphical interface"""
+    from PyQt5 import QtWidgets
     app = QtWidgets.QApplication(sys.argv)
 
     w = QtWidgets.QWidget()
@@ -29,6 +67,62 @@ def main():
 
     sys.exit(app.exec_())
 
+def main():
+    """The main entry point, compatible with setuptools entry points."""
+    # pylint: disable=bad-continuation
+    from optparse import OptionParser
+    parser = OptionParser(version="%%prog v%s" % __version__,
+            usage="%prog [options]",
+            description=__doc__.replace('\r\n', '\n').split('\n--snip--\n')[0])
+    parser.add_option('--launch', action="store", default=None,
+        metavar="NAME", help="Launch the game named NAME (or the only game "
+        "whose name starts with NAME) and exit")
+    parser.add_option('--list', action="store_true", default=False,
+        help="List the names of known games and exit")
+    parser.add_option('--match', action="store", default='',
+        metavar="PREFIX", help="With --list, only list names starting with "
+        "PREFIX")
+    parser.add_option('--pick', action="store", default=None,
+        metavar="QUERY", help="Launch a random game matching the saved query "
+        "named QUERY (or QUERY itself, eg. 'played>30d') and exit")
+    parser.add_option('--index', action="store", default=None,
+        metavar="PATH", help="Read the game index from PATH instead of the "
+        "default location")
+
+    # Allow pre-formatted descriptions
+    parser.formatter.format_description = lambda description: description
+
+    opts, _ = parser.parse_args()
+
+    if not (opts.launch or opts.list or opts.pick):
+        run_gui()
+        return
+
+    # TODO: Decide on a name for the project and rename "src"
+    from src.library.index import DEFAULT_INDEX_PATH, GameIndex
+    try:
+        index = GameIndex(opts.index or DEFAULT_INDEX_PATH)
+    except (IOError, OSError, ValueError) as err:
+        parser.error("Could not read the game index (%s). Run a scan first."
+                     % err)
+
+    if opts.pick:
+        opts.launch = pick_game(parser, opts.pick)
+
+    if opts.list:
+        for record in index.match(opts.match):
+            print(record.name)
+        return
+
+    matches = index.lookup(opts.launch)
+    if not matches:
+        parser.error("No game matches %r" % opts.launch)
+    elif len(matches) > 1:
+        print("Ambiguous name. Matching games:\n\t%s" % '\n\t'.join(
+            x.name for x in matches), file=sys.stderr)
+        sys.exit(2)
+    exec_record(matches[0])
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,525 @@
+"""Resident library daemon and its client
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+One process owns scanning, the library store, filesystem watching, and the
+children of launched games so frontends (and things like a Launchy-style
+resident launcher) can start in milliseconds against a warm library.
+
+Protocol
+========
+
+Messages in both directions are UTF-8 JSON objects, each preceded by its
+length as a 4-byte big-endian unsigned integer, over a C{SOCK_STREAM} Unix
+domain socket. Every request is a C{{"cmd": ..., <arguments>}} object and
+gets exactly one response, in order:
+
+ - C{{"ok": true, "result": ...}}
+ - C{{"ok": false, "error": "..."}}
+
+Commands:
+
+ - C{ping}: Returns C{"pong"}
+ - C{list}: Returns every visible entry
+ - C{search} (C{query}, optional C{limit}): Returns the best matches,
+   best first (See L{src.library.search})
+ - C{get} (C{identity}): Returns one entry
+ - C{launch} (C{identity}, optional C{argv}): Runs the default (or the
+   given) launcher and returns its PID
+ - C{rescan}: Forces a full rescan and returns the new entry count
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import errno, json, logging, os, socket, struct, time
+
+try:
+    import selectors
+except ImportError:  # Python < 3.4
+    import selectors34 as selectors  # pylint: disable=import-error
+
+from .game_providers.common import GameLauncher, InstalledGameEntry
+from .game_providers.watch import IncrementalScanner
+from .library.index import DEFAULT_INDEX_PATH, write_index
+from .library.search import SearchIndex, entry_keywords
+from .library.sessions import SessionTracker
+from .library.store import LibraryStore
+from .util.executables import Roles
+from .util.prefetch import Prefetcher
+from .util.supervisor import Supervisor
+
+log = logging.getLogger(__name__)
+
+# TODO: Move this and most other constants to a config.py for visibility
+SOCKET_PATH = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+    'game_launcher-%d.sock' % os.getuid())
+
+HEADER = struct.Struct(str('!I'))
+MAX_MESSAGE = 16 * 1024 * 1024
+
+# Stop reading requests from a client once this many bytes of responses
+# are waiting for it to read them
+MAX_PENDING_OUTPUT = 2 * MAX_MESSAGE
+
+# How long the main loop may sleep when nothing else needs attention
+IDLE_TIMEOUT = 1.0
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a malformed or oversized frame"""
+
+class DaemonError(Exception):
+    """Raised when a request fails (and re-raised by L{DaemonClient})"""
+
+def encode_message(obj):
+    """Serialize an object into a length-prefixed frame"""
+    payload = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    if len(payload) > MAX_MESSAGE:
+        raise ProtocolError("Message too large (%d bytes)" % len(payload))
+    return HEADER.pack(len(payload)) + payload
+
+def decode_messages(buf):
+    """Extract every complete frame from the start of a bytearray.
+
+    Consumed bytes are removed from C{buf} in place.
+
+    @returns: A list of decoded objects.
+    @raises ProtocolError: On an oversized frame or invalid JSON.
+    """
+    messages = []
+    while len(buf) >= HEADER.size:
+        length = HEADER.unpack(bytes(buf[:HEADER.size]))[0]
+        if length > MAX_MESSAGE:
+            raise ProtocolError("Frame too large (%d bytes)" % length)
+        if len(buf) < HEADER.size + length:
+            break
+        payload = bytes(buf[HEADER.size:HEADER.size + length])
+        del buf[:HEADER.size + length]
+        try:
+            messages.append(json.loads(payload.decode('utf-8')))
+        except ValueError as err:
+            raise ProtocolError("Invalid message: %s" % err)
+    return messages
+
+def entry_to_dict(entry):
+    """Return a JSON-serializable representation of a L{GameEntry}"""
+    return {
+        'identity': getattr(entry, 'identity', None),
+        'name': entry.name,
+        'icon': entry.icon,
+        'description': entry.description,
+        'providers': sorted(entry.provider),
+        'base_path': entry.base_path,
+        'missing_libs': entry.missing_libs,
+        'commands': [{
+            'name': cmd.name,
+            'argv': cmd.argv,
+            'role': int(cmd.role),
+            'provider': cmd.provider,
+            'path': cmd.path,
+            'use_terminal': bool(cmd.use_terminal),
+        } for cmd in entry.commands],
+    }
+
+def entry_from_dict(data):
+    """Rebuild an L{InstalledGameEntry} from L{entry_to_dict}'s output
+
+    (As used by frontends getting their library from the daemon)
+    """
+    entry = InstalledGameEntry(
+        name=data['name'], icon=data['icon'],
+        description=data['description'], base_path=data['base_path'],
+        commands=[GameLauncher(name=x['name'], argv=x['argv'],
+                               role=Roles(x['role']), provider=x['provider'],
+                               path=x['path'], use_terminal=x['use_terminal'])
+                  for x in data['commands']])
+    entry.identity = data['identity']
+    entry.missing_libs = data['missing_libs']
+    return entry
+
+def _search_key(entry):
+    """Return what L{SearchIndex} indexes an entry by, to tell whether a
+    rescanned entry needs re-indexing
+    """
+    return entry.name, entry_keywords(entry)
+
+class _Connection(object):
+    """Buffers for one client connection"""
+    __slots__ = ('inbuf', 'outbuf')
+
+    def __init__(self):
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+class LibraryDaemon(object):
+    """Single-threaded server owning the scanner, store, and game processes
+
+    Responses are queued per connection and written as the socket becomes
+    writable, so a client which stops reading can't stall the others.
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH, scanner=None, store=None,
+                 index_path=DEFAULT_INDEX_PATH):
+        """
+        @param index_path: Where to keep the L{src.library.index} file
+            up to date for C{game_launcher.py --launch}. (C{None} to skip)
+        """
+        self.socket_path = socket_path
+        self.index_path = index_path
+        self.scanner = scanner or IncrementalScanner()
+        self.store = store or LibraryStore()
+        self.supervisor = Supervisor()
+        self.tracker = SessionTracker(self.store)
+        self.prefetcher = Prefetcher()
+
+        self.entries = []
+        self._by_identity = {}
+        self.search_index = SearchIndex()
+        self._indexed = {}  # Identity -> the entry search_index holds for it
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._running = False
+        self._next_session_poll = 0
+
+    def _refresh(self, games=None):
+        """Rebuild the visible entry list from the scanner's results"""
+        start = time.time()
+        games = self.scanner.games if games is None else games
+        self.store.save_scan(games)
+        self.entries = self.store.apply_overrides(games)
+        self._by_identity = dict((x.identity, x) for x in self.entries
+                                 if getattr(x, 'identity', None))
+        self._update_search()
+        if self.index_path:
+            write_index(self.entries, self.index_path)
+        log.info("Library holds %d entries (refreshed in %.3fs)",
+                 len(self.entries), time.time() - start)
+
+    def _update_search(self):
+        """Bring L{search_index} up to date with L{entries}
+
+        Only entries which were added, removed, or renamed (or whose
+        keywords changed) are re-indexed, so a rescan which found one new
+        game costs one L{SearchIndex.add}. (The index may hold an older
+        copy of an unchanged entry, so results are looked up by identity.)
+        """
+        if not self._indexed:
+            self._indexed = dict(self._by_identity)
+            self.search_index = SearchIndex(self._indexed.values(),
+                                            self.store.get_last_played())
+            return
+
+        for identity, old in list(self._indexed.items()):
+            new = self._by_identity.get(identity)
+            if new is None or _search_key(new) != _search_key(old):
+                self.search_index.remove(old)
+                del self._indexed[identity]
+        for identity, new in self._by_identity.items():
+            if identity not in self._indexed:
+                self.search_index.add(new)
+                self._indexed[identity] = new
+
+    def listen(self):
+        """Perform the initial scan and start accepting connections
+
+        @raises socket.error: If another daemon is already listening.
+        """
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error:
+                os.unlink(self.socket_path)  # Stale socket from a crash
+            else:
+                probe.close()
+                raise socket.error(errno.EADDRINUSE, "Daemon already running")
+
+        self._refresh(self.scanner.scan())
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self._listener.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self._listener.listen(16)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ, None)
+
+        inotify = getattr(self.scanner.watcher, 'inotify', None)
+        if inotify:
+            self._selector.register(inotify.fileno(), selectors.EVENT_READ,
+                                    'watch')
+        self._running = True
+
+    def serve_forever(self):
+        """Run the main loop until L{stop} is called"""
+        if not self._listener:
+            self.listen()
+        try:
+            while self._running:
+                self.serve_once()
+        finally:
+            self.close()
+
+    def serve_once(self, timeout=None):
+        """Run one iteration of the main loop"""
+        if timeout is None:
+            timeout = 0.1 if self.supervisor.children else IDLE_TIMEOUT
+            if self.tracker.sessions:
+                timeout = min(timeout, max(0, self._next_session_poll -
+                                           time.time()))
+
+        for key, events in self._selector.select(timeout):
+            if key.data is None:
+                self._accept()
+            elif key.data != 'watch':
+                if events & selectors.EVENT_WRITE:
+                    self._write(key.fileobj, key.data)
+                if (events & selectors.EVENT_READ and
+                        key.fileobj.fileno() != -1):
+                    self._read(key.fileobj, key.data)
+
+        # Also handles the polled (network mount) part of the watcher
+        if self.scanner.wait(0):
+            self._refresh()
+
+        self.supervisor.poll()
+        if self.tracker.sessions and time.time() >= self._next_session_poll:
+            self.tracker.poll()
+            self._next_session_poll = time.time() + self.tracker.interval
+
+    def stop(self):
+        """Ask L{serve_forever} to return after the current iteration"""
+        self._running = False
+
+    def close(self):
+        """Close all connections and remove the socket"""
+        for key in list(self._selector.get_map().values()):
+            if key.data not in (None, 'watch'):
+                key.fileobj.close()
+        self._selector.close()
+        if self._listener:
+            self._listener.close()
+            self._listener = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _accept(self):
+        """Accept a new client connection"""
+        try:
+            conn, _ = self._listener.accept()
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        conn.setblocking(False)
+        self._selector.register(conn, selectors.EVENT_READ, _Connection())
+
+    def _disconnect(self, conn):
+        """Drop a client connection"""
+        self._selector.unregister(conn)
+        conn.close()
+
+    def _update_events(self, conn, state):
+        """Wait for writability only while output is pending, and stop
+        reading new requests while too much of it is.
+        """
+        events = selectors.EVENT_READ
+        if state.outbuf:
+            events |= selectors.EVENT_WRITE
+            if len(state.outbuf) > MAX_PENDING_OUTPUT:
+                events = selectors.EVENT_WRITE
+        if self._selector.get_key(conn).events != events:
+            self._selector.modify(conn, events, state)
+
+    def _write(self, conn, state):
+        """Send as much pending output to a client as it will accept"""
+        try:
+            sent = conn.send(state.outbuf)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._disconnect(conn)
+            return
+        del state.outbuf[:sent]
+        self._update_events(conn, state)
+
+    def _read(self, conn, state):
+        """Read from a client and queue answers to any complete requests"""
+        try:
+            data = conn.recv(65536)
+        except socket.error as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+        if not data:
+            self._disconnect(conn)
+            return
+
+        state.inbuf.extend(data)
+        try:
+            requests = decode_messages(state.inbuf)
+        except ProtocolError as err:
+            log.warning("Dropping client: %s", err)
+            self._disconnect(conn)
+            return
+
+        for request in requests:
+            try:
+                state.outbuf.extend(encode_message(self.handle(request)))
+            except ProtocolError as err:
+                state.outbuf.extend(encode_message(
+                    {'ok': False, 'error': str(err)}))
+        if state.outbuf:
+            self._write(conn, state)
+
+    def handle(self, request):
+        """Answer a single decoded request with a response object"""
+        try:
+            handler = getattr(self, 'cmd_' + str(request.get('cmd')), None)
+            if not handler:
+                raise DaemonError("Unknown command: %s" % request.get('cmd'))
+            args = dict((str(k), v) for k, v in request.items()
+                        if k != 'cmd')
+            return {'ok': True, 'result': handler(**args)}
+        except (DaemonError, TypeError, KeyError) as err:
+            return {'ok': False, 'error': str(err)}
+        except Exception as err:  # pylint: disable=broad-except
+            log.exception("Error while handling %r", request)
+            return {'ok': False, 'error': "Internal error: %s" % err}
+
+    def _get_entry(self, identity):
+        """Look up an entry by identity or raise L{DaemonError}"""
+        entry = self._by_identity.get(identity)
+        if not entry:
+            raise DaemonError("No such entry: %s" % identity)
+        return entry
+
+    @staticmethod
+    def cmd_ping():
+        """Check that the daemon is alive"""
+        return 'pong'
+
+    def cmd_list(self):
+        """Return every visible entry"""
+        return [entry_to_dict(x) for x in self.entries]
+
+    def cmd_search(self, query, limit=50):
+        """Return the best matches for C{query}, best first
+
+        @param limit: Maximum results to return (C{None} for all)
+        """
+        return [entry_to_dict(self._by_identity[x.identity])
+                for x in self.search_index.search(query, limit)]
+
+    def cmd_get(self, identity):
+        """Return a single entry"""
+        return entry_to_dict(self._get_entry(identity))
+
+    def cmd_launch(self, identity, argv=None):
+        """Launch an entry's default (or specified) launcher"""
+        entry = self._get_entry(identity)
+        cmd = entry.default_launcher
+        if argv:
+            cmd = ([x for x in entry.commands if x.argv == argv] + [None])[0]
+        if not cmd:
+            raise DaemonError("No usable launcher for %s" % entry.name)
+
+        try:
+            pid = cmd.run(self.supervisor, self.prefetcher,
+                          entry.base_path)
+        except OSError as err:
+            raise DaemonError("Could not launch %s: %s" % (entry.name, err))
+        if not self.tracker.sessions:
+            self._next_session_poll = time.time() + self.tracker.interval
+        session = self.tracker.track(entry, pid)
+        if entry.identity in self._indexed:
+            self.search_index.touch(self._indexed[entry.identity],
+                                    session.started)
+        return pid
+
+    def cmd_rescan(self):
+        """Force a full rescan"""
+        self._refresh(self.scanner.scan())
+        return len(self.entries)
+
+class DaemonClient(object):
+    """Blocking client for L{LibraryDaemon}"""
+
+    def __init__(self, socket_path=SOCKET_PATH, timeout=30):
+        """
+        @raises socket.error: If no daemon is listening.
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self._buf = bytearray()
+
+    def close(self):
+        """Close the connection"""
+        self.sock.close()
+
+    def request(self, cmd, **args):
+        """Send a request and wait for its result
+
+        @raises DaemonError: If the daemon reports an error.
+        """
+        args['cmd'] = cmd
+        self.sock.sendall(encode_message(args))
+        while True:
+            messages = decode_messages(self._buf)
+            if messages:
+                response = messages[0]
+                break
+            data = self.sock.recv(65536)
+            if not data:
+                raise ProtocolError("Daemon closed the connection")
+            self._buf.extend(data)
+
+        if not response.get('ok'):
+            raise DaemonError(response.get('error'))
+        return response.get('result')
+
+    def ping(self):
+        """Check that the daemon is alive"""
+        return self.request('ping')
+
+    def list(self):
+        """Return every visible entry as a dict"""
+        return self.request('list')
+
+    def search(self, query, limit=50):
+        """Return the best matches for C{query} as dicts, best first"""
+        return self.request('search', query=query, limit=limit)
+
+    def get(self, identity):
+        """Return one entry as a dict"""
+        return self.request('get', identity=identity)
+
+    def launch(self, identity, argv=None):
+        """Launch an entry and return the PID"""
+        return self.request('launch', identity=identity, argv=argv)
+
+    def rescan(self):
+        """Force a full rescan and return the new entry count"""
+        return self.request('rescan')
+
+# vim: set sw=4 sts=4 expandtab :
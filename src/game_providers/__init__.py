@@ -3,7 +3,7 @@
 __author__ = "Stephan Sokolow (deitarion/SSokolow)"
 __license__ = "GNU GPL 3.0 or later"
 
-import logging
+import logging, sys
 from itertools import chain
 
 from . import desura, fallback, playonlinux, scummvm, residualvm, xdg_menu
@@ -20,14 +20,35 @@ PROVIDERS = [xdg_menu, desura, scummvm, residualvm, playonlinux, fallback]
 #       standards for explaining what inputs they ignored and why when
 #       at debug-level logging (in case of false negatives).
 
-# TODO: This only performs acceptably with a warm cache. Rework it as a
-#       generator so we can display a visual progress indication.
-def get_games():
-    """Use all available backends to retrieve a deduplicated list of games"""
+def instrument(profiler, providers=None):
+    """Patch all providers and fallback sub-plugins to report to C{profiler}
+
+    (The patches are undone when the L{Profiler}'s context exits.)
+
+    @type profiler: L{src.util.profiling.Profiler}
+    """
+    for provider in PROVIDERS if providers is None else providers:
+        name = provider.__name__.split('.')[-1]
+        profiler.patch(provider, 'get_games', name, 'entries')
+
+        if hasattr(provider, 'SUBPLUGINS'):
+            profiler.patch(provider, 'gather_candidates',
+                           name + '.gather_candidates', 'candidates')
+            for subplugin in provider.SUBPLUGINS:
+                profiler.patch(subplugin, 'inspect', '%s.%s' % (
+                    name, subplugin.__name__.split('.')[-1]), 'matches')
+    profiler.patch(sys.modules[__name__], 'merge_entries', 'merge', 'entries')
+
+def merge_entries(entries):
+    """Filter and deduplicate raw entries from one or more backends.
+
+    @note: Entries are merged in place, so callers which need to merge the
+        same raw results more than once should pass in copies.
+    """
     results_raw, results = [], []
 
     # Get raw results
-    for entry in sorted(chain(*[x.get_games() for x in PROVIDERS])):
+    for entry in sorted(entries):
         if not entry.is_executable():
             log.info("Skipping entry %s from %s. Not executable:\n\t%s",
                      entry,
@@ -56,3 +77,43 @@ def get_games():
                 break
 
     return results
+
+def _iter_raw():
+    """Yield lists of raw entries: first everything from the providers
+    which can't stream, then each phase from the ones which can.
+    """
+    yield list(chain(*[x.get_games() for x in PROVIDERS
+                       if not hasattr(x, 'iter_games')]))
+    for provider in PROVIDERS:
+        if hasattr(provider, 'iter_games'):
+            for entries in provider.iter_games():
+                yield entries
+
+def iter_games():
+    """Like L{get_games} but yields results as each batch comes in, so
+    games on fast disks can be shown while slow ones are still being
+    scanned. (See L{fallback.iter_games})
+
+    Later results which duplicate earlier ones are merged into the earlier
+    entry in place, so each yielded list holds the entries which are new
+    I{or} have changed since the previous one.
+    """
+    seen = []  # TODO: Share merge_entries()'s eventual non-O(n^2) redesign
+    for raw in _iter_raw():
+        changed, changed_ids = [], set()
+        for entry in merge_entries(raw):
+            for existing in seen:
+                if existing == entry:
+                    existing.update(entry)
+                    entry = existing
+                    break
+            else:
+                seen.append(entry)
+            if id(entry) not in changed_ids:
+                changed_ids.add(id(entry))
+                changed.append(entry)
+        yield changed
+
+def get_games():
+    """Use all available backends to retrieve a deduplicated list of games"""
+    return merge_entries(chain(*[x.get_games() for x in PROVIDERS]))
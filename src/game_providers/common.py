@@ -19,7 +19,7 @@ from __future__ import (absolute_import, division, print_function,
 __author__ = "Stephan Sokolow (deitarion/SSokolow)"
 __license__ = "GNU GPL 3.0 or later"
 
-import errno, logging, os, subprocess, sys
+import copy, errno, logging, os, subprocess, sys
 from functools import total_ordering
 
 from ..util.common import which
@@ -50,11 +50,32 @@ class GameEntry(object):
 
     base_path = None
 
+    # User overrides (See L{src.library.store.LibraryStore.apply_overrides})
+    hidden = False
+    default_argv = None
+
+    # Sonames the default launcher can't load (None if unchecked/uncheckable)
+    missing_libs = None
+
+    # Derived values like the summary are cached here (See L{invalidate})
+    _cache = None
+
     # pylint: disable=too-many-arguments
     def __init__(self, name, icon=None, provider=None, description=None,
-                 commands=None, *args, **kwargs):
+                 commands=None, game_id=None, provider_id=None,
+                 *args, **kwargs):
+        """
+        @param game_id: An ID which is stable across providers and
+            reinstalls (eg. the C{PACKAGE_NAME} from a GOG.com C{start.sh})
+        @param provider_id: A provider-qualified ID which is only meaningful
+            to the provider that produced this entry.
+            (eg. C{ScummVM:monkey1})
+        """
+        self._cache = {}
         self.name = name
         self.icon = icon
+        self.game_id = game_id
+        self.provider_id = provider_id
         self._provider = provider or []
         self._description = description
         self.commands = commands or []
@@ -80,20 +101,71 @@ class GameEntry(object):
         """@todo: Make this read out the subentries too"""
         return "<%s (%s)>" % (self.name, ', '.join(self.provider))
 
+    @property
+    def name(self):
+        """The display name (Setting it invalidates cached values)"""
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+        self._cache = {}
+
+    def invalidate(self):
+        """Discard the cached derived values (L{provider}, L{categories},
+        L{description}, and L{summarize}) after modifying an entry or its
+        commands in place.
+
+        (L{update}, L{check_libraries}, and renames call this for you.)
+        """
+        self._cache = {}
+
+    def _cached(self, key, func):
+        """Return C{func()}, memoized under C{key} until L{invalidate}"""
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = func()
+            return value
+
+    def copy(self):
+        """Return a copy which can be merged without altering this entry."""
+        result = copy.copy(self)
+        result.commands = list(self.commands)
+        result._provider = set(self._provider)  # pylint: disable=W0212
+        result._cache = {}  # pylint: disable=W0212
+        return result
+
     @property
     def default_launcher(self):
         """A property returning a launcher safe for double-click triggering"""
         # TODO: ".sh" files should be preferred over extensionless ones.
         # TODO: An extensionless file should be preferred over that same name
         #       with a .x86 or .x86_64 extension.
+        if self.default_argv:
+            for cmd in self.commands:
+                if cmd.argv == self.default_argv and cmd.is_executable():
+                    return cmd
         return self.first_launcher(Roles.play, True)
 
     @property
     def description(self):
         """Make a best effort to return a description for this entry."""
-        return self._description or ([x.description
-                                      for x in self.commands
-                                      if x.description] + [None])[0]
+        return self._cached('description', lambda: self._description or (
+            [x.description for x in self.commands if x.description] +
+            [None])[0])
+
+    def check_libraries(self, checker):
+        """Check the default launcher for missing shared libraries.
+
+        @param checker: A L{src.util.elf.DependencyChecker}
+        @returns: The new value of L{missing_libs}
+        """
+        cmd = self.default_launcher
+        self.missing_libs = (checker.check_launcher(cmd.argv, self.base_path)
+                             if cmd else None)
+        self.invalidate()
+        return self.missing_libs
 
     def first_launcher(self, role=None, fallback_unknown=False):
         """Get the first usable launcher matching the specified role."""
@@ -116,15 +188,25 @@ class GameEntry(object):
     @property
     def provider(self):
         """Deduce the provider list from the commands"""
-        return self._provider.union(x.provider for x in self.commands
-                                    if x.provider)
+        return self._cached('provider', lambda: frozenset(
+            self._provider.union(x.provider for x in self.commands
+                                 if x.provider)))
 
     def summarize(self):
         """Return all human-relevant metadata in formatted plaintext form
 
+        (Cached, since GUIs call this for every tooltip and redraw.)
+
         @todo: Fix Don't Starve's description
         """
+        return self._cached('summary', self._summarize)
+
+    def _summarize(self):
+        """Uncached implementation of L{summarize}"""
         lines = ["%s (%s)" % (self.name, ', '.join(self.provider))]
+        if self.missing_libs:
+            lines.extend(('', 'Missing libraries: ' +
+                          ', '.join(self.missing_libs)))
         if self.description and self.description != self.name:
             lines.extend(('', self.description))
         if any(x for x in self.categories if x != 'Game'):
@@ -136,7 +218,7 @@ class GameEntry(object):
     def update(self, other):
         """Merge in metadata from another entry object."""
         # TODO: Check for common subset of the name and dedupe
-        for name in ('icon', 'provider', '_description'):
+        for name in ('icon', '_description', 'game_id', 'provider_id'):
             if hasattr(other, name) and not getattr(self, name, None):
                 setattr(self, name, getattr(other, name))
 
@@ -150,7 +232,7 @@ class GameEntry(object):
                 self.name = name_prefix.rstrip(' -:([<')
         # TODO: Now strip common prefixes from the subentry names
 
-        self.provider.update(other.provider)
+        self._provider.update(other.provider)
 
         # TODO: Make this no longer O(n^2)
         # TODO: Prefer run.sh over bare commands
@@ -158,12 +240,14 @@ class GameEntry(object):
         for command in other.commands:
             if not any(x.argv == command.argv for x in self.commands):
                 self.commands.append(command)
+        self.invalidate()
 
     # TODO: Rename to categories and allow non-launcher content like providers?
     @property
     def categories(self):
-        """Deduce the provider list from the commands"""
-        return [cat for cats in self.commands for cat in cats]
+        """Deduce the category list from the commands"""
+        return self._cached('categories', lambda: [
+            cat for cmd in self.commands for cat in cmd.categories])
 
 @total_ordering
 class InstalledGameEntry(GameEntry):
@@ -175,18 +259,30 @@ class InstalledGameEntry(GameEntry):
            install directories, and the like as deduplication keys.
     """
 
-    def __init__(self, base_path, **kwargs):
+    def __init__(self, base_path, aliases=(), **kwargs):
+        """
+        @param aliases: Other paths the same install folder was found at
+            (eg. via symlinks or bind mounts) so entries for it can be
+            merged by physical identity.
+        """
         super(InstalledGameEntry, self).__init__(**kwargs)
 
         # TODO: Apply COMMON_DIRS filtering here so it's unified
         # XXX: What if multiple copies are installed? Allow a list?
         if base_path:
             self.base_path = os.path.normcase(os.path.abspath(base_path))
+        self.aliases = set(os.path.normcase(os.path.abspath(x))
+                           for x in aliases)
+
+    @property
+    def paths(self):
+        """The base path (if any) and all of its aliases"""
+        return self.aliases | set([self.base_path] if self.base_path else [])
 
     def __eq__(self, other):
         """@todo: Make this more discerning"""
         if (self.base_path and other.base_path and
-            self.base_path == other.base_path):
+                self.paths & getattr(other, 'paths', set([other.base_path]))):
             return True
 
         argv_match = False
@@ -200,9 +296,21 @@ class InstalledGameEntry(GameEntry):
         """Make a best effort to return a description for this entry.
 
         @todo: Decide whether I should filter for Roles.play and then merge."""
-        return self._description or ([x.categories
-                                      for x in self.commands
-                                      if x.categories] + [[]])[0]
+        return self._cached('categories', lambda: self._description or (
+            [x.categories for x in self.commands if x.categories] +
+            [[]])[0])
+
+    def copy(self):
+        """Return a copy which can be merged without altering this entry."""
+        result = super(InstalledGameEntry, self).copy()
+        result.aliases = set(self.aliases)
+        return result
+
+    def update(self, other):
+        """Merge in metadata (and alternate paths) from another entry."""
+        super(InstalledGameEntry, self).update(other)
+        self.aliases.update(getattr(other, 'paths', ()))
+        self.aliases.discard(self.base_path)
 
 
 # --- Subentry Classes ---
@@ -321,8 +429,18 @@ class GameLauncher(GameSubentry):
             return False
         return bool(which(self.argv[0]))
 
-    def run(self):
-        """Launch this entry as a subprocess using the contained metadata"""
+    def run(self, supervisor=None, prefetcher=None, base_path=None):
+        """Launch this entry as a subprocess using the contained metadata
+
+        @param supervisor: A L{src.util.supervisor.Supervisor} to capture
+            the game's output and report its exit status. If omitted, the
+            process is simply spawned and forgotten.
+        @param prefetcher: A L{src.util.prefetch.Prefetcher} to warm the
+            page cache with the game's files while it starts up.
+        @param base_path: The install folder of the entry this launcher
+            belongs to. Only files inside it are prefetched.
+        @returns: The new process's PID
+        """
         # Work around things like Desura expecting Windows-style PWD behaviour
         if not self.path:
             self.path = os.path.dirname(which(self.argv[0]))
@@ -330,22 +448,27 @@ class GameLauncher(GameSubentry):
                 log.error("Failed to generate valid $PWD (%s)", self.path)
                 self.path = None
 
-        argv = self.argv
-        if self.use_terminal:
-            argv = TERMINAL_CMD + argv
+        if prefetcher:
+            prefetcher.request(which(self.argv[0]), base_path)
+
+        def spawn(argv):
+            """Spawn via the supervisor if we have one"""
+            if self.use_terminal:
+                argv = TERMINAL_CMD + argv
+            if supervisor:
+                return supervisor.spawn(self.name, argv, cwd=self.path).pid
+            return subprocess.Popen(argv, cwd=self.path).pid
 
         log.info("Spawning %r with cwd=%r", self.argv, self.path)
         try:
-            return subprocess.Popen(self.argv, cwd=self.path).pid
-            # TODO: Rework so I can capture output and display it on unclean
-            #       exit (eg. error while loading shared libraries: ...)
+            return spawn(self.argv)
         except OSError as err:
             if err.errno != errno.ENOEXEC:
                 raise
             if not self.argv[0].endswith('.sh'):
                 raise
-            with file(self.argv[0]) as fobj:
-                if fobj.read(2) == '#!':
+            with open(self.argv[0], 'rb') as fobj:
+                if fobj.read(2) == b'#!':
                     raise
             # If we reach here, it's a shellscript with no shebang
-            return subprocess.Popen(['/bin/sh'] + self.argv, cwd=self.path).pid
+            return spawn(['/bin/sh'] + self.argv)
@@ -30,6 +30,9 @@ from .common import InstalledGameEntry, GameLauncher
 DESURA_DB = os.path.expanduser('~/.desura/iteminfo_d.sqlite')
 BACKEND_NAME = "Desura"
 
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = [DESURA_DB]
+
 def get_games():
     """Retrieve a list of games from the Desura client's data store.
 
@@ -58,8 +61,9 @@ def get_games():
             role = Roles.unknown
 
         if row[0] not in entries:
-            entries[row[0]] = InstalledGameEntry(name=row[1], icon=row[3],
-                                                 base_path=row[10])
+            entries[row[0]] = InstalledGameEntry(
+                name=row[1], icon=row[3], base_path=row[10],
+                provider_id="%s:%s" % (BACKEND_NAME, row[0]))
 
         # TODO: Inspect base_path to see if the game has a higher-resolution
         #       icon than Desura's cached version.
@@ -18,6 +18,19 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+Roots are scanned according to their L{RootPolicy} in L{ROOTS}: local
+roots first, in parallel, and then each removable or networked root that's
+currently mounted, with throttled I/O. (See L{iter_games}) Root-level
+filesystem calls go through a L{Prober} so a dead network mount costs a
+bounded delay and then its last known results are used until it recovers.
+
+Candidates are identified by C{(st_dev, st_ino)} so an install reachable by
+more than one path (eg. C{~/opt/foo} symlinked into C{/mnt/buffalo_ext})
+is only inspected once, with the other paths recorded as its aliases.
+
+Each candidate is only run through the sub-plugins whose marker files it
+contains (plus L{guesser}, which is the catch-all). See L{dispatch}.
+
 @todo: Some kind of (path, size, ctime)-backed analogue to If-Modified-Since
 """
 
@@ -27,12 +40,24 @@ from __future__ import (absolute_import, division, print_function,
 __author__ = "Stephan Sokolow (deitarion/SSokolow)"
 __license__ = "GNU GPL 3.0 or later"
 
-import logging, os
-from ...util.common import multiglob_compile
+import logging, os, time
+from collections import deque
+
+try:
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+except ImportError:  # Python 2.x without the "futures" backport
+    ThreadPoolExecutor = None
+
+from ...util import profiling
+from ...util.blacklist import BlacklistFile, compile_globs
+from ...util.fswatch import get_mounts
 from ...util.naming import filename_to_name
+from ...util.probing import ProbeError, Prober
 from ..common import InstalledGameEntry
 
 from . import gog, ssokolow_install_sh, guesser
+from .dispatch import SubpluginIndex
+from .roots import MAX_DEPTH, RootPolicy, RootRegistry
 
 # Placeholders for user-specified values which should be stored in the database
 # TODO: Some kind of "If it's in /usr/games, default to Terminal=true" rule
@@ -46,70 +71,357 @@ BLACKLIST = [
     '*/firefox',  # TODO: Include */firefox[_-]*
 ]
 
+# Extra globs (one per line) which the user can add without editing BLACKLIST
+# TODO: Move this and DATA_DIR to a config.py for visibility
+BLACKLIST_PATH = os.path.join(os.environ.get('XDG_CONFIG_HOME',
+                                             os.path.expanduser('~/.config')),
+                              'game_launcher', 'blacklist')
+USER_BLACKLIST = BlacklistFile(BLACKLIST_PATH, BLACKLIST)
+
+# Candidates are inspected on a pool of this many threads, since on a
+# high-latency mount the scan is almost all waiting...
+MAX_WORKERS = 8
+
+# ...but each root's policy limits how many at once come from it, so a
+# slow mount can't monopolize the pool or be swamped with requests
+# TODO: Store these in the database along with GAMES_DIRS
+ROOTS = RootRegistry([
+    RootPolicy('/mnt/buffalo_ext/games', removable=True,
+               mount_point='/mnt/buffalo_ext'),
+])
+
+# How long listing a healthy root's candidates may take (seconds)
+# (Short enough to notice a mount dying mid-scan, but not a big folder on a
+#  slow network. The initial isdir() check uses the Prober's own timeout.)
+LIST_TIMEOUT = 10
+
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = GAMES_DIRS
+
+# Sub-plugins to try on each candidate, in descending priority order
+SUBPLUGINS = (gog, ssokolow_install_sh, guesser)
+
+# ...though only the ones whose marker files a candidate contains are tried
+SUBPLUGIN_INDEX = SubpluginIndex(SUBPLUGINS)
+
 # Files which shouldn't require +x to be considered for inclusion
 # (SWF really doesn't need +x while top-level -x JAR files should be noticed)
 EXEC_EXCEPTIONS = ('.swf', '.jar')
 
 log = logging.getLogger(__name__)
 
-def gather_candidates(path, blacklist=BLACKLIST):  # pylint: disable=W0102
+def is_candidate(fpath, blacklist_re):
+    """Return C{True} if C{fpath} passes the stage one pre-filter.
+
+    @param blacklist_re: Anything with a C{match(path)} method, such as a
+        L{src.util.blacklist.GlobMatcher}.
+    """
+    fname = os.path.basename(fpath)
+
+    # Skip hidden files and directories
+    if fname.startswith('.'):
+        log.debug("Skipped hidden file/folder: %s", fpath)
+        return False
+
+    # Skip blacklisted paths
+    if blacklist_re.match(fpath):
+        log.debug("Skipped blacklisted path: %s", fpath)
+        return False
+
+    # Directories get a free pass to stage two
+    if os.path.isdir(fpath):
+        log.debug("Directories are automatically accepted: %s", fpath)
+        return True
+
+    # Skip non-executable files that need +x to be potential games
+    if not os.access(fpath, os.X_OK):
+        if not os.path.splitext(fpath)[1].lower() in EXEC_EXCEPTIONS:
+            return False
+    return True
+
+def _blacklist_matcher(blacklist=None):
+    """Return the cached matcher for C{blacklist} (or L{USER_BLACKLIST})"""
+    if blacklist is None:
+        return USER_BLACKLIST.matcher()
+    return compile_globs(blacklist)
+
+def gather_candidates(path, blacklist=None, follow_symlinks=True):
     """C{os.listdir()} the contents of a folder and filter for potential games.
 
     This is essentially a pre-filter to eliminate things which cannot be games
     as quickly and in as lightweight a manner as possible.
+
+    @param blacklist: Globs to skip. (Defaults to L{BLACKLIST} plus the
+        contents of L{BLACKLIST_PATH}.)
+    @param follow_symlinks: If C{False}, skip symlinked candidates.
     """
     candidates = set()
     if not os.path.isdir(path):
         return candidates
 
-    blacklist_re = multiglob_compile(blacklist, prefix=True)
+    blacklist_re = _blacklist_matcher(blacklist)
     for fname in os.listdir(path):
         fpath = os.path.join(path, fname)
+        if not follow_symlinks and os.path.islink(fpath):
+            log.debug("Skipped symlink: %s", fpath)
+        elif is_candidate(fpath, blacklist_re):
+            candidates.add(fpath)
+    return candidates
 
-        # Skip hidden files and directories
-        if fname.startswith('.'):
-            log.debug("Skipped hidden file/folder: %s", fpath)
-            continue
+def candidate_for(path, roots=GAMES_DIRS):  # pylint: disable=W0102
+    """Map a path inside one of C{roots} to the candidate which contains it.
 
-        # Skip blacklisted paths
-        if blacklist_re.match(fpath):
-            log.debug("Skipped blacklisted path: %s", fpath)
-            continue
+    (Used to limit rescanning to the one install a filesystem change could
+     have affected.)
 
-        # Directories get a free pass to stage two
-        if os.path.isdir(fpath):
-            log.debug("Directories are automatically accepted: %s", fpath)
-            candidates.add(fpath)
-            continue
+    @returns: The candidate path or C{None} if C{path} isn't inside a root.
+    """
+    path = os.path.abspath(path)
+    for root in roots:
+        root = os.path.abspath(root)
+        if path.startswith(root.rstrip(os.sep) + os.sep):
+            return os.path.join(root, path[len(root):].lstrip(os.sep)
+                                .split(os.sep)[0])
+    return None
+
+def _run_subplugins(candidate, max_depth=MAX_DEPTH):
+    """Return an L{InstalledGameEntry} from the first matching sub-plugin.
+
+    @param max_depth: Passed on to sub-plugins with C{DESCENDS} set.
+    """
+    for subplugin in SUBPLUGIN_INDEX.subplugins_for(candidate):
+        if getattr(subplugin, 'DESCENDS', False):
+            result = subplugin.inspect(candidate, max_depth=max_depth)
+        else:
+            result = subplugin.inspect(candidate)
+        if result:
+            try:
+                return InstalledGameEntry(**result)
+            except TypeError:
+                print("TypeError for InstalledGameEntry(**%r)" % result)
+                raise
+
+    log.info("Fallback - <Unmatched>: %s",
+             filename_to_name(os.path.basename(candidate)))
+    return None
+
+def identify(paths):
+    """Pair each path with the C{(st_dev, st_ino)} it resolves to
+    (or C{None} if it can't be C{stat()}ed)
+    """
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            results.append((path, None))
+        else:
+            results.append((path, (stat.st_dev, stat.st_ino)))
+    return results
 
-        # Skip non-executable files that need +x to be potential games
-        if not os.access(fpath, os.X_OK):
-            if not os.path.splitext(fpath)[1].lower() in EXEC_EXCEPTIONS:
+def inspect_candidate(candidate, blacklist=None):
+    """Run a single candidate through the pre-filter and the sub-plugins.
+
+    @returns: An L{InstalledGameEntry} or C{None} if nothing was found or
+        C{candidate} is an alias for an install found at another path.
+    """
+    canonical = SCHEDULER.aliases.get(os.path.abspath(candidate))
+    if canonical and SCHEDULER.visited.get(
+            identify([candidate])[0][1]) == canonical:
+        log.debug("Not rescanning %s. Alias for %s", candidate, canonical)
+        return None
+
+    blacklist_re = _blacklist_matcher(blacklist)
+    if os.path.exists(candidate) and is_candidate(candidate, blacklist_re):
+        root = os.path.dirname(os.path.abspath(candidate))
+        return _run_subplugins(candidate, ROOTS.get(root).max_depth)
+    return None
+
+def _inspect_with(policy, candidate):
+    """Inspect one candidate according to its root's L{RootPolicy}"""
+    if policy.throttle:
+        time.sleep(policy.throttle)
+    return _run_subplugins(candidate, policy.max_depth)
+
+def inspect_all(queues, max_workers=MAX_WORKERS):
+    """Run candidates through the sub-plugins on a bounded thread pool.
+
+    Each root's candidates are fed to the pool by its own window of at most
+    C{policy.concurrency} in flight, refilled as they complete, so a slow
+    root holds up only its own share of the workers.
+
+    @param queues: A list of C{(policy, candidates)} pairs.
+    @returns: A list of lists of matching L{InstalledGameEntry} objects,
+        one per queue and in the order their candidates were given,
+        regardless of the order they completed in.
+    @raises Exception: The first (in candidate order) error raised by a
+        sub-plugin, once all other candidates have finished.
+    """
+    if ThreadPoolExecutor is None or max_workers < 2:
+        return [[x for x in (_inspect_with(policy, y) for y in candidates)
+                 if x] for policy, candidates in queues]
+
+    futures, in_flight = {}, {}  # candidate -> future, future -> queue
+    inspect_with = profiling.propagate(_inspect_with)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        def submit(policy, pending):
+            """Start the next candidate from one root's queue"""
+            candidate = pending.popleft()
+            futures[candidate] = future = pool.submit(inspect_with, policy,
+                                                      candidate)
+            in_flight[future] = (policy, pending)
+
+        for policy, candidates in queues:
+            pending = deque(candidates)
+            for _ in range(max(1, policy.concurrency)):
+                if pending:
+                    submit(policy, pending)
+
+        # Refill each root's window as its candidates finish
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                policy, pending = in_flight.pop(future)
+                if pending:
+                    submit(policy, pending)
+
+    return [[x for x in (futures[y].result() for y in candidates) if x]
+            for _, candidates in queues]
+
+class ScanScheduler(object):
+    """Decides which roots get scanned, in what order, and which can reuse
+    their previous results.
+
+    Roots which are unhealthy (their probes timed out) get their results
+    from the last successful scan instead, if there was one.
+
+    @ivar visited: C{{(st_dev, st_ino): path}} for each candidate inspected
+        by the latest scan.
+    @ivar aliases: C{{path: canonical path}} for each candidate which was
+        skipped because it was already visited by another path.
+    """
+
+    def __init__(self, registry=ROOTS, clock=time.time, prober=None):
+        self.registry = registry
+        self.clock = clock
+        self.prober = prober or Prober()
+        self._cache = {}  # Root path -> (scanned_at, entries)
+        self.visited, self.aliases, self._found = {}, {}, {}
+
+    def plan(self, roots, mounts=None):
+        """Split roots into phases to be scanned one after another:
+        all available local roots, then each available slow one.
+
+        Unhealthy roots are kept, as slow roots, so L{scan} can fall back to
+        their cached results.
+
+        @returns: A list of lists of L{RootPolicy} objects.
+        """
+        mounts = get_mounts() if mounts is None else mounts
+        fast, slow = [], []
+        for policy in self.registry.policies_for(roots, mounts):
+            try:
+                available = policy.is_available(mounts, self.prober)
+            except ProbeError:
+                slow.append([policy])
                 continue
 
-        candidates.add(fpath)
-    return candidates
+            if not available:
+                log.info("Skipping unavailable root: %s", policy.path)
+            elif policy.slow:
+                slow.append([policy])
+            else:
+                fast.append(policy)
+        return ([fast] if fast else []) + slow
 
-def get_games(roots=GAMES_DIRS):  # pylint: disable=dangerous-default-value
-    """List potential games by examining a set of /opt-like paths."""
-    candidates = set()
+    def _cached(self, policy, now, stale_ok=False):
+        """Return copies of a root's previous results if still fresh
+        (or at all, if C{stale_ok} is set)
+        """
+        scanned_at, entries = self._cache.get(policy.path, (None, None))
+        if entries is None or not stale_ok and (
+                policy.rescan_interval is None or
+                now - scanned_at >= policy.rescan_interval):
+            return None
+        # (merge_entries() modifies entries in place)
+        return [x.copy() for x in entries]
 
-    for root in set(os.path.abspath(x) for x in roots):
-        candidates.update(gather_candidates(root))
+    def _unvisited(self, candidates):
+        """Filter out (and record as aliases) already-visited candidates
 
-    results = []
-    for candidate in candidates:
-        for subplugin in (gog, ssokolow_install_sh, guesser):
-            result = subplugin.inspect(candidate)
-            if result:
+        @param candidates: C{(path, identity)} pairs from L{identify}.
+        """
+        results = []
+        for path, identity in candidates:
+            if identity is None or self.visited.setdefault(
+                    identity, path) == path:
+                results.append(path)
+            else:
+                canonical = self.aliases[path] = self.visited[identity]
+                log.debug("Skipping %s. Same folder as %s", path, canonical)
+                if canonical in self._found:
+                    self._found[canonical].aliases.add(path)
+        return results
+
+    def scan(self, roots, max_workers=MAX_WORKERS, mounts=None):
+        """Scan roots phase by phase (See L{plan})
+
+        @returns: A generator of C{(policies, entries)} tuples, one per
+            phase, so local results can be used while slow roots are
+            still being scanned.
+        """
+        self.visited, self.aliases = {}, {}
+        self._found = {}  # Base path -> entry, to attach later aliases to
+        for phase in self.plan(roots, mounts):
+            now = self.clock()
+            results = dict((x.path, self._cached(x, now)) for x in phase)
+            queues = []
+            for policy in phase:
+                if results[policy.path] is not None:
+                    continue
                 try:
-                    results.append(InstalledGameEntry(**result))
-                except TypeError:
-                    print("TypeError for InstalledGameEntry(**%r)" % result)
-                    raise
-                break
-        else:
-            log.info("Fallback - <Unmatched>: %s",
-                     filename_to_name(os.path.basename(candidate)))
+                    candidates = self.prober.call(
+                        policy.path, lambda x=policy: identify(sorted(
+                            gather_candidates(x.path, follow_symlinks=
+                                              x.follow_symlinks))),
+                        timeout=LIST_TIMEOUT)
+                except ProbeError as err:
+                    log.warning("Using cached results for %s: %s",
+                                policy.path, err)
+                    results[policy.path] = self._cached(
+                        policy, now, stale_ok=True) or []
+                else:
+                    queues.append((policy, self._unvisited(candidates)))
 
-    return results
+            fresh = inspect_all(queues, max_workers)
+            aliases_for = {}
+            for alias, canonical in self.aliases.items():
+                aliases_for.setdefault(canonical, []).append(alias)
+            for (policy, _), entries in zip(queues, fresh):
+                for entry in entries:
+                    entry.aliases.update(aliases_for.get(entry.base_path, ()))
+                    self._found[entry.base_path] = entry
+                results[policy.path] = entries
+                self._cache[policy.path] = (now, [x.copy() for x in entries])
+            yield phase, [y for x in phase for y in results[x.path]]
+
+SCHEDULER = ScanScheduler()
+
+def iter_games(roots=GAMES_DIRS, max_workers=MAX_WORKERS, scheduler=None):
+    """Like L{get_games} but yields a list of entries for each phase of the
+    scan, starting with the local roots. (See L{ScanScheduler.plan})
+
+    This is what L{src.game_providers.iter_games} streams to frontends.
+    """
+    for _, entries in (scheduler or SCHEDULER).scan(roots, max_workers):
+        yield entries
+
+def get_games(roots=GAMES_DIRS, max_workers=MAX_WORKERS, scheduler=None):
+    """List potential games by examining a set of /opt-like paths.
+
+    (Results come back sorted by phase, root, then candidate path, so
+     they're reproducible from run to run even though candidates are
+     inspected in parallel. See L{inspect_all})
+    """
+    return [x for entries in iter_games(roots, max_workers, scheduler)
+            for x in entries]
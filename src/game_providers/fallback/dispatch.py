@@ -0,0 +1,93 @@
+"""Marker-file index for choosing which sub-plugins to run on a candidate
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Rather than letting every sub-plugin probe every candidate for its own
+files, each one declares:
+
+ - C{MARKERS}: Paths relative to the candidate, any of which must exist
+   for the sub-plugin to possibly match. A tuple of paths means "all of
+   these". C{None} marks a catch-all which is always tried.
+ - C{PRIORITY}: Sub-plugins are tried highest first.
+
+L{SubpluginIndex} lists each candidate once and looks the names up in an
+index of the markers' top-level components, so adding a sub-plugin costs a
+dict entry per candidate rather than another round of C{stat()} calls.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, os, sys
+
+if sys.version_info.major >= 3:
+    basestring = str  # pylint: disable=invalid-name,redefined-builtin
+
+log = logging.getLogger(__name__)
+
+def _normalize_markers(markers):
+    """Turn C{MARKERS} into a list of tuples of paths which must all exist"""
+    return [(x,) if isinstance(x, basestring) else tuple(x)
+            for x in markers]
+
+class SubpluginIndex(object):
+    """Picks the sub-plugins worth running on a candidate by marker files"""
+
+    def __init__(self, subplugins):
+        # Stable sort so equal priorities keep their listed order
+        self.subplugins = sorted(subplugins,
+                                 key=lambda x: -getattr(x, 'PRIORITY', 0))
+        self._catchall = set()
+        self._by_name = {}  # top-level name -> [(subplugin, marker group)]
+
+        for subplugin in self.subplugins:
+            markers = getattr(subplugin, 'MARKERS', None)
+            if markers is None:
+                self._catchall.add(subplugin)
+                continue
+            for group in _normalize_markers(markers):
+                first = group[0].split('/')[0]
+                self._by_name.setdefault(first, []).append((subplugin, group))
+
+    @staticmethod
+    def snapshot(path):
+        """List C{path} once (or return an empty set if it isn't a folder)
+        """
+        try:
+            return set(os.listdir(path))
+        except OSError:
+            return set()
+
+    def subplugins_for(self, path, snapshot=None):
+        """Return the sub-plugins to try on C{path}, in priority order
+
+        @param snapshot: The names in C{path} if already listed.
+        """
+        names = self.snapshot(path) if snapshot is None else snapshot
+        matched = set(self._catchall)
+        for name in names.intersection(self._by_name):
+            for subplugin, group in self._by_name[name]:
+                if subplugin in matched:
+                    continue
+                if all(x.split('/')[0] in names and ('/' not in x or
+                       os.path.exists(os.path.join(path, x))) for x in group):
+                    matched.add(subplugin)
+        return [x for x in self.subplugins if x in matched]
+
+# vim: set sw=4 sts=4 expandtab :
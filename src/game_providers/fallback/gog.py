@@ -33,6 +33,10 @@ log = logging.getLogger(__name__)
 
 BACKEND_NAME = "GOG.com"
 
+# Files which must be present for inspect() to be tried (See L{dispatch})
+MARKERS = (('start.sh', 'support/gog_com.shlib'), 'gameinfo')
+PRIORITY = 20
+
 def detect_gogishness(token_list, fields):
     """Set the sub_provider field if the shell script sources
        C{support/gog_com.shlib}"""
@@ -63,8 +67,8 @@ def _inspect_mojo(path):
         log.debug("not os.path.isfile(%r)", gameinfo_path)
         return {}
 
-    with open(gameinfo_path, 'rU') as fobj:
-        lines = fobj.read().strip().split('\n')
+    with open(gameinfo_path, 'r') as fobj:
+        lines = fobj.read().strip().splitlines()
         if len(lines) < 3:
             log.debug("len(gameinfo) < 3 for %s", gameinfo_path)
             return {}
@@ -14,6 +14,13 @@ GNU General Public License for more details.
 
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Some installs (Bit.Trip games, Runner 2, EufloriaHD, many MojoSetup
+installs) keep their real launchers a folder or so below the top level, so
+if nothing playable is found there, L{descend} searches deeper. It's
+bounded by depth, directory entries listed, and time, and it never enters
+folders matching L{PRUNE_DIRS} (engine data, bundled runtimes, installer
+state) so looking deeper doesn't multiply the cost of the scan.
 """
 
 from __future__ import (absolute_import, division, print_function,
@@ -22,21 +29,62 @@ from __future__ import (absolute_import, division, print_function,
 __author__ = "Stephan Sokolow (deitarion/SSokolow)"
 __license__ = "GNU GPL 3.0 or later"
 
-import os, logging
+import os, logging, re, time
+from collections import deque
 from glob import glob
 
 from ..common import GameLauncher
 from ...util.icons import pick_icon
 from ...util.naming import filename_to_name
+from ...util import profiling
 from ...util.executables import Roles, classify_executable
+from .roots import MAX_DEPTH
 
 # TODO: Finish moving icon-identifying code into ...util.icons
 from ...util.icons import ICON_EXTS
 
 # TODO: See if I can justify moving the use of this into ...util
-from ...util.common import RESOURCE_DIRS_RE
+from ...util.common import RESOURCE_DIRS_RE, multiglob_compile
 
 BACKEND_NAME = "filesystem heuristics"
+
+# Tells the dispatcher to pass the root's max_depth policy to inspect()
+DESCENDS = True
+
+# Tried on every candidate, after anything with more specific markers
+MARKERS = None
+PRIORITY = 0
+
+# Subfolders which are never worth searching for launchers or icons
+# (Matched case-insensitively against folder names)
+PRUNE_DIRS = (
+    '*_Data', 'Mono', 'Shaders', 'node_modules', '__MACOSX',
+    '.mojosetup', '.git', '.svn',
+)
+
+# Limits on how much work searching below a candidate may do
+DESCEND_MAX_ENTRIES = 1000
+DESCEND_MAX_TIME = 0.25  # seconds
+
+class PruneIndex(object):
+    """Precompiled set of folder-name globs, split into a set of literal
+    names (for O(1) lookups) and a single regex for the rest.
+    """
+
+    def __init__(self, patterns):
+        wildcards = re.compile(r'[*?\[]')
+        self.literals = frozenset(x.lower() for x in patterns
+                                  if not wildcards.search(x))
+        globs = [x for x in patterns if wildcards.search(x)]
+        self.regex = multiglob_compile(globs, re_flags=re.I) if globs else None
+
+    def __contains__(self, name):
+        pruned = name.lower() in self.literals or bool(
+            self.regex and self.regex.match(name))
+        profiling.count('prune_hit' if pruned else 'prune_miss')
+        return pruned
+
+PRUNE_INDEX = PruneIndex(PRUNE_DIRS)
 log = logging.getLogger(__name__)
 
 def pathjoin_if(parent, child):
@@ -54,7 +102,8 @@ def find_files(path):
         # TODO: Consider handling this
         return None
 
-    for fname in os.listdir(path):
+    fnames = os.listdir(path)
+    for fname in fnames:
         fpath = os.path.join(path, fname)
         fext = os.path.splitext(fname)[1].lower()
         if os.path.isdir(fpath):
@@ -69,10 +118,6 @@ def find_files(path):
     # TODO: Figure out why Dynablaster Revenge's non-server binaries aren't
     #       showing up.
 
-    # TODO: If we only find install/uninstall, and there's a single
-    #       subdirectory, try descending one layer deeper.
-    #       (This will fix Bit.Trip games and various MojoSetup installs)
-
     # TODO: Also find .desktop files. Even if they only work when installed,
     #       they provide metadata we can scrape for things like the game's
     #       proper title.
@@ -80,11 +125,69 @@ def find_files(path):
     return {
         'executables': executables,
         'icons': icons,
-        'subdirs': subdirs
+        'subdirs': subdirs,
+        'count': len(fnames),
     }
 
-def inspect(path):
-    """Try to guess metadata from the given folder"""
+def descend(path, subdirs, max_depth, include=None, prune=PRUNE_INDEX,
+            max_entries=DESCEND_MAX_ENTRIES, max_time=DESCEND_MAX_TIME,
+            clock=time.time):
+    """Breadth-first search of the folders below C{path}
+
+    Stops early once C{max_entries} directory entries have been listed or
+    C{max_time} seconds have passed.
+
+    @param subdirs: The names of C{path}'s subfolders. (From L{find_files})
+    @param max_depth: How many levels below C{path} to go.
+    @param include: If given, only search top-level subfolders for which
+        C{include(name)} is true, whether or not they'd be pruned.
+    @param prune: Names of folders not to search. (See L{PruneIndex})
+    @returns: A generator of C{(relpath, found)} tuples where C{found} is
+        the result of L{find_files}.
+    """
+    deadline = clock() + max_time
+    queue = deque((x, 1) for x in sorted(subdirs)
+                  if (include(x) if include else x not in prune))
+    while queue and max_depth > 0:
+        if max_entries <= 0 or clock() >= deadline:
+            log.debug("Stopped searching %s early (%d folders left)",
+                      path, len(queue))
+            return
+
+        relpath, depth = queue.popleft()
+        found = find_files(os.path.join(path, relpath))
+        if not found:
+            continue
+        max_entries -= found['count']
+        yield relpath, found
+
+        if depth < max_depth:
+            queue.extend((os.path.join(relpath, x), depth + 1)
+                         for x in sorted(found['subdirs']) if x not in prune)
+
+def _nested_launchers(path, subdirs, max_depth):
+    """Find launchers in the shallowest subfolder with clear ones
+
+    @returns: C{(executables, icons)} with paths relative to C{path} or
+        C{None} if nothing was found.
+    """
+    for relpath, found in descend(path, subdirs, max_depth):
+        exes = found['executables']
+        if Roles.play in exes:
+            exes = {Roles.play: exes[Roles.play]}
+        elif len(exes.get(Roles.unknown, ())) != 1 or len(exes) > 1:
+            continue
+        return (dict((role, [os.path.join(relpath, x) for x in names])
+                     for role, names in exes.items()),
+                [os.path.join(relpath, x) for x in found['icons']])
+    return None
+
+def inspect(path, max_depth=MAX_DEPTH):
+    """Try to guess metadata from the given folder
+
+    @param max_depth: How many subfolders deep to look for launchers and
+        icons.
+    """
     found = find_files(path)
     name = filename_to_name(os.path.basename(path))
     # TODO: Inspect executable names to get capitalization hints which
@@ -97,6 +200,15 @@ def inspect(path):
     else:
         return None
 
+    # Only installers/uninstallers here? Look deeper for the game itself
+    # (but keep them as secondary launchers once it turns up)
+    extras = {}
+    if max_depth > 0 and exes and all(x >= Roles.install for x in exes):
+        nested = _nested_launchers(path, subdirs, max_depth)
+        if nested:
+            extras, exes = exes, nested[0]
+            icons = icons or nested[1]
+
     # TODO: Make this case-insensitive
     if not icons:
         icons += glob(os.path.join(
@@ -110,15 +222,11 @@ def inspect(path):
         exes[:] = ['run.sh']
 
     # Find icons in asset subdirectories
-    if len(icons) < 1:
-        uncase_map = {x.lower(): x for x in subdirs}
-        for subname in uncase_map:
-            if RESOURCE_DIRS_RE.match(subname):
-                subname_real = uncase_map[subname]
-                subfound = find_files(os.path.join(path, subname_real))
-                if subfound['icons']:
-                    icons.extend([os.path.join(
-                        subname_real, x) for x in subfound['icons']])
+    if len(icons) < 1 and max_depth > 0:
+        for relpath, subfound in descend(path, subdirs, max_depth,
+                                         include=RESOURCE_DIRS_RE.match):
+            icons.extend(os.path.join(relpath, x)
+                         for x in subfound['icons'])
 
     icon = pick_icon(icons, path)
     result = {
@@ -137,13 +245,8 @@ def inspect(path):
                          role=Roles.play)
             for x in exes[Roles.play])
     elif len(exes) == 1 and len(list(exes.values())[0]) == 1:
-        # TODO: bit.trip.runner and Runner 2 have everything in a folder and
-        #       only "install" and related files are at the top level. We'll
-        #       need to detect and recurse somehow.
-        #       (Also, it should be useful to scrape clues from un-installed
-        #        .desktop files that are hard-coded to the install location)
-        # TODO: Games like EufloriaHD also express a similar pattern but with
-        #       the mojosetup uninstall stuff being the top-level thing.
+        # TODO: It should be useful to scrape clues from un-installed
+        #       .desktop files that are hard-coded to the install location
         # TODO: Use a more proper solution than list() for working around
         #       .values() and .keys() returning lists in Python 2.x and views
         #       in Python 3.x. (A first() wrapper defined differently in each?)
@@ -153,6 +256,13 @@ def inspect(path):
                          provider=BACKEND_NAME,
                          role=list(exes.keys())[0]))
 
+    if result['commands']:
+        for role in sorted(extras):
+            result['commands'].extend(
+                GameLauncher(name=x, icon=icon, argv=[os.path.join(path, x)],
+                             provider=BACKEND_NAME, role=role)
+                for x in extras[role])
+
     return result if result['commands'] else None
 
     # TODO: More testcases for filename_to_name
@@ -0,0 +1,172 @@
+"""Per-root scan policies for the fallback provider's C{GAMES_DIRS}
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+A USB disk, an NFS share, and C{~/opt} shouldn't all be scanned the same
+way, so each root can be given a L{RootPolicy}. Roots on removable or
+network storage are "slow": they're scanned after the local ones, with
+throttled I/O, and only if the mount table says they're actually mounted.
+(Checking C{/proc/mounts} never touches the mount itself, so an unplugged
+disk can't stall the scan. Mounted-but-dead network shares are handled by
+probing through a L{src.util.probing.Prober}.)
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, os
+
+from ...util.fswatch import get_mounts, is_network_path
+
+log = logging.getLogger(__name__)
+
+# How many subfolders deep sub-plugins may look inside a candidate
+MAX_DEPTH = 1
+
+# Defaults for how many candidates may be inspected at once from a root...
+ROOT_WORKERS = 4
+SLOW_ROOT_WORKERS = 2
+
+# ...and the minimum delay (in seconds) before each one on slow roots
+SLOW_ROOT_THROTTLE = 0.01
+
+def mount_point_for(path, mounts):
+    """Return the deepest mount point in C{mounts} containing C{path}
+    (without touching the filesystem)
+
+    @param mounts: C{(mount_point, fstype)} pairs as returned by
+        L{src.util.fswatch.get_mounts}.
+    """
+    best = None
+    for mount, _ in mounts:
+        prefix = mount.rstrip(os.sep) + os.sep
+        if path == mount or path.startswith(prefix):
+            if best is None or len(mount) > len(best):
+                best = mount
+    return best
+
+class RootPolicy(object):
+    """How one root folder should be scanned"""
+
+    def __init__(self, path, max_depth=MAX_DEPTH, follow_symlinks=True,
+                 concurrency=None, throttle=None, rescan_interval=None,
+                 removable=False, networked=None, mount_point=None,
+                 mounts=None):
+        """
+        @param max_depth: How many subfolders deep sub-plugins may look
+            inside each candidate for launchers and icons.
+        @param follow_symlinks: If C{False}, candidates which are symlinks
+            are skipped.
+        @param concurrency: Maximum candidates to inspect at once.
+            (Defaults to L{ROOT_WORKERS}, or L{SLOW_ROOT_WORKERS} if slow.)
+        @param throttle: Seconds to wait before inspecting each candidate.
+            (Defaults to 0, or L{SLOW_ROOT_THROTTLE} if slow.)
+        @param rescan_interval: If set, reuse the previous results for this
+            many seconds rather than rescanning.
+        @param removable: Whether the root lives on removable media.
+        @param networked: Whether the root lives on a network mount.
+            (Defaults to whether the mount table currently says so.)
+        @param mount_point: For removable or networked roots, where their
+            filesystem should be mounted. If not given, any mount point
+            other than C{/} containing the root will do.
+        @param mounts: The mount table to decide C{networked} from if it
+            isn't given. (See L{src.util.fswatch.get_mounts})
+        """
+        self.path = os.path.abspath(path)
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.rescan_interval = rescan_interval
+        self.removable = removable
+        self.networked = (networked if networked is not None else
+                          is_network_path(self.path, mounts))
+        self.mount_point = mount_point
+
+        slow = self.slow
+        self.concurrency = concurrency or (
+            SLOW_ROOT_WORKERS if slow else ROOT_WORKERS)
+        self.throttle = (throttle if throttle is not None else
+                         SLOW_ROOT_THROTTLE if slow else 0)
+
+    def __repr__(self):
+        return "<RootPolicy %r>" % self.path
+
+    @property
+    def slow(self):
+        """Whether this root should be scanned after the local ones"""
+        return self.removable or self.networked
+
+    def is_mounted(self, mounts=None):
+        """Check the mount table (not the filesystem) for this root
+
+        Always C{True} for local roots or if the mount table is unavailable.
+        """
+        if not self.slow:
+            return True
+        mounts = get_mounts() if mounts is None else mounts
+        if not mounts:
+            return True
+
+        mount = mount_point_for(self.path, mounts)
+        if self.mount_point:
+            return mount == os.path.abspath(self.mount_point)
+        return mount not in (None, os.sep)
+
+    def is_available(self, mounts=None, prober=None):
+        """Return C{True} if this root is mounted and is a folder
+
+        @param prober: If given, a L{src.util.probing.Prober} to do the
+            C{isdir()} check through so a dead mount can't hang the caller.
+        @raises src.util.probing.ProbeError: If the probe timed out or the
+            root is already known to be unhealthy.
+        """
+        if not self.is_mounted(mounts):
+            return False
+        elif prober is None:
+            return os.path.isdir(self.path)
+        return prober.call(self.path, os.path.isdir, self.path)
+
+class RootRegistry(object):
+    """Policies for known roots, with a default policy for the rest"""
+
+    def __init__(self, policies=()):
+        self.policies = {}
+        for policy in policies:
+            self.register(policy)
+
+    def register(self, policy):
+        """Add or replace the policy for C{policy.path}"""
+        self.policies[policy.path] = policy
+
+    def get(self, path, mounts=None):
+        """Return the policy for a root (or a default one if unregistered)
+
+        @param mounts: The mount table for deciding whether unregistered
+            roots are networked. (See L{RootPolicy})
+        """
+        path = os.path.abspath(path)
+        return self.policies.get(path) or RootPolicy(path, mounts=mounts)
+
+    def policies_for(self, paths, mounts=None):
+        """Return the policies for a list of roots (deduplicated, in sorted
+        order) so scan results are reproducible.
+        """
+        return [self.get(x, mounts) for x in sorted(set(os.path.abspath(x)
+                                                        for x in paths))]
+
+# vim: set sw=4 sts=4 expandtab :
@@ -30,6 +30,10 @@ from ...util.shlexing import (script_precheck, lex_shellscript,
                               make_metadata_mapper)
 
 BACKEND_NAME = "ssokolow's install.sh"
+
+# Files which must be present for inspect() to be tried (See L{dispatch})
+MARKERS = ('install.sh',)
+PRIORITY = 10
 log = logging.getLogger(__name__)
 
 def inspect(path):
@@ -39,7 +43,7 @@ def inspect(path):
         return None
 
     metadata_map = {
-        'GAME_ID': 'game_id',  # TODO: Decide how to support this
+        'GAME_ID': 'game_id',
         'GAME_NAME': 'name',
         'GAME_SYNOPSIS': 'description',
         'GAME_EXEC': 'argv',
@@ -88,6 +92,7 @@ def inspect(path):
         'name': launcher.name,
         'icon': launcher.icon,
         'base_path': path,
+        'game_id': fields['game_id'],
         'provider': BACKEND_NAME,
         'commands': [launcher, installer]
     }
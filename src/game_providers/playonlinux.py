@@ -35,6 +35,9 @@ from ..util.shlexing import lex_shellscript, make_metadata_mapper
 BACKEND_NAME = "PlayOnLinux"
 POL_PREFIX = os.path.expanduser('~/.PlayOnLinux')
 
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = [os.path.join(POL_PREFIX, 'shortcuts')]
+
 # Let this get subbed in elsewhere so there's a clean way to identify which
 # entries had to fall back to a default icon
 DEFAULT_ICON = "playonlinux"
@@ -100,6 +103,7 @@ def get_games():
             name=name,
             icon=icon,
             base_path=fields['base_path'],
+            provider_id="%s:%s" % (BACKEND_NAME, name),
             commands=[GameLauncher(
                 argv=["playonlinux", "--run", name],
                 provider=BACKEND_NAME,
@@ -39,6 +39,9 @@ except ImportError:  # Python 2.x
 BACKEND_NAME = "ResidualVM"
 RC_PATH = os.path.expanduser('~/.residualvmrc')
 
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = [RC_PATH]
+
 # Let this get subbed in elsewhere so our dependency on PyXDG is more decoupled
 from xdg.IconTheme import getIconPath
 DEFAULT_ICON = getIconPath("residualvm", 128)
@@ -55,7 +58,7 @@ def _get_games_list():
 
         rows = rows.strip().split('\n')[2:]
         return dict(row.split(None, 1) for row in rows)
-    except subprocess.CalledProcessError:
+    except (OSError, subprocess.CalledProcessError):
         log.info("Could not retrieve list of games from ResidualVM")
         return {}
 
@@ -101,6 +104,7 @@ def get_games():
             name=name,
             icon=DEFAULT_ICON,
             base_path=base_path,
+            provider_id="%s:%s" % (BACKEND_NAME, game_id),
             commands=[GameLauncher(
                 argv=["residualvm", game_id],
                 provider=BACKEND_NAME,
@@ -39,6 +39,9 @@ except ImportError:  # Python 2.x
 BACKEND_NAME = "ScummVM"
 RC_PATH = os.path.expanduser('~/.scummvmrc')
 
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = [RC_PATH]
+
 # Let this get subbed in elsewhere so our dependency on PyXDG is more decoupled
 from xdg.IconTheme import getIconPath
 DEFAULT_ICON = getIconPath("scummvm", 128)
@@ -62,7 +65,7 @@ def _parse_list(args):
             result[game_id.strip()] = name.strip()
         return result
 
-    except subprocess.CalledProcessError:
+    except (OSError, subprocess.CalledProcessError):
         log.info("Could not retrieve list of games from ScummVM")
         return {}
 
@@ -106,6 +109,7 @@ def get_games():
             name=name,
             icon=DEFAULT_ICON,
             base_path=base_path,
+            provider_id="%s:%s" % (BACKEND_NAME, game_id),
             commands=[GameLauncher(
                 argv=["scummvm", game_id],
                 provider=BACKEND_NAME,
@@ -0,0 +1,222 @@
+"""Code to keep a game list up to date by watching the providers' inputs
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Each provider module lists the files and folders it reads in C{WATCH_PATHS}.
+Providers which can rescan a subset of their inputs (currently only
+L{fallback}) also provide C{candidate_for()} and C{inspect_candidate()} so
+that installing one game into C{~/opt} only re-inspects that one folder.
+If they also provide C{gather_candidates()}, every candidate folder is
+watched, whether or not a game has been found in it yet, so a game copied
+into a freshly-created folder is still noticed.
+
+Providers whose roots may be on removable or network mounts also provide a
+C{SCHEDULER} (a L{fallback.ScanScheduler}). Only the roots its plan
+considers available and whose probes are healthy get watched, and the
+listing and C{stat()} calls for them go through its prober (or the
+watcher's) so a dead mount can't hang the event loop.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, os
+
+from . import PROVIDERS, merge_entries
+from ..util.fswatch import FilesystemWatcher
+from ..util.probing import ProbeError
+
+log = logging.getLogger(__name__)
+
+def _is_within(path, parent):
+    """Return C{True} if C{path} is C{parent} or somewhere inside it"""
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+def _stat_candidate(path):
+    """Return C{(isdir, exists)} for C{path} so both cost a single probe"""
+    return os.path.isdir(path), os.path.exists(path)
+
+class IncrementalScanner(object):
+    """Holds raw per-provider results and refreshes only what changed.
+
+    Raw results are stored as C{{provider: {key: [entries]}}} where C{key} is
+    a candidate path for providers supporting partial rescans and C{None}
+    otherwise.
+    """
+
+    def __init__(self, providers=None, watcher=None):
+        self.providers = PROVIDERS if providers is None else providers
+        self.watcher = watcher or FilesystemWatcher()
+        self.raw = {}
+        self._games = None
+
+    @staticmethod
+    def _is_granular(provider):
+        """Return C{True} if C{provider} supports per-candidate rescans"""
+        return (hasattr(provider, 'candidate_for') and
+                hasattr(provider, 'inspect_candidate'))
+
+    @staticmethod
+    def _roots_for(provider):
+        """Return the provider's watch paths which are safe to touch now
+
+        If the provider has a C{SCHEDULER}, roots which aren't mounted or
+        whose probes are failing are left out until a later scan.
+        """
+        paths = getattr(provider, 'WATCH_PATHS', ())
+        scheduler = getattr(provider, 'SCHEDULER', None)
+        if scheduler is None:
+            return list(paths)
+        return [policy.path for phase in scheduler.plan(paths)
+                for policy in phase
+                if scheduler.prober.is_healthy(policy.path)]
+
+    @staticmethod
+    def _gather(provider, root):
+        """Call C{provider.gather_candidates(root)}, through its scheduler's
+        prober if it has one
+
+        @raises src.util.probing.ProbeError: If the listing timed out or
+            C{root} is already known to be unhealthy.
+        """
+        scheduler = getattr(provider, 'SCHEDULER', None)
+        if scheduler is None:
+            return provider.gather_candidates(root)
+        timeout = getattr(provider, 'LIST_TIMEOUT', scheduler.prober.timeout)
+        return scheduler.prober.call(root, provider.gather_candidates, root,
+                                     timeout=timeout)
+
+    def _scan_provider(self, provider):
+        """(Re)run a provider in full and (re)install its watches"""
+        roots = self._roots_for(provider)
+        for path in roots:
+            self.watcher.add_watch(path)
+
+        if self._is_granular(provider):
+            results = {}
+            for entry in provider.get_games():
+                key = provider.candidate_for(entry.base_path)
+                results.setdefault(key, []).append(entry)
+                if key:
+                    self._watch_candidate(key)
+            self.raw[provider] = results
+
+            if hasattr(provider, 'gather_candidates'):
+                for root in roots:
+                    try:
+                        candidates = self._gather(provider, root)
+                    except ProbeError as err:
+                        log.warning("Not watching candidates in %s: %s",
+                                    root, err)
+                        continue
+                    for candidate in candidates:
+                        self._watch_candidate(candidate)
+        else:
+            self.raw[provider] = {None: list(provider.get_games())}
+        self._games = None
+
+    def _watch_candidate(self, candidate):
+        """Watch inside a candidate folder so changes to its contents
+        (rather than just its creation) are noticed, or stop watching it if
+        it's gone.
+        """
+        try:
+            isdir, exists = self.watcher.probe(candidate, _stat_candidate,
+                                               candidate)
+        except ProbeError as err:
+            log.debug("Leaving watches on %s alone: %s", candidate, err)
+            return
+
+        if isdir:
+            self.watcher.add_watch(candidate)
+        elif not exists:
+            self.watcher.remove_watch(candidate)
+
+    def _rescan_candidate(self, provider, candidate):
+        """Re-inspect a single candidate for a granular provider"""
+        self._watch_candidate(candidate)
+        entry = provider.inspect_candidate(candidate)
+        if entry:
+            log.debug("Rescanned %s: %r", candidate, entry)
+            self.raw[provider][candidate] = [entry]
+        else:
+            log.debug("Rescanned %s: no game found", candidate)
+            self.raw[provider].pop(candidate, None)
+        self._games = None
+
+    def scan(self):
+        """Perform a full scan of all providers and return the game list"""
+        for provider in self.providers:
+            self._scan_provider(provider)
+        return self.games
+
+    def handle_changes(self, paths):
+        """Rescan only the providers (and candidates) affected by C{paths}
+
+        @param paths: Changed paths as returned by
+            L{FilesystemWatcher.wait}. C{None} forces a full rescan.
+        @returns: C{True} if anything was rescanned.
+        """
+        if None in paths:
+            log.info("Filesystem events were lost. Performing full rescan.")
+            self.scan()
+            return True
+
+        full, partial = set(), set()
+        for path in paths:
+            for provider in self.providers:
+                if not any(_is_within(path, os.path.abspath(x)) or
+                           _is_within(os.path.abspath(x), path)
+                           for x in getattr(provider, 'WATCH_PATHS', ())):
+                    continue
+
+                candidate = (provider.candidate_for(path)
+                             if self._is_granular(provider) else None)
+                if candidate:
+                    partial.add((provider, candidate))
+                else:
+                    full.add(provider)
+
+        for provider in full:
+            log.info("Rescanning %s", provider.__name__)
+            self._scan_provider(provider)
+        for provider, candidate in partial:
+            if provider not in full:
+                self._rescan_candidate(provider, candidate)
+        return bool(full or partial)
+
+    def wait(self, timeout=None):
+        """Block until the game list changes (or C{timeout} expires)
+
+        @returns: C{True} if the game list may have changed.
+        """
+        paths = self.watcher.wait(timeout)
+        return bool(paths) and self.handle_changes(paths)
+
+    @property
+    def games(self):
+        """The merged, deduplicated game list (recomputed only on change)"""
+        if self._games is None:
+            self._games = merge_entries(entry.copy()
+                                        for results in self.raw.values()
+                                        for entries in results.values()
+                                        for entry in entries)
+        return self._games
+
+# vim: set sw=4 sts=4 expandtab :
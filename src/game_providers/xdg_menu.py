@@ -32,24 +32,18 @@ BACKEND_NAME = "XDG"
 
 import logging, os, re
 import xdg.Menu
+from xdg.BaseDirectory import xdg_config_dirs, xdg_data_dirs
 from xdg.IconTheme import getIconPath
 
 from .common import InstalledGameEntry, GameLauncher
-from ..util.common import resolve_exec, which
+from ..util.common import COMMON_DIRS, resolve_exec, which
 from ..util.executables import Roles
 
 log = logging.getLogger(__name__)
 
-# TODO: Put this somewhere like util.common
-# A list of paths that, if exactly matched, should not be used for game
-# deduplication via install directory
-COMMON_DIRS = [
-    '/opt', os.path.expanduser('~/opt'),
-    '/bin', os.path.expanduser('~/bin'),
-    '/usr/games/bin', '/usr/local/games/bin',
-    '/usr/games', '/usr/local/games',
-    '/usr/bin', '/usr/local/bin',
-]
+# Paths which, when changed, may change what this provider finds
+WATCH_PATHS = ([os.path.join(x, 'applications') for x in xdg_data_dirs] +
+               [os.path.join(x, 'menus') for x in xdg_config_dirs])
 
 def _process_menu(menu):
     """Recursive handler for getting games from menus.
@@ -122,6 +116,8 @@ def get_games(root_folder='Games'):
             name=name,
             icon=icon,
             base_path=base_path,
+            provider_id="%s:%s" % (BACKEND_NAME,
+                                   os.path.basename(dentry.getFileName())),
             commands=[GameLauncher(
                 argv=argv,
                 provider=BACKEND_NAME,
@@ -0,0 +1,8 @@
+"""Frontend-agnostic code for maintaining the user's game library"""
+
+import os
+
+# TODO: Move this and most other constants to a config.py for visibility
+DATA_DIR = os.path.join(os.environ.get('XDG_DATA_HOME',
+                                       os.path.expanduser('~/.local/share')),
+                        'game_launcher')
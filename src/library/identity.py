@@ -0,0 +1,174 @@
+"""Code for recognizing a game as "the same game" across rescans and reinstalls
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Each entry produces a ranked chain of keys, from most to least trustworthy:
+
+ 1. C{pid:}   The provider's own ID (eg. C{ScummVM:monkey1})
+ 2. C{gid:}   A cross-provider game ID (GOG.com C{PACKAGE_NAME},
+              install.sh C{GAME_ID})
+ 3. C{name:}  The name, normalized to ignore case and punctuation
+ 4. C{path:}  The install path
+ 5. C{inode:} The device, inode, size, and mtime of C{argv[0]}
+              (Survives renaming or moving the install folder)
+
+Every key is remembered in an inverted index pointing at a persistent
+record's identity string, so an entry whose strongest keys changed (eg.
+reinstalled somewhere else) still finds its old record via any one key in a
+single dict lookup.
+
+Keys which turn out to be shared by more than one record (eg. the name of a
+game with two versions installed) are kept in the index pointing at
+L{AMBIGUOUS} so they're never matched on again, and a record is never
+matched by a weak key if the entry has a C{pid:} or C{gid:} which differs
+from the one the record was found under.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, os, re
+
+log = logging.getLogger(__name__)
+
+# Stands in for the identity of keys shared by more than one record
+AMBIGUOUS = ''
+
+# Kinds of key which name exactly one game, so a record having a different
+# one of them rules out a match by any weaker key
+ID_KINDS = ('pid', 'gid')
+
+_name_junk_re = re.compile(r'[\W_]+', re.UNICODE)
+
+def normalize_name(name):
+    """Reduce a name to a form which ignores case, spacing, and punctuation.
+
+    (eg. "Trine 2: Complete Story" and "trine 2 - complete story" match)
+    """
+    return _name_junk_re.sub('', name.lower())
+
+def identity_keys(entry):
+    """Return the ranked list of identity keys for an entry"""
+    keys = []
+    if getattr(entry, 'provider_id', None):
+        keys.append('pid:' + entry.provider_id)
+    if getattr(entry, 'game_id', None):
+        keys.append('gid:' + entry.game_id)
+    if entry.name and normalize_name(entry.name):
+        keys.append('name:' + normalize_name(entry.name))
+    if entry.base_path:
+        keys.append('path:' + entry.base_path)
+
+    for cmd in entry.commands:
+        if os.path.isabs(cmd.argv[0]):
+            try:
+                stat = os.stat(cmd.argv[0])
+            except OSError:
+                continue
+            keys.append('inode:%d:%d:%d:%d' % (stat.st_dev, stat.st_ino,
+                                               stat.st_size, stat.st_mtime))
+            break
+    return keys
+
+class IdentityResolver(object):
+    """Inverted index from identity keys to persistent record identities"""
+
+    def __init__(self, index=None):
+        """
+        @param index: An iterable of C{(key, identity)} pairs to preload.
+        """
+        self.index = dict(index or ())
+        self._ids = {}  # Identity -> its ID_KINDS keys
+        for key, identity in self.index.items():
+            self._remember(key, identity)
+
+    def _remember(self, key, identity):
+        """Record which C{ID_KINDS} keys a record was found under"""
+        if identity != AMBIGUOUS and key.split(':', 1)[0] in ID_KINDS:
+            self._ids.setdefault(identity, set()).add(key)
+
+    def _conflicts(self, identity, keys):
+        """Whether a record has a different key of the same L{ID_KINDS}
+        kind as any of C{keys}
+        """
+        theirs = self._ids.get(identity, ())
+        for key in keys:
+            kind = key.split(':', 1)[0] + ':'
+            if kind[:-1] in ID_KINDS and key not in theirs and any(
+                    x.startswith(kind) for x in theirs):
+                return True
+        return False
+
+    def resolve(self, entries):
+        """Assign an C{identity} attribute to each entry.
+
+        Keys shared by more than one entry in the same call or by more than
+        one record (eg. the name of a game with two versions installed side
+        by side) are too ambiguous to match on, so lookup falls through to
+        the next key in the chain, and no two entries are ever given the
+        same identity.
+
+        @returns: A list of C{(key, identity)} pairs which were added to or
+            changed in the index and need persisting.
+        """
+        batch = [(entry, identity_keys(entry)) for entry in entries]
+        key_counts = {}
+        for _, keys in batch:
+            for key in keys:
+                key_counts[key] = key_counts.get(key, 0) + 1
+
+        claimed, added = set(), []
+        for entry, keys in batch:
+            if not keys:
+                log.debug("No identity keys for %r", entry)
+                continue
+            unambiguous = [x for x in keys if key_counts[x] == 1 and
+                           self.index.get(x) != AMBIGUOUS] or keys
+
+            identity = None
+            for rank, key in enumerate(keys):
+                candidate = self.index.get(key)
+                if (key in unambiguous and candidate and
+                        candidate not in claimed and
+                        not self._conflicts(candidate, keys[:rank])):
+                    identity = candidate
+                    break
+
+            if identity is None:
+                identity = unambiguous[0]
+                while identity in claimed or (
+                        self.index.get(identity, identity) != identity):
+                    identity += '+'
+
+            claimed.add(identity)
+            entry.identity = identity
+
+            # A weak key (eg. a reused install path) can't be stolen from the
+            # record which first claimed it, but it can't be trusted either
+            for key in keys:
+                if key not in self.index:
+                    self.index[key] = identity
+                    self._remember(key, identity)
+                    added.append((key, identity))
+                elif self.index[key] not in (identity, AMBIGUOUS):
+                    self.index[key] = AMBIGUOUS
+                    added.append((key, AMBIGUOUS))
+        return added
+
+# vim: set sw=4 sts=4 expandtab :
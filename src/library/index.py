@@ -0,0 +1,188 @@
+"""Compact, read-only name index for launching games without a scan
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Written at the end of each scan so keyboard launching
+(C{game_launcher.py --launch "trine 2"}) can go from process start to
+C{exec()} without importing any provider, GUI toolkit, or even C{sqlite3}.
+Reading it only needs C{mmap} and C{struct}, so keep it that way.
+
+File layout (all integers big-endian)::
+
+    header:  8s magic, I count
+    table:   count * (I key_offset, I record_offset), sorted by key bytes
+    keys:    H length, casefolded UTF-8 name
+    records: I length, NUL-separated UTF-8 fields (name, cwd, *argv)
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import mmap, os, struct, sys
+from collections import namedtuple
+
+from . import DATA_DIR
+
+DEFAULT_INDEX_PATH = os.path.join(DATA_DIR, 'index.bin')
+
+MAGIC = b'GLIDX001'
+HEADER = struct.Struct(str('!8sI'))
+SLOT = struct.Struct(str('!II'))
+KEY_LEN = struct.Struct(str('!H'))
+RECORD_LEN = struct.Struct(str('!I'))
+
+IndexRecord = namedtuple('IndexRecord', 'name cwd argv')
+
+def _encode(text):
+    """Encode a string for storage (round-tripping undecodable paths)"""
+    if isinstance(text, bytes):
+        return text
+    if sys.version_info.major < 3:
+        return text.encode('utf-8')
+    return text.encode('utf-8', 'surrogateescape')
+
+def _decode(raw):
+    """Inverse of L{_encode}"""
+    if sys.version_info.major < 3:
+        return raw.decode('utf-8', 'replace')
+    return raw.decode('utf-8', 'surrogateescape')
+
+def make_key(name):
+    """Return the byte string names are sorted and matched on"""
+    name = ' '.join(name.split())
+    return _encode(name.casefold() if hasattr(name, 'casefold')
+                   else name.lower())[:0xFFFF]
+
+def write_index(entries, path=DEFAULT_INDEX_PATH):
+    """Atomically (re)write the index for the default launchers of C{entries}
+
+    (Entries without a usable default launcher are left out.)
+    """
+    # Deferred so readers of the index never pay for these imports
+    from ..game_providers.common import TERMINAL_CMD
+    from ..util.common import which
+
+    rows = []
+    for entry in entries:
+        cmd = entry.default_launcher
+        if not cmd or not cmd.argv:
+            continue
+
+        argv = list(cmd.argv)
+        if cmd.use_terminal:
+            argv = TERMINAL_CMD + argv
+        # Mirror GameLauncher.run()'s Windows-style $PWD workaround
+        cwd = cmd.path or os.path.dirname(which(cmd.argv[0]) or '')
+        rows.append((make_key(entry.name), b'\0'.join(
+            _encode(x) for x in [entry.name, cwd] + argv)))
+    rows.sort()
+
+    keys, records, slots = bytearray(), bytearray(), []
+    for key, record in rows:
+        slots.append((len(keys), len(records)))
+        keys.extend(KEY_LEN.pack(len(key)) + key)
+        records.extend(RECORD_LEN.pack(len(record)) + record)
+
+    keys_start = HEADER.size + SLOT.size * len(rows)
+    records_start = keys_start + len(keys)
+
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fobj:
+        fobj.write(HEADER.pack(MAGIC, len(rows)))
+        for key_off, rec_off in slots:
+            fobj.write(SLOT.pack(keys_start + key_off,
+                                 records_start + rec_off))
+        fobj.write(keys)
+        fobj.write(records)
+    os.rename(tmp_path, path)
+
+class GameIndex(object):
+    """Read-only, memory-mapped view of an index written by L{write_index}
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        """
+        @raises IOError: If the index is missing.
+        @raises ValueError: If the file isn't a valid index.
+        """
+        with open(path, 'rb') as fobj:
+            self._map = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError("Truncated index: %s" % path)
+        magic, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a game index (or wrong version): %s" % path)
+
+    def close(self):
+        """Release the memory mapping"""
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, idx):
+        """Return the sort key for the C{idx}th entry"""
+        offset = SLOT.unpack_from(self._map, HEADER.size + idx * SLOT.size)[0]
+        length = KEY_LEN.unpack_from(self._map, offset)[0]
+        start = offset + KEY_LEN.size
+        return self._map[start:start + length]
+
+    def record(self, idx):
+        """Return the L{IndexRecord} for the C{idx}th entry"""
+        offset = SLOT.unpack_from(self._map, HEADER.size + idx * SLOT.size)[1]
+        length = RECORD_LEN.unpack_from(self._map, offset)[0]
+        start = offset + RECORD_LEN.size
+        fields = [_decode(x) for x in
+                  self._map[start:start + length].split(b'\0')]
+        return IndexRecord(fields[0], fields[1] or None, fields[2:])
+
+    def _bisect(self, key):
+        """Return the first position whose key is not less than C{key}"""
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def match(self, prefix=''):
+        """Return records whose names start with C{prefix} (casefolded)"""
+        key = make_key(prefix)
+        results = []
+        for idx in range(self._bisect(key), self._count):
+            if not self._key(idx).startswith(key):
+                break
+            results.append(self.record(idx))
+        return results
+
+    def lookup(self, name):
+        """Return the records for C{name}: exact matches if there are any,
+        otherwise every prefix match.
+        """
+        key = make_key(name)
+        matches = self.match(name)
+        exact = [x for x in matches if make_key(x.name) == key]
+        return exact or matches
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,385 @@
+"""Frontend-agnostic sorted, filtered view of the library
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+L{LibraryModel} keeps entries in humansorted order (with each entry's sort
+key computed once and cached) so each entry streamed in from a scan is
+placed with a binary search rather than a re-sort, and toolkit models
+(See C{testgui.py} and C{testgui_qt.py}) are just thin adapters over it.
+
+Changes aren't announced one row at a time. They're recorded as ranges
+and coalesced (eg. 200 adjacent inserts become one) until L{flush} is
+called, usually from an idle callback scheduled via C{on_pending}, at
+which point each range is replayed to the listeners in order against the
+published L{LibraryModel.rows} so every notification sees the rows it
+describes, as both GTK+ and Qt require.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import bisect, itertools, logging, time
+
+from ..util.common import humansort_key
+
+log = logging.getLogger(__name__)
+
+INSERT, REMOVE, CHANGE = 'insert', 'remove', 'change'
+
+# Hand rows from a loader thread to the UI thread at least this often, and
+# in chunks of no more than this many, so the UI stays responsive at ~60fps
+BATCH_DELAY = 0.016
+BATCH_ROWS = 200
+
+class ModelListener(object):
+    """Base class for objects notified of L{LibraryModel} changes.
+
+    Each notification covers C{count} consecutive rows starting at
+    C{first}, in terms of L{LibraryModel.rows} as it was before (for
+    L{rows_about_to_change}) or after (for L{rows_changed}) that one range
+    was applied.
+    """
+
+    def rows_about_to_change(self, kind, first, count):
+        """Called before a range of rows is inserted, removed, or changed
+        """
+
+    def rows_changed(self, kind, first, count):
+        """Called after a range of rows is inserted, removed, or changed"""
+
+class LibraryModel(object):
+    """Sorted, optionally filtered list of entries with batched change
+    notifications.
+
+    Entries are tracked by object identity, so call L{changed} after
+    modifying one in place.
+    """
+
+    def __init__(self, entries=(), on_pending=None):
+        """
+        @param on_pending: Called with no arguments when changes start
+            accumulating so the frontend can schedule a call to L{flush}.
+        """
+        self.on_pending = None
+        self.listeners = []
+        self.rows = []          # Published rows, as the views last saw them
+
+        self._seq = itertools.count()
+        self._sort_keys = {}    # id(entry) -> cached sort key
+        self._entries = {}      # id(entry) -> entry, whether visible or not
+        self._filter = None
+
+        # Live visible state, ahead of self.rows until the next flush()
+        self._keys, self._visible = [], []
+        self._ops, self._changed = [], {}
+
+        self.extend(entries)
+        self._ops = []
+        self.rows = list(self._visible)
+        self.on_pending = on_pending
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, pos):
+        return self.rows[pos]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, entry):
+        return id(entry) in self._entries
+
+    @property
+    def entries(self):
+        """Every entry in the model (visible or not) in sorted order"""
+        return sorted(self._entries.values(),
+                      key=lambda x: self._sort_keys[id(x)])
+
+    @property
+    def pending(self):
+        """Whether there are changes waiting for L{flush}"""
+        return bool(self._ops or self._changed)
+
+    def sort_key(self, entry):
+        """Return the cached humansort key for an entry
+
+        (A unique sequence number breaks ties so entries themselves are
+         never compared.)
+        """
+        key = self._sort_keys.get(id(entry))
+        if key is None:
+            key = self._sort_keys[id(entry)] = (
+                tuple(humansort_key(entry.name)), next(self._seq))
+        return key
+
+    def index(self, entry):
+        """Return the position of a visible entry in L{rows}
+
+        @raises ValueError: If the entry isn't currently published.
+        """
+        if not self.pending:
+            pos = self._visible_pos(entry)
+            if pos is not None:
+                return pos
+        else:
+            # Published rows may no longer match the cached sort keys
+            for pos, row in enumerate(self.rows):
+                if row is entry:
+                    return pos
+        raise ValueError("Entry not in model: %r" % entry)
+
+    # -- Recording changes --
+
+    def _record(self, kind, pos, entry):
+        """Record a one-row insert or removal, merging it into the last
+        range if adjacent.
+
+        (Ranges are kept as C{[kind, first, entries]} so inserted rows can
+         be published with their entries in place.)
+        """
+        if not self.pending and self.on_pending:
+            self.on_pending()
+
+        if self._ops:
+            last = self._ops[-1]
+            first, rows = last[1], last[2]
+            if last[0] == kind:
+                if kind == INSERT and first <= pos <= first + len(rows):
+                    rows.insert(pos - first, entry)
+                    return
+                elif kind == REMOVE and pos == first:
+                    rows.append(entry)
+                    return
+                elif kind == REMOVE and pos == first - 1:
+                    last[1] = pos
+                    rows.insert(0, entry)
+                    return
+        self._ops.append([kind, pos, [entry]])
+
+    def _insert_at(self, pos, key, entry):
+        """Insert into the live visible rows"""
+        self._keys.insert(pos, key)
+        self._visible.insert(pos, entry)
+        self._record(INSERT, pos, entry)
+
+    def _remove_at(self, pos):
+        """Remove from the live visible rows"""
+        del self._keys[pos]
+        entry = self._visible.pop(pos)
+        self._changed.pop(id(entry), None)
+        self._record(REMOVE, pos, entry)
+
+    def _visible_pos(self, entry):
+        """Return the live position of an entry (or C{None} if hidden)"""
+        key = self._sort_keys.get(id(entry))
+        if key is None:
+            return None
+        pos = bisect.bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return pos
+        return None
+
+    def add(self, entry):
+        """Add an entry (in O(log n) comparisons, without re-sorting)"""
+        if id(entry) in self._entries:
+            return self.changed(entry)
+        self._entries[id(entry)] = entry
+        key = self.sort_key(entry)
+        if self._filter and not self._filter(entry):
+            return
+        self._insert_at(bisect.bisect_left(self._keys, key), key, entry)
+
+    def extend(self, entries):
+        """Add several entries"""
+        for entry in entries:
+            self.add(entry)
+
+    def remove(self, entry):
+        """Remove an entry (if present)"""
+        if self._entries.pop(id(entry), None) is None:
+            return
+        pos = self._visible_pos(entry)
+        if pos is not None:
+            self._remove_at(pos)
+        del self._sort_keys[id(entry)]
+
+    def changed(self, entry):
+        """Call after modifying an entry in place to update its sort
+        position, filter status, and displayed data.
+        """
+        if id(entry) not in self._entries:
+            return
+        old_pos = self._visible_pos(entry)
+        old_key = self._sort_keys.pop(id(entry))
+        key = self.sort_key(entry)
+        if key[0] == old_key[0]:
+            # Keep the old tie-breaker so unrenamed entries don't move
+            key = self._sort_keys[id(entry)] = old_key
+
+        visible = not self._filter or self._filter(entry)
+        if old_pos is not None and (not visible or key != old_key):
+            self._remove_at(old_pos)
+            old_pos = None
+
+        if old_pos is not None:
+            if not self.pending and self.on_pending:
+                self.on_pending()
+            self._changed[id(entry)] = entry
+        elif visible:
+            self._insert_at(bisect.bisect_left(self._keys, key), key, entry)
+
+    def set_filter(self, predicate):
+        """Show only entries for which C{predicate(entry)} is true
+        (or all entries if C{None}).
+
+        Rows are inserted and removed in place, as adjacent ranges where
+        possible, rather than the whole view being reset.
+        """
+        self._filter = predicate
+        pos = 0
+        for entry in self.entries:
+            key = self._sort_keys[id(entry)]
+            shown = pos < len(self._keys) and self._keys[pos] == key
+            wanted = not predicate or predicate(entry)
+            if shown and not wanted:
+                self._remove_at(pos)
+            elif wanted and not shown:
+                self._insert_at(pos, key, entry)
+                pos += 1
+            elif shown:
+                pos += 1
+
+    # -- Publishing changes --
+
+    def connect(self, listener):
+        """Register a L{ModelListener}"""
+        self.listeners.append(listener)
+
+    def disconnect(self, listener):
+        """Unregister a L{ModelListener}"""
+        self.listeners.remove(listener)
+
+    def _emit(self, kind, first, count, apply_change=None):
+        """Notify listeners of one range around applying it to L{rows}"""
+        for listener in self.listeners:
+            listener.rows_about_to_change(kind, first, count)
+        if apply_change:
+            apply_change()
+        for listener in self.listeners:
+            listener.rows_changed(kind, first, count)
+
+    def flush(self):
+        """Publish all pending changes to L{rows} and the listeners.
+
+        @returns: The list of C{(kind, first, count)} ranges published.
+        """
+        ops, self._ops = self._ops, []
+        changed, self._changed = self._changed, {}
+        rows, published = self.rows, []
+
+        for kind, first, entries in ops:
+            count = len(entries)
+            if kind == INSERT:
+                def apply_change(first=first, entries=entries):
+                    """Insert the rows the range covered"""
+                    rows[first:first] = entries
+            else:
+                def apply_change(first=first, count=count):
+                    """Delete the rows the range covered"""
+                    del rows[first:first + count]
+            self._emit(kind, first, count, apply_change)
+            published.append((kind, first, count))
+
+        positions = sorted(self._visible_pos(x) for x in changed.values())
+        for _, group in itertools.groupby(enumerate(positions),
+                                          lambda x: x[1] - x[0]):
+            group = [x[1] for x in group]
+            self._emit(CHANGE, group[0], len(group))
+            published.append((CHANGE, group[0], len(group)))
+        return published
+
+class RowBatcher(object):
+    """Accumulates rows from a loader thread and hands them to C{emit} in
+    chunks, so populating a view costs one main-loop callback per batch
+    rather than one per row.
+
+    A batch is emitted once it reaches C{max_rows} or its first row has
+    waited C{max_delay} seconds (checked as rows arrive), and by L{flush}.
+    """
+
+    def __init__(self, emit, max_rows=BATCH_ROWS, max_delay=BATCH_DELAY,
+                 clock=time.time):
+        """
+        @param emit: Called with each batch (a list of rows). This will be
+            called from the loader thread, so it should just schedule the
+            real work (eg. via C{gobject.idle_add}).
+        """
+        self.emit = emit
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.clock = clock
+
+        self.rows = 0
+        self.batches = 0
+        self.started = None
+        self.finished = None
+        self._batch, self._batch_started = [], None
+
+    def add(self, row):
+        """Queue a row for the next batch"""
+        now = self.clock()
+        if self.started is None:
+            self.started = now
+        if not self._batch:
+            self._batch_started = now
+        self._batch.append(row)
+        if (len(self._batch) >= self.max_rows or
+                now - self._batch_started >= self.max_delay):
+            self.flush()
+
+    def extend(self, rows):
+        """Queue several rows"""
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """Emit any queued rows now"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        self.rows += len(batch)
+        self.batches += 1
+        self.finished = self.clock()
+        self.emit(batch)
+
+    @property
+    def throughput(self):
+        """Rows handed off per second so far (C{None} before any were)"""
+        if not self.rows:
+            return None
+        return self.rows / max(self.finished - self.started, 1e-6)
+
+    def log_stats(self, what="rows"):
+        """Log the row count, batch count, and throughput"""
+        if self.rows:
+            log.info("Populated %d %s in %d batches (%.0f/s)", self.rows,
+                     what, self.batches, self.throughput)
+
+# vim: set sw=4 sts=4 expandtab :
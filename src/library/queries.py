@@ -0,0 +1,360 @@
+"""Saved queries like "What haven't I played recently?" and random picks
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Queries use the tag filter syntax (See L{src.library.tags.parse_filter})
+with a few extra kinds of term::
+
+    played<30d      Started within the last 30 days
+    played>2w       Not started within the last 2 weeks (or never)
+    played:never    Never started
+    playtime>10h    More than 10 hours played in total
+    playtime<30m    Less than 30 minutes played (including never)
+    name:trine      Name contains "trine"
+    provider:gog    Found by a provider with "gog" in its name
+    co-op           Any other term is a user-assigned tag
+
+Durations take an C{s}, C{m}, C{h}, C{d}, C{w}, or C{y} suffix and default
+to days for C{played} and hours for C{playtime}.
+
+Each query compiles to a single SQL C{WHERE} clause over the library store
+so SQLite's indexes do the work, except that queries made only of
+user-assigned tags are answered from a L{TagIndex} of the visible entries
+instead. Results are kept materialized, both as a list (for O(1) random
+picks) and a position dict (for O(1) removals), and are patched one entry
+at a time via L{QueryEngine.entry_changed} rather than being re-run
+whenever a session ends or an entry is renamed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, random, re, time
+
+from .tags import FilterSyntaxError, TagIndex, parse_filter
+
+log = logging.getLogger(__name__)
+
+# Results of queries involving the current time (eg. played>30d) drift as
+# time passes, so fully re-run them after this many seconds
+REFRESH_INTERVAL = 3600
+
+# Stands in for the current time in compiled query parameters
+NOW = object()
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400,
+         'y': 365 * 86400}
+_duration_re = re.compile(r'^(\d+(?:\.\d+)?)([smhdwy]?)$')
+_comparison_re = re.compile(r'^(played|playtime)([<>])(.+)$')
+
+# Only the entries seen by the latest scan which the user hasn't hidden
+BASE_QUERY = """SELECT e.identity FROM entries e
+LEFT JOIN overrides o ON o.identity = e.identity
+WHERE e.last_seen >= (SELECT MAX(last_seen) FROM entries)
+AND NOT COALESCE(o.hidden, 0)"""
+
+def parse_duration(text, default_unit):
+    """Parse a duration like C{30d} into seconds
+
+    @raises FilterSyntaxError: If C{text} isn't a valid duration.
+    """
+    match = _duration_re.match(text)
+    if not match:
+        raise FilterSyntaxError("Invalid duration: %s" % text)
+    return float(match.group(1)) * UNITS[match.group(2) or default_unit]
+
+def _like(text):
+    """Escape text for a substring C{LIKE} pattern"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+
+def is_tag_term(term):
+    """Whether a query term is a user-assigned tag (rather than a test of
+    play history, names, or providers)
+    """
+    return not (_comparison_re.match(term) or term == 'played:never' or
+                term.startswith(('name:', 'provider:')))
+
+def tags_only(tree):
+    """Whether a parsed query (See L{parse_filter}) involves nothing but
+    user-assigned tags, so a L{TagIndex} can answer it
+    """
+    if tree is None:
+        return True
+    kind, arg = tree
+    if kind == 'tag':
+        return is_tag_term(arg)
+    elif kind == 'not':
+        return tags_only(arg)
+    return all(tags_only(x) for x in arg)
+
+def compile_term(term):
+    """Compile one query term into a C{(sql, params, time_based)} tuple.
+
+    (C{sql} is a condition on the C{e} and C{o} aliases of L{BASE_QUERY}
+     and L{NOW} in C{params} must be replaced with the current time.)
+    """
+    match = _comparison_re.match(term)
+    if match:
+        field, operator, value = match.groups()
+        if field == 'played':
+            since = parse_duration(value, 'd')
+            sql = ("e.identity %sIN (SELECT identity FROM sessions "
+                   "WHERE started >= ? - ?)" %
+                   ('' if operator == '<' else 'NOT '))
+            return sql, [NOW, since], True
+
+        total = parse_duration(value, 'h')
+        sql = ("e.identity %sIN (SELECT identity FROM sessions "
+               "WHERE ended IS NOT NULL GROUP BY identity "
+               "HAVING SUM(ended - started) %s ?)" %
+               (('', '>') if operator == '>' else ('NOT ', '>=')))
+        return sql, [total], False
+
+    if term == 'played:never':
+        return ("e.identity NOT IN (SELECT identity FROM sessions)",
+                [], False)
+    elif term.startswith('name:'):
+        return ("COALESCE(o.name, e.name) LIKE ? ESCAPE '\\'",
+                [_like(term[5:])], False)
+    elif term.startswith('provider:'):
+        return ("e.providers LIKE ? ESCAPE '\\'",
+                [_like(term[9:])], False)
+    return ("e.identity IN (SELECT identity FROM tags "
+            "WHERE tag = ? COLLATE NOCASE)", [term], False)
+
+def compile_query(expression):
+    """Compile a query into a C{(sql, params, time_based)} tuple.
+
+    @raises FilterSyntaxError: If the expression is malformed.
+    """
+    def walk(node):
+        """Compile a node of the L{parse_filter} tree"""
+        kind, arg = node
+        if kind == 'tag':
+            return compile_term(arg)
+        elif kind == 'not':
+            sql, params, time_based = walk(arg)
+            return 'NOT (%s)' % sql, params, time_based
+
+        parts = [walk(x) for x in arg]
+        return ('(%s)' % (' %s ' % kind.upper()).join(x[0] for x in parts),
+                [y for x in parts for y in x[1]], any(x[2] for x in parts))
+
+    tree = parse_filter(expression)
+    if tree is None:
+        return BASE_QUERY, [], False
+    sql, params, time_based = walk(tree)
+    return '%s AND %s' % (BASE_QUERY, sql), params, time_based
+
+class SavedQuery(object):
+    """A named, compiled query and its materialized results"""
+
+    def __init__(self, name, expression):
+        """
+        @raises FilterSyntaxError: If the expression is malformed.
+        """
+        self.name = name
+        self.expression = expression
+        self.sql, self._params, self.time_based = compile_query(expression)
+        self.tree = parse_filter(expression)
+        self.tags_only = tags_only(self.tree)
+        self.results = []       # Identities, in no particular order
+        self._positions = {}    # Identity -> index in results
+        self.refreshed = None
+
+    def params(self, now):
+        """Return the SQL parameters for a run at time C{now}"""
+        return [now if x is NOW else x for x in self._params]
+
+    def clear(self):
+        """Empty the materialized results"""
+        self.results, self._positions = [], {}
+
+    def add(self, identity):
+        """Add an identity to the materialized results in O(1)"""
+        if identity not in self._positions:
+            self._positions[identity] = len(self.results)
+            self.results.append(identity)
+
+    def discard(self, identity):
+        """Remove an identity from the materialized results in O(1) by
+        swapping the last result into its place.
+        """
+        pos = self._positions.pop(identity, None)
+        if pos is None:
+            return
+        last = self.results.pop()
+        if pos < len(self.results):
+            self.results[pos] = last
+            self._positions[last] = pos
+
+    def __contains__(self, identity):
+        return identity in self._positions
+
+    def __len__(self):
+        return len(self.results)
+
+class QueryEngine(object):
+    """Maintains the materialized results of the user's saved queries"""
+
+    def __init__(self, store, clock=time.time):
+        """
+        @param store: The L{LibraryStore} to query and persist queries in.
+        @param clock: Returns the current time. (For testing)
+        """
+        self.store = store
+        self.clock = clock
+        self.queries = {}
+
+        # User-assigned tags of the visible entries, keyed by identity
+        self.tags = TagIndex()
+        self._tagged = {}       # Identity -> the object self.tags holds
+        self._tags_scan = None  # Which scan self.tags was loaded from
+        for name, expression in store.get_saved_queries().items():
+            try:
+                self.queries[name] = SavedQuery(name, expression)
+            except FilterSyntaxError as err:
+                log.warning("Ignoring broken saved query %r: %s", name, err)
+
+    def define(self, name, expression):
+        """Add or replace a saved query
+
+        @raises FilterSyntaxError: If the expression is malformed.
+        """
+        query = SavedQuery(name, expression)
+        self.store.save_query(name, expression)
+        self.queries[name] = query
+        return query
+
+    def delete(self, name):
+        """Delete a saved query"""
+        self.store.delete_query(name)
+        self.queries.pop(name, None)
+
+    def _sync_tags(self):
+        """(Re)load the tag index if a scan has changed what's visible"""
+        latest = self.store.conn.execute(
+            "SELECT MAX(last_seen) FROM entries").fetchone()[0]
+        if latest == self._tags_scan:
+            return
+
+        tags = self.store.get_tags()
+        self.tags, self._tagged = TagIndex(), {}
+        for (identity,) in self.store.conn.execute(BASE_QUERY):
+            self._tagged[identity] = identity
+            self.tags.add(identity, tags.get(identity, ()))
+        self._tags_scan = latest
+
+    def _retag(self, identity):
+        """Reload one entry's visibility and tags into the tag index"""
+        key = self._tagged.pop(identity, None)
+        if key is not None:
+            self.tags.remove(key)
+
+        conn = self.store.conn
+        if conn.execute(BASE_QUERY + " AND e.identity = ?",
+                        (identity,)).fetchone():
+            self._tagged[identity] = identity
+            self.tags.add(identity, [x[0] for x in conn.execute(
+                "SELECT tag FROM tags WHERE identity = ?", (identity,))])
+
+    def _run(self, query, identity=None):
+        """Run a query, optionally restricted to one identity"""
+        if query.tags_only:
+            self._sync_tags()
+            if identity is None:
+                return self.tags.filter(query.tree)
+            key = self._tagged.get(identity)
+            return [identity] if key is not None and self.tags.matches(
+                key, query.tree) else []
+
+        sql, params = query.sql, query.params(self.clock())
+        if identity is not None:
+            sql += " AND e.identity = ?"
+            params.append(identity)
+        return [x[0] for x in self.store.conn.execute(sql, params)]
+
+    def evaluate(self, expression):
+        """Run an unsaved query and return the matching identities
+
+        @raises FilterSyntaxError: If the expression is malformed.
+        """
+        return self._run(SavedQuery(None, expression))
+
+    def tag_counts(self, expression=None):
+        """Return a dict mapping user-assigned tags to how many visible
+        entries matching C{expression} (default: all) have each, omitting
+        zeroes, for showing how far each further tag would narrow a filter.
+
+        @raises FilterSyntaxError: If the expression is malformed.
+        """
+        query = SavedQuery(None, expression or '')
+        self._sync_tags()
+        if query.tags_only:
+            bits = self.tags.evaluate(query.tree)
+        else:
+            bits = self.tags.bits_for(self._tagged[x]
+                                      for x in self._run(query)
+                                      if x in self._tagged)
+        return self.tags.counts(bits)
+
+    def refresh(self, name):
+        """Re-run a query from scratch and return it"""
+        query = self.queries[name]
+        query.clear()
+        for identity in self._run(query):
+            query.add(identity)
+        query.refreshed = self.clock()
+        return query
+
+    def get(self, name):
+        """Return a L{SavedQuery}, (re-)running it only if necessary"""
+        query = self.queries[name]
+        if query.refreshed is None or (query.time_based and
+                self.clock() - query.refreshed > REFRESH_INTERVAL):
+            self.refresh(name)
+        return query
+
+    def results(self, name):
+        """Return the identities matching a saved query (in no order)"""
+        return list(self.get(name).results)
+
+    def entry_changed(self, identity):
+        """Update all materialized results for one changed entry.
+
+        Call this when a session ends or an entry is renamed, hidden, or
+        (un)tagged. Each already-materialized query is re-checked against
+        just that entry via the C{identity} index.
+        """
+        if self._tags_scan is not None:
+            self._retag(identity)
+        for query in self.queries.values():
+            if query.refreshed is None:
+                continue
+            if self._run(query, identity):
+                query.add(identity)
+            else:
+                query.discard(identity)
+
+    def pick(self, name, rand=random):
+        """Pick one matching identity at random in O(1) (or C{None})"""
+        results = self.get(name).results
+        return rand.choice(results) if results else None
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,455 @@
+"""Incremental search over game names, keywords, and categories
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Query words of three or more characters are looked up in a trigram index
+(so "goat" finds "Escape Goat 2" as well as "Goat Simulator") while shorter
+ones are looked up in a word-prefix index, since one or two letters
+match something in nearly every title as a substring.
+
+Queries never score every hit. Each prefix and trigram has a list of the
+entries containing it kept in rank order (recently-played first, then by
+name), so each match tier is read straight out of one of them and ranking
+stops as soon as enough results have been found. Even a one-letter query
+against 10,000 games only touches the handful of entries it returns.
+
+Multi-word queries walk the lists of whichever word's best tier is rarest,
+with each of its tiers capped at the best total score anything in it could
+reach, so they stop once nothing left unread could beat what's been found.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import bisect, heapq, re
+from itertools import chain, compress
+from operator import itemgetter
+
+from ..util import profiling
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+_camel_re = re.compile(r'(?<=[a-z])(?=[A-Z])')
+
+# Points per query word, by where it matched
+SCORE_NAME_START = 4    # The start of the name
+SCORE_NAME_WORD = 3     # The start of a word in the name
+SCORE_NAME = 2          # Anywhere in the name
+SCORE_KEYWORD = 1       # A keyword or category
+
+# Query words shorter than this use the word-prefix index
+TRIGRAM_MIN = 3
+
+# Longest name (and name word) prefix with its own ranked list. Longer
+# query words are filtered while walking the list for this much of them.
+PREFIX_MAX = 8
+
+# Categories too generic to be worth matching on
+IGNORED_CATEGORIES = ('game',)
+
+def fold(text):
+    """Normalize text for case-insensitive matching"""
+    return text.casefold() if hasattr(text, 'casefold') else text.lower()
+
+def tokenize(text):
+    """Split text into casefolded words"""
+    return _word_re.findall(fold(text or ''))
+
+def trigrams(word):
+    """Return the set of three-character substrings of C{word}"""
+    return set(word[i:i + 3] for i in range(len(word) - 2))
+
+def entry_keywords(entry):
+    """Gather the keywords and categories from all of an entry's launchers
+
+    (XDG categories like C{ActionGame} are split on their capital letters so
+     they can be searched for as C{action}.)
+    """
+    words = []
+    for cmd in entry.commands:
+        for field, split in ((getattr(cmd, 'keywords', None), False),
+                             (getattr(cmd, 'categories', None), True)):
+            if isinstance(field, (list, tuple, set)):
+                field = ' '.join(field)
+            if split and field:
+                field = _camel_re.sub(' ', field)
+            words.extend(tokenize(field))
+    return sorted(set(words) - set(IGNORED_CATEGORIES))
+
+def _is_chain(word, other):
+    """Return C{True} if one word is a prefix of the other, so a name could
+    start with both
+    """
+    return word.startswith(other) or other.startswith(word)
+
+class _Document(object):
+    """The pre-digested searchable form of one entry
+
+    (C{word_text} and C{keyword_text} start with a space so that
+     C{' ' + word in text} checks whether any word starts with C{word}
+     without a Python-level loop.)
+    """
+    __slots__ = ('entry', 'name', 'name_words', 'word_text', 'keywords',
+                 'keyword_text')
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.name = fold(' '.join(entry.name.split()))
+        self.name_words = tokenize(entry.name)
+        self.word_text = ' ' + ' '.join(self.name_words)
+        self.keywords = entry_keywords(entry)
+        self.keyword_text = ' ' + ' '.join(self.keywords)
+
+    @property
+    def words(self):
+        """Every indexable word"""
+        return set(self.name_words) | set(self.keywords)
+
+class SearchIndex(object):
+    """Ranked search over a set of L{GameEntry} objects
+
+    Entries are tracked by object identity, so call L{update} after
+    changing an entry's name (or launchers) in place.
+    """
+
+    def __init__(self, entries=(), last_played=None):
+        """
+        @param last_played: A dict mapping identities to the last time
+            each game was played (See L{LibraryStore.get_last_played}), for
+            breaking ties in favour of recently-played games.
+        """
+        self._docs = {}
+        self._ranks = {}
+        self._trigrams = {}
+        self._prefixes = {}
+
+        # Lists of (rank, key) pairs kept in rank order (See _rank) for
+        # reading each match tier out best-first
+        self._name_starts = {}      # Name prefix (up to PREFIX_MAX)
+        self._word_starts = {}      # Name word prefix (up to PREFIX_MAX)
+        self._keyword_starts = {}   # Keyword prefix (shorter than trigrams)
+        self._name_trigrams = {}    # Trigram of a name word
+        self._keyword_trigrams = {} # Trigram of a keyword
+
+        self.last_played = last_played or {}
+
+        # Sort each ranked list once rather than insort()ing every entry
+        for entry in entries:
+            if id(entry) not in self._docs:
+                self._add(entry, list.append)
+        for postings in (self._name_starts, self._word_starts,
+                         self._keyword_starts, self._name_trigrams,
+                         self._keyword_trigrams):
+            for ranked in postings.values():
+                ranked.sort()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _rank(self, key, doc):
+        """Return the order of a document within a match tier:
+        recently-played first (most recent first), then by name.
+        """
+        when = self.last_played.get(getattr(doc.entry, 'identity', None))
+        if when:
+            return (0, -when, doc.name, key)
+        return (1, 0, doc.name, key)
+
+    def _ranked_postings(self, doc):
+        """Yield C{(postings, text)} for each ranked list C{doc} belongs in
+        """
+        for length in range(1, min(len(doc.name), PREFIX_MAX) + 1):
+            yield self._name_starts, doc.name[:length]
+        for word in set(doc.name_words):
+            for length in range(1, min(len(word), PREFIX_MAX) + 1):
+                yield self._word_starts, word[:length]
+        for text in set(x[:y] for x in doc.keywords
+                        for y in range(1, TRIGRAM_MIN)):
+            yield self._keyword_starts, text
+        for gram in set(chain(*[trigrams(x) for x in doc.name_words])):
+            yield self._name_trigrams, gram
+        for gram in set(chain(*[trigrams(x) for x in doc.keywords])):
+            yield self._keyword_trigrams, gram
+
+    def _insert_ranked(self, key, doc, insert=bisect.insort):
+        """Add a document to its ranked lists"""
+        pair = self._ranks[key] = (self._rank(key, doc), key)
+        for postings, text in self._ranked_postings(doc):
+            insert(postings.setdefault(text, []), pair)
+
+    def _remove_ranked(self, key, doc):
+        """Remove a document from its ranked lists"""
+        pair = self._ranks.pop(key)
+        for postings, text in self._ranked_postings(doc):
+            ranked = postings[text]
+            del ranked[bisect.bisect_left(ranked, pair)]
+            if not ranked:
+                del postings[text]
+
+    def add(self, entry):
+        """Add an entry to the index (or refresh it if already present)"""
+        if id(entry) in self._docs:
+            self.remove(entry)
+        self._add(entry, bisect.insort)
+
+    def _add(self, entry, insert):
+        """Index an entry which isn't already present"""
+        key = id(entry)
+        doc = self._docs[key] = _Document(entry)
+
+        for word in doc.words:
+            for gram in trigrams(word):
+                self._trigrams.setdefault(gram, set()).add(key)
+            for length in range(1, TRIGRAM_MIN):
+                if len(word) >= length:
+                    self._prefixes.setdefault(word[:length], set()).add(key)
+        self._insert_ranked(key, doc, insert)
+
+    def remove(self, entry):
+        """Remove an entry from the index (if present)"""
+        key = id(entry)
+        doc = self._docs.pop(key, None)
+        if not doc:
+            return
+
+        for word in doc.words:
+            for gram in trigrams(word):
+                postings = self._trigrams.get(gram)
+                if postings:
+                    postings.discard(key)
+                    if not postings:
+                        del self._trigrams[gram]
+            for length in range(1, TRIGRAM_MIN):
+                postings = self._prefixes.get(word[:length])
+                if postings:
+                    postings.discard(key)
+                    if not postings:
+                        del self._prefixes[word[:length]]
+        self._remove_ranked(key, doc)
+
+    # Re-adding handles updates since add() removes stale postings first
+    update = add
+
+    def touch(self, entry, when):
+        """Record that an entry was just played (for ranking)"""
+        identity = getattr(entry, 'identity', None)
+        if identity:
+            self.last_played[identity] = when
+            doc = self._docs.get(id(entry))
+            if doc:
+                self._remove_ranked(id(entry), doc)
+                self._insert_ranked(id(entry), doc)
+
+    def _candidates(self, word):
+        """Return a set of document keys including all which match C{word}
+
+        (Just the rarest of its trigrams' sets, since intersecting them
+         costs more than the extra L{_score} calls it would save.)
+        """
+        if len(word) < TRIGRAM_MIN:
+            return self._prefixes.get(word, set())
+        return min((self._trigrams.get(x, set()) for x in trigrams(word)),
+                   key=len)
+
+    def _score(self, doc, words):
+        """Score a document or return 0 if any query word doesn't match"""
+        total = 0
+        for word in words:
+            if doc.name.startswith(word):
+                total += SCORE_NAME_START
+            elif ' ' + word in doc.word_text:
+                total += SCORE_NAME_WORD
+            elif len(word) >= TRIGRAM_MIN and word in doc.name:
+                total += SCORE_NAME
+            elif (' ' + word in doc.keyword_text or
+                  (len(word) >= TRIGRAM_MIN and word in doc.keyword_text)):
+                total += SCORE_KEYWORD
+            else:
+                return 0
+        return total
+
+    @staticmethod
+    def _rarest(postings, word):
+        """Return the shortest ranked list for any of C{word}'s trigrams"""
+        return min((postings.get(x, ()) for x in trigrams(word)), key=len)
+
+    def _tiers(self, word):
+        """Return C{(score, ranked)} for each of C{word}'s match tiers, best
+        first, where C{ranked} holds every entry matching at that tier.
+        (Along with some which match better or, for long words and
+        trigrams, not at all.)
+        """
+        prefix = word[:PREFIX_MAX]
+        tiers = [(SCORE_NAME_START, self._name_starts.get(prefix, ())),
+                 (SCORE_NAME_WORD, self._word_starts.get(prefix, ()))]
+        if len(word) >= TRIGRAM_MIN:
+            tiers += [(SCORE_NAME, self._rarest(self._name_trigrams, word)),
+                      (SCORE_KEYWORD,
+                       self._rarest(self._keyword_trigrams, word))]
+        else:
+            tiers.append((SCORE_KEYWORD, self._keyword_starts.get(word, ())))
+        return tiers
+
+    def _search_word(self, word, limit):
+        """Rank-ordered results for a one-word query without scoring every
+        hit, since each match tier can be read out of a ranked list.
+
+        (Each tier is only reached once every better one has been used up,
+         so anything not yet C{seen} which matches at all belongs to it.
+         Words longer than L{PREFIX_MAX} or matched via trigrams are
+         filtered while walking the list, in rank order, so only as much of
+         it as it takes to fill C{limit} is ever looked at.)
+        """
+        docs = self._docs
+        tests = [None, None]
+        if len(word) > PREFIX_MAX:
+            tests = [lambda doc: doc.name.startswith(word),
+                     lambda doc: ' ' + word in doc.word_text]
+        if len(word) >= TRIGRAM_MIN:
+            tests += [lambda doc: word in doc.name,
+                      lambda doc: word in doc.keyword_text]
+
+        results, seen, walked = [], set(), 0
+        for (_, ranked), test in zip(self._tiers(word), tests + [None]):
+            for _, key in ranked:
+                if limit is not None and len(results) >= limit:
+                    break
+                walked += 1
+                if key not in seen and (test is None or test(docs[key])):
+                    seen.add(key)
+                    results.append(key)
+
+        # How much of the postings had to be skipped to fill the results
+        profiling.count('search_hit', len(results))
+        profiling.count('search_miss', walked - len(results))
+        return results
+
+    @staticmethod
+    def _bounds(driver, words, tiers):
+        """Return C{{bound: [ranked, ...]}} for the tiers of C{driver}
+        (one of C{words}), where C{bound} is the best total score anything
+        in those tiers could reach.
+
+        @param tiers: L{_tiers} for each of C{words}.
+        """
+        others = list(words)
+        others.remove(driver)
+        best = dict((x, max([y for y, z in tiers[x] if z] or [0]))
+                    for x in others)
+
+        # Several words can only start the same name if each is a prefix
+        # of the next, so score the others as name words plus a bonus for
+        # the most of them that could start it together
+        base = sum(min(best[x], SCORE_NAME_WORD) for x in others)
+        starts = [x for x in others if best[x] == SCORE_NAME_START]
+
+        bounds = {}
+        for score, ranked in tiers[driver]:
+            if not ranked:
+                continue
+            leaders = [driver] if score == SCORE_NAME_START else starts
+            bonus = max([sum(1 for x in starts if _is_chain(x, y))
+                         for y in leaders] or [0])
+            bound = score + base + bonus * (SCORE_NAME_START -
+                                            SCORE_NAME_WORD)
+
+            group = bounds.setdefault(bound, [])
+            if score == SCORE_NAME_WORD and group and (
+                    group[-1] is tiers[driver][0][1]):
+                # (Anything starting the name starts a word too)
+                group.pop()
+            group.append(ranked)
+        return bounds
+
+    def _search_words(self, words, limit):
+        """Rank-ordered results for a multi-word query which only score as
+        many entries as it takes to be sure of the best C{limit}.
+
+        (Tiers with the same bound are walked together in rank order,
+         skipping anything the other words' candidate sets rule out. Once
+         C{limit} results either beat the bound or tie it with a better
+         rank than the walk has reached, nothing left unread could
+         displace them.)
+        """
+        # Drive from the word whose best tier is rarest, since that's where
+        # the walk will usually stop
+        tiers = dict((x, self._tiers(x)) for x in words)
+        driver = min(words, key=lambda x: min(
+            [len(y) for _, y in tiers[x] if y] or [0]))
+        bounds = self._bounds(driver, words, tiers)
+
+        # Filter by the rarest word first so the lists shrink fastest
+        sets = sorted((self._candidates(x) for x in words if x != driver),
+                      key=len)
+        keys = sets[0].intersection(*sets[1:]) if sets else None
+
+        results, seen, walked = [], set(), 0
+        for bound in sorted(bounds, reverse=True):
+            above = sum(1 for x in results if -x[0] > bound)
+            ties = sorted(x[1] for x in results if -x[0] == bound)
+            group = bounds[bound]
+            ranked = (group[0] if len(group) == 1
+                      else list(heapq.merge(*group)))
+            if keys is not None:
+                # (Skip the other words' non-matches without a Python-level
+                #  loop, since they're most of what gets walked past.)
+                ranked = compress(ranked, map(keys.__contains__,
+                                              map(itemgetter(1), ranked)))
+
+            for rank, key in ranked:
+                if limit is not None and (
+                        above + bisect.bisect_left(ties, rank) >= limit):
+                    break
+                if key in seen:
+                    continue
+                seen.add(key)
+                walked += 1
+
+                score = self._score(self._docs[key], words)
+                if score == bound:
+                    above += 1  # (Anything still unread ranks after it)
+                if score:
+                    results.append((-score, rank, key))
+            else:
+                continue
+            break
+
+        results.sort()
+        results = results[:limit]
+        profiling.count('search_hit', len(results))
+        profiling.count('search_miss', walked - len(results))
+        return [x[2] for x in results]
+
+    def search(self, query, limit=50):
+        """Return the best-matching entries for a query, best first.
+
+        Ranked by match quality, then by how recently they were played,
+        then by name.
+
+        @param limit: Maximum results to return (C{None} for all)
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        if len(words) == 1:
+            keys = self._search_word(words[0], limit)
+        else:
+            keys = self._search_words(words, limit)
+        return [self._docs[x].entry for x in keys]
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,120 @@
+"""Tracking of which games are running and for how long
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+To stay well under 0.1% CPU while a game is running, process trees are
+polled adaptively: quickly right after a launch (to catch wrappers forking
+the real binary) and then backing off to L{MAX_INTERVAL} for as long as
+nothing changes.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import logging, time
+
+from ..util.proctree import ProcessTree
+
+log = logging.getLogger(__name__)
+
+# Polling interval bounds in seconds
+MIN_INTERVAL = 0.25
+MAX_INTERVAL = 5.0
+
+class Session(object):
+    """One run of a game"""
+
+    def __init__(self, entry, pid, session_id=None):
+        self.entry = entry
+        self.tree = ProcessTree(pid)
+        self.session_id = session_id
+        self.started = time.time()
+        self.ended = None
+
+    @property
+    def duration(self):
+        """Seconds the game has been running (so far, if still running)"""
+        return (self.ended or time.time()) - self.started
+
+    def __repr__(self):
+        return "<Session %r pids=%r>" % (self.entry.name,
+                                         sorted(self.tree.known))
+
+class SessionTracker(object):
+    """Follows the process trees of launched games and records sessions.
+
+    Frontends should call L{poll} again after L{interval} seconds for as
+    long as L{sessions} is non-empty.
+    """
+
+    def __init__(self, store=None, on_end=None):
+        """
+        @param store: A L{src.library.store.LibraryStore} to record sessions
+            in, if any.
+        @param on_end: Called as C{on_end(session)} when a game's entire
+            process tree has exited.
+        """
+        self.store = store
+        self.on_end = on_end
+        self.sessions = []
+        self.interval = MIN_INTERVAL
+
+    def track(self, entry, pid):
+        """Start tracking a game launched as C{pid}
+
+        @returns: The new L{Session}
+        """
+        session = Session(entry, pid)
+        if self.store:
+            session.session_id = self.store.start_session(entry,
+                                                          session.started)
+        self.sessions.append(session)
+        self.interval = MIN_INTERVAL
+        return session
+
+    def is_running(self, entry):
+        """Whether any process launched for C{entry} is still running"""
+        return any(x.entry is entry for x in self.sessions)
+
+    def poll(self):
+        """Refresh all process trees and finish sessions which have ended.
+
+        @returns: A list of the L{Session} objects which ended.
+        """
+        changed, ended = False, []
+        for session in self.sessions[:]:
+            changed |= session.tree.refresh()
+            if session.tree.alive:
+                continue
+
+            session.ended = time.time()
+            self.sessions.remove(session)
+            ended.append(session)
+            log.info("%s ran for %.0fs", session.entry.name, session.duration)
+
+            if self.store and session.session_id is not None:
+                self.store.end_session(session.session_id, session.ended)
+            if self.on_end:
+                self.on_end(session)
+
+        self.interval = (MIN_INTERVAL if changed else
+                         min(self.interval * 2, MAX_INTERVAL))
+        return ended
+
+# vim: set sw=4 sts=4 expandtab :
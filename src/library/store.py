@@ -0,0 +1,380 @@
+"""SQLite-backed persistent storage for the game library
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Records are never flushed when a game disappears from a scan so that user
+overrides (names, hidden flags, default launchers) come back if the game is
+ever reinstalled.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import json, logging, os, sqlite3, time
+from collections import namedtuple
+
+from . import DATA_DIR
+from .identity import IdentityResolver
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, 'library.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    identity TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    icon TEXT,
+    base_path TEXT,
+    description TEXT,
+    providers TEXT,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS entries_last_seen ON entries (last_seen);
+
+CREATE TABLE IF NOT EXISTS launchers (
+    entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT,
+    provider TEXT,
+    role INTEGER,
+    argv TEXT NOT NULL,
+    path TEXT,
+    tryexec TEXT,
+    use_terminal INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (entry_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS identity_keys (
+    key TEXT PRIMARY KEY,
+    identity TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS identity_keys_identity
+    ON identity_keys (identity);
+
+CREATE TABLE IF NOT EXISTS overrides (
+    identity TEXT PRIMARY KEY,
+    name TEXT,
+    hidden INTEGER NOT NULL DEFAULT 0,
+    default_argv TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    identity TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_identity ON sessions (identity);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+
+CREATE TABLE IF NOT EXISTS tags (
+    identity TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (identity, tag)
+);
+
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS tag_axes (
+    tag TEXT PRIMARY KEY,
+    axis TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS saved_queries (
+    name TEXT PRIMARY KEY,
+    expression TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS scan_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+Override = namedtuple('Override', 'name hidden default_argv')
+
+class LibraryStore(object):
+    """Persistent storage for scan results and user overrides"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        """
+        @param path: Path to the SQLite database. Parent directories will be
+            created as needed. (Pass C{:memory:} for a throwaway store.)
+        """
+        parent = os.path.dirname(path)
+        if path != ':memory:' and parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+        self.resolver = IdentityResolver(self.conn.execute(
+            "SELECT key, identity FROM identity_keys"))
+
+    def close(self):
+        """Close the underlying database connection"""
+        self.conn.close()
+
+    def identify(self, entries):
+        """Attach each entry to its persistent record via an C{identity}
+        attribute, remembering any new identity keys.
+
+        (Entries which already have an identity are left alone so renaming
+         an entry can't change the record it's attached to.)
+        """
+        added = self.resolver.resolve(x for x in entries
+                                      if not getattr(x, 'identity', None))
+        if added:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO identity_keys VALUES (?, ?)",
+                    added)
+
+    def _get_identity(self, entry):
+        """Return the identity of a single entry, resolving it if necessary
+        """
+        if not getattr(entry, 'identity', None):
+            self.identify([entry])
+        return entry.identity
+
+    def get_meta(self, key, default=None):
+        """Retrieve a value from the scan metadata table"""
+        row = self.conn.execute("SELECT value FROM scan_meta WHERE key = ?",
+                                (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        """Store a JSON-serializable value in the scan metadata table"""
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO scan_meta VALUES (?, ?)",
+                              (key, json.dumps(value)))
+
+    def save_scan(self, entries, duration=None):
+        """Record the results of a scan in a single transaction.
+
+        @param entries: The (un-overridden) entries produced by the scan.
+        @param duration: How long the scan took, for the scan metadata.
+        @returns: A dict mapping identities to row IDs.
+        """
+        now = time.time()
+        entries = list(entries)
+        self.identify(entries)
+
+        rows, by_identity = {}, {}
+        for entry in entries:
+            identity = getattr(entry, 'identity', None)
+            if identity is None or identity in rows:
+                log.debug("Not saving %r (identity: %s)", entry, identity)
+                continue
+            by_identity[identity] = entry
+            rows[identity] = (
+                entry.name, entry.icon, entry.base_path, entry.description,
+                json.dumps(sorted(entry.provider)), now)
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO entries (identity, name) VALUES (?, ?)",
+                [(key, row[0]) for key, row in rows.items()])
+            self.conn.executemany(
+                "UPDATE entries SET name = ?, icon = ?, base_path = ?, "
+                "description = ?, providers = ?, last_seen = ? "
+                "WHERE identity = ?",
+                [row + (key,) for key, row in rows.items()])
+
+            ids = dict((identity, row_id) for row_id, identity in
+                       self.conn.execute("SELECT id, identity FROM entries"))
+            self.conn.executemany(
+                "DELETE FROM launchers WHERE entry_id = ?",
+                [(ids[x],) for x in rows])
+            self.conn.executemany(
+                "INSERT INTO launchers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ids[identity], pos, cmd.name, cmd.provider,
+                  int(cmd.role), json.dumps(cmd.argv), cmd.path, cmd.tryexec,
+                  int(bool(cmd.use_terminal)))
+                 for identity, entry in by_identity.items()
+                 for pos, cmd in enumerate(entry.commands)])
+
+            for key, value in (('last_scan', now), ('entry_count', len(rows)),
+                               ('scan_duration', duration)):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO scan_meta VALUES (?, ?)",
+                    (key, json.dumps(value)))
+
+        log.debug("Saved %d entries in %.3fs", len(rows), time.time() - now)
+        return dict((x, ids[x]) for x in rows)
+
+    def get_overrides(self):
+        """Return a dict mapping identities to L{Override} tuples"""
+        return dict((row[0], Override(row[1], bool(row[2]),
+                                      json.loads(row[3]) if row[3] else None))
+                    for row in self.conn.execute(
+                        "SELECT identity, name, hidden, default_argv "
+                        "FROM overrides"))
+
+    def set_override(self, entry, **fields):
+        """Persist one or more user overrides for an entry.
+
+        @param fields: Any of C{name}, C{hidden}, or C{default_argv}.
+            Passing C{None} clears an override.
+        """
+        unknown = set(fields) - set(Override._fields)
+        if unknown:
+            raise TypeError("Unknown override fields: %s" % ', '.join(unknown))
+
+        if 'default_argv' in fields and fields['default_argv'] is not None:
+            fields['default_argv'] = json.dumps(fields['default_argv'])
+        if 'hidden' in fields:
+            fields['hidden'] = int(bool(fields['hidden']))
+
+        identity = self._get_identity(entry)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO overrides (identity) "
+                              "VALUES (?)", (identity,))
+            for key, value in fields.items():
+                # Field names come from Override._fields, not user input
+                self.conn.execute("UPDATE overrides SET %s = ? "
+                                  "WHERE identity = ?" % key,
+                                  (value, identity))
+
+    def start_session(self, entry, started=None):
+        """Record that a game has started running.
+
+        (Recorded immediately, rather than on exit, so a crash of the
+         launcher itself still leaves evidence the game was played.)
+
+        @returns: A session ID to pass to L{end_session}.
+        """
+        identity = self._get_identity(entry)
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO sessions (identity, started) VALUES (?, ?)",
+                (identity, started or time.time())).lastrowid
+
+    def end_session(self, session_id, ended=None):
+        """Record that the game for a session has stopped running"""
+        with self.conn:
+            self.conn.execute("UPDATE sessions SET ended = ? WHERE id = ?",
+                              (ended or time.time(), session_id))
+
+    def get_playtime(self):
+        """Return a dict mapping identities to total seconds played"""
+        return dict(self.conn.execute(
+            "SELECT identity, SUM(ended - started) FROM sessions "
+            "WHERE ended IS NOT NULL GROUP BY identity"))
+
+    def get_last_played(self):
+        """Return a dict mapping identities to when they were last started
+        """
+        return dict(self.conn.execute(
+            "SELECT identity, MAX(started) FROM sessions GROUP BY identity"))
+
+    def get_tags(self):
+        """Return a dict mapping identities to sets of user-assigned tags"""
+        tags = {}
+        for identity, tag in self.conn.execute(
+                "SELECT identity, tag FROM tags"):
+            tags.setdefault(identity, set()).add(tag)
+        return tags
+
+    def add_tags(self, entry, tags):
+        """Persist user-assigned tags for an entry"""
+        identity = self._get_identity(entry)
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)",
+                                  [(identity, x) for x in tags])
+
+    def remove_tags(self, entry, tags):
+        """Remove user-assigned tags from an entry"""
+        identity = self._get_identity(entry)
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM tags WHERE identity = ? AND tag = ?",
+                [(identity, x) for x in tags])
+
+    def get_tag_axes(self):
+        """Return a dict mapping tags to their user-assigned axes"""
+        return dict(self.conn.execute("SELECT tag, axis FROM tag_axes"))
+
+    def set_tag_axis(self, tag, axis):
+        """Assign a tag to a custom axis (or unassign it if C{axis} is
+        C{None})
+        """
+        with self.conn:
+            if axis is None:
+                self.conn.execute("DELETE FROM tag_axes WHERE tag = ?",
+                                  (tag,))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO tag_axes VALUES (?, ?)",
+                    (tag, axis))
+
+    def get_saved_queries(self):
+        """Return a dict mapping saved query names to their expressions"""
+        return dict(self.conn.execute(
+            "SELECT name, expression FROM saved_queries"))
+
+    def save_query(self, name, expression):
+        """Persist a saved query (See L{src.library.queries})"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO saved_queries VALUES (?, ?)",
+                (name, expression))
+
+    def delete_query(self, name):
+        """Delete a saved query"""
+        with self.conn:
+            self.conn.execute("DELETE FROM saved_queries WHERE name = ?",
+                              (name,))
+
+    def get_name(self, identity):
+        """Return the (possibly user-overridden) name for an identity"""
+        row = self.conn.execute(
+            "SELECT COALESCE(o.name, e.name) FROM entries e "
+            "LEFT JOIN overrides o ON o.identity = e.identity "
+            "WHERE e.identity = ?", (identity,)).fetchone()
+        return row[0] if row else None
+
+    def apply_overrides(self, entries):
+        """Apply stored user overrides to a list of entries in place.
+
+        @returns: The entries which haven't been hidden by the user.
+        """
+        entries = list(entries)
+        self.identify(entries)
+
+        overrides = self.get_overrides()
+        visible = []
+        for entry in entries:
+            override = overrides.get(getattr(entry, 'identity', None))
+            if override:
+                if override.name:
+                    entry.name = override.name
+                entry.hidden = override.hidden
+                entry.default_argv = override.default_argv
+            if not entry.hidden:
+                visible.append(entry)
+        return visible
+
+# vim: set sw=4 sts=4 expandtab :
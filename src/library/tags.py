@@ -0,0 +1,361 @@
+"""Multi-tag filtering with one bitset of entries per tag
+
+Copyright (C) 2015 Stephan Sokolow
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Each entry gets a small integer slot and each tag a Python C{int} with the
+bits of its entries' slots set, so filters like
+C{action AND (gog OR steam) AND NOT unplayed} are a handful of bitwise
+operations done a machine word at a time in C, no matter how many entries
+match, and live per-tag counts for a filter are one C{&} and popcount each.
+
+Slots freed by removals are reused so the bitsets stay as short as the
+library is big.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import re
+
+from ..util import profiling
+
+# Tags are prefixed with their axis to keep them from colliding
+# (eg. "provider:gog" vs. a user's "gog" tag)
+AXIS_SEPARATOR = ':'
+
+# How many parsed filter expressions to cache
+MAX_PARSED = 256
+
+# Categories too generic to be worth a tag
+IGNORED_CATEGORIES = ('Game',)
+
+_token_re = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+class FilterSyntaxError(ValueError):
+    """Raised for malformed filter expressions"""
+
+def fold(tag):
+    """Normalize a tag for case-insensitive matching"""
+    tag = ' '.join(tag.split())
+    return tag.casefold() if hasattr(tag, 'casefold') else tag.lower()
+
+def split_axis(tag):
+    """Split C{axis:value} into C{(axis, value)} (axis C{None} if absent)"""
+    if AXIS_SEPARATOR in tag:
+        axis, value = tag.split(AXIS_SEPARATOR, 1)
+        return axis, value
+    return None, tag
+
+def popcount(bits):
+    """Count the set bits in a non-negative integer"""
+    if hasattr(bits, 'bit_count'):
+        return bits.bit_count()
+    return bin(bits).count('1')
+
+def iter_bits(bits):
+    """Yield the positions of the set bits in a non-negative integer,
+    lowest first.
+    """
+    # One pass over the binary string beats repeatedly masking off the
+    # lowest bit, which copies the whole (potentially huge) int each time
+    digits = bin(bits)[:1:-1]
+    pos = digits.find('1')
+    while pos != -1:
+        yield pos
+        pos = digits.find('1', pos + 1)
+
+def entry_tags(entry):
+    """Return the tags which can be inferred from an entry's metadata
+
+    (Its XDG categories and providers, as C{category:} and C{provider:} tags)
+    """
+    tags = set('provider' + AXIS_SEPARATOR + x for x in entry.provider if x)
+    for cmd in entry.commands:
+        tags.update('category' + AXIS_SEPARATOR + x
+                    for x in (getattr(cmd, 'categories', None) or ())
+                    if x.strip() and x not in IGNORED_CATEGORIES)
+    return tags
+
+def parse_filter(expression):
+    """Parse a filter expression into a nested tuple tree.
+
+    The grammar is the familiar one, with C{AND} as the implied operator::
+
+        expr   := term ("OR" term)*
+        term   := factor ("AND"? factor)*
+        factor := ("NOT" | "-") factor | "(" expr ")" | TAG | '"' TAG '"'
+
+    Operators are case-insensitive. Quote tags containing spaces,
+    parentheses, or operator names.
+
+    @returns: C{('tag', folded_name)}, C{('not', node)}, or
+        C{('and'|'or', [nodes])}, or C{None} for an empty expression.
+    @raises FilterSyntaxError: If the expression is malformed.
+    """
+    tokens, pos = [], 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _token_re.match(expression, pos)
+        if not match or match.end() == pos:
+            raise FilterSyntaxError("Unbalanced quote at position %d" % pos)
+        pos = match.end()
+        if match.group(1) or match.group(2):
+            tokens.append((match.group(1) or match.group(2), None))
+        elif match.group(3) is not None:
+            tokens.append(('tag', fold(match.group(3))))
+        else:
+            word = match.group(4)
+            if word.upper() in ('AND', 'OR', 'NOT'):
+                tokens.append((word.upper(), None))
+            elif word == '-':
+                tokens.append(('NOT', None))
+            elif word.startswith('-') and len(word) > 1:
+                tokens.extend([('NOT', None), ('tag', fold(word[1:]))])
+            else:
+                tokens.append(('tag', fold(word)))
+
+    if not tokens:
+        return None
+    tokens.append((None, None))
+    state = {'pos': 0}
+
+    def peek():
+        """Return the type of the next token"""
+        return tokens[state['pos']][0]
+
+    def take(kind):
+        """Consume a token of the given type or raise an error"""
+        token = tokens[state['pos']]
+        if token[0] != kind:
+            raise FilterSyntaxError("Expected %s but got %s" % (
+                kind or 'end of filter', token[1] or token[0] or
+                'end of filter'))
+        state['pos'] += 1
+        return token
+
+    def parse_expr():
+        """expr := term ("OR" term)*"""
+        nodes = [parse_term()]
+        while peek() == 'OR':
+            take('OR')
+            nodes.append(parse_term())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_term():
+        """term := factor ("AND"? factor)*"""
+        nodes = [parse_factor()]
+        while peek() in ('AND', 'NOT', 'tag', '('):
+            if peek() == 'AND':
+                take('AND')
+            nodes.append(parse_factor())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_factor():
+        """factor := "NOT" factor | "(" expr ")" | TAG"""
+        kind = peek()
+        if kind == 'NOT':
+            take('NOT')
+            return ('not', parse_factor())
+        elif kind == '(':
+            take('(')
+            node = parse_expr()
+            take(')')
+            return node
+        return take('tag')
+
+    tree = parse_expr()
+    take(None)
+    return tree
+
+class TagIndex(object):
+    """Bitset index of which entries have which tags
+
+    Entries are tracked by object identity (like L{SearchIndex}) and tags
+    are matched case-insensitively but reported as first seen.
+    """
+
+    def __init__(self):
+        self._entries = []      # Slot -> entry (None for free slots)
+        self._slots = {}        # id(entry) -> slot
+        self._free = []
+        self._all = 0           # Bits of every occupied slot
+        self._bits = {}         # Folded tag -> bitset
+        self._names = {}        # Folded tag -> display name
+        self._parsed = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, entry):
+        return id(entry) in self._slots
+
+    @property
+    def tags(self):
+        """The display names of all tags in use, sorted"""
+        return sorted(self._names.values(), key=fold)
+
+    def add(self, entry, tags=()):
+        """Add an entry (if not already present) and give it some tags"""
+        slot = self._slots.get(id(entry))
+        if slot is None:
+            slot = self._free.pop() if self._free else len(self._entries)
+            if slot == len(self._entries):
+                self._entries.append(entry)
+            else:
+                self._entries[slot] = entry
+            self._slots[id(entry)] = slot
+            self._all |= 1 << slot
+
+        bit = 1 << slot
+        for tag in tags:
+            key = fold(tag)
+            self._names.setdefault(key, tag)
+            self._bits[key] = self._bits.get(key, 0) | bit
+
+    def untag(self, entry, tags):
+        """Remove tags from an entry"""
+        slot = self._slots.get(id(entry))
+        if slot is None:
+            return
+        mask = ~(1 << slot)
+        for tag in tags:
+            key = fold(tag)
+            if key in self._bits:
+                self._bits[key] &= mask
+                if not self._bits[key]:
+                    del self._bits[key], self._names[key]
+
+    def remove(self, entry):
+        """Remove an entry and all of its tags"""
+        slot = self._slots.pop(id(entry), None)
+        if slot is None:
+            return
+        mask = ~(1 << slot)
+        for key in [x for x, bits in self._bits.items() if bits >> slot & 1]:
+            self._bits[key] &= mask
+            if not self._bits[key]:
+                del self._bits[key], self._names[key]
+        self._all &= mask
+        self._entries[slot] = None
+        self._free.append(slot)
+
+    def tags_for(self, entry):
+        """Return the sorted display names of an entry's tags"""
+        slot = self._slots.get(id(entry))
+        if slot is None:
+            return []
+        return sorted((self._names[x] for x, bits in self._bits.items()
+                       if bits >> slot & 1), key=fold)
+
+    def evaluate(self, expression):
+        """Return the bitset of entries matching a filter expression
+
+        (Parsed expressions are cached, so calling this on every keystroke
+         or checkbox toggle is cheap.)
+
+        @param expression: A string (See L{parse_filter}) or an
+            already-parsed tree. Empty expressions match everything.
+        @raises FilterSyntaxError: If the expression is malformed.
+        """
+        if not isinstance(expression, tuple) and expression is not None:
+            if expression in self._parsed:
+                profiling.count('filter_cache_hit')
+            else:
+                profiling.count('filter_cache_miss')
+                if len(self._parsed) > MAX_PARSED:
+                    self._parsed.clear()
+                self._parsed[expression] = parse_filter(expression)
+            expression = self._parsed[expression]
+        if expression is None:
+            return self._all
+
+        kind, arg = expression
+        if kind == 'tag':
+            return self._bits.get(arg, 0)
+        elif kind == 'not':
+            return self._all & ~self.evaluate(arg)
+        elif kind == 'and':
+            result = self._all
+            for node in arg:
+                result &= self.evaluate(node)
+                if not result:
+                    break
+            return result
+        result = 0
+        for node in arg:
+            result |= self.evaluate(node)
+        return result
+
+    def matches(self, entry, expression):
+        """Return C{True} if an entry matches a filter expression"""
+        slot = self._slots.get(id(entry))
+        return slot is not None and bool(self.evaluate(expression) >> slot & 1)
+
+    def bits_for(self, entries):
+        """Return the bitset for some entries (ignoring unknown ones)"""
+        bits = 0
+        for entry in entries:
+            slot = self._slots.get(id(entry))
+            if slot is not None:
+                bits |= 1 << slot
+        return bits
+
+    def entries(self, bits):
+        """Return the entries for a bitset, in slot order"""
+        return [self._entries[x] for x in iter_bits(bits)]
+
+    def filter(self, expression):
+        """Return the entries matching a filter expression"""
+        return self.entries(self.evaluate(expression))
+
+    def counts(self, bits=None):
+        """Return a dict mapping display names to how many entries in
+        C{bits} (default: all) have each tag, omitting zeroes.
+
+        (Pass the result of L{evaluate} to show how many games each
+         further tag would leave if added to the current filter.)
+        """
+        if bits is None:
+            bits = self._all
+        counts = {}
+        for key, tag_bits in self._bits.items():
+            count = popcount(tag_bits & bits)
+            if count:
+                counts[self._names[key]] = count
+        return counts
+
+    def axes(self, extra_axes=None):
+        """Group tags by axis for building filter UIs.
+
+        @param extra_axes: A dict mapping tags to user-assigned axes which
+            take precedence over the C{axis:value} naming convention.
+            (See L{LibraryStore.get_tag_axes})
+        @returns: A dict mapping axis names (C{None} for unassigned tags)
+            to sorted lists of tags.
+        """
+        extra_axes = dict((fold(x), y) for x, y in (extra_axes or {}).items())
+        result = {}
+        for key, tag in self._names.items():
+            axis = extra_axes.get(key) or split_axis(tag)[0]
+            result.setdefault(axis, []).append(tag)
+        for tags in result.values():
+            tags.sort(key=fold)
+        return result
+
+# vim: set sw=4 sts=4 expandtab :
@@ -15,6 +15,16 @@ RESOURCE_DIRS = (
     'icons',
 )
 
+# A list of paths that, if exactly matched, should not be treated as a
+# game's install folder (eg. for deduplication or prefetching)
+COMMON_DIRS = [
+    '/opt', os.path.expanduser('~/opt'),
+    '/bin', os.path.expanduser('~/bin'),
+    '/usr/games/bin', '/usr/local/games/bin',
+    '/usr/games', '/usr/local/games',
+    '/usr/bin', '/usr/local/bin',
+]
+
 # Ensure cmp is available to Python 3 for cases where it's the cleanest option
 if sys.version_info.major >= 3:
     def cmp(i, j):  # pylint: disable=redefined-builtin
@@ -0,0 +1,325 @@
+"""Minimal ELF parsing for detecting missing shared libraries without ldd
+
+Reads just enough of an ELF file (header, program headers, and dynamic
+section) to get its C{DT_NEEDED}, C{DT_RPATH}, and C{DT_RUNPATH} entries,
+then resolves them roughly the way C{ld.so} would, using an in-memory index
+of C{/etc/ld.so.cache}.
+
+Nothing is ever executed, so this is safe to run over an entire library of
+untrusted binaries in a background thread.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import logging, os, struct, sys
+from collections import namedtuple
+
+from . import profiling
+
+log = logging.getLogger(__name__)
+
+LD_CACHE_PATH = '/etc/ld.so.cache'
+DEFAULT_LIB_DIRS = ('/lib', '/usr/lib', '/lib64', '/usr/lib64')
+
+# Folders games commonly bundle libraries in and point LD_LIBRARY_PATH at
+# from their launch scripts
+BUNDLED_LIB_DIRS = ('', 'lib', 'lib32', 'lib64', 'libs', 'x86', 'x86_64')
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32, ELFCLASS64 = 1, 2
+ELFDATA2LSB = 1
+PT_LOAD, PT_DYNAMIC, PT_INTERP = 1, 2, 3
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_STRSZ = 0, 1, 5, 10
+DT_RPATH, DT_RUNPATH = 15, 29
+
+LD_CACHE_MAGIC = b'glibc-ld.so.cache1.1'
+LD_CACHE_OLD_MAGIC = b'ld.so-1.7.0'
+
+# Give up on anything this broken rather than reading huge bogus tables
+MAX_PHDRS = 256
+MAX_DYNAMIC_SIZE = 1024 * 1024
+
+# (.dynstr in things like LLVM tools or big game engine binaries can be
+#  several megabytes, so this is just a sanity check)
+MAX_STRTAB_SIZE = 256 * 1024 * 1024
+
+ElfInfo = namedtuple('ElfInfo', 'elf_class machine interp needed rpath '
+                                'runpath')
+
+def _decode(raw):
+    """Decode a path from an ELF string table"""
+    if sys.version_info.major < 3:
+        return raw
+    return raw.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+def parse_elf(path):
+    """Read the dynamic linking information from an ELF file.
+
+    @returns: An L{ElfInfo} or C{None} if C{path} isn't a readable ELF file
+        or its dynamic section is damaged. (Statically-linked files get an
+        empty C{needed} list.)
+    """
+    try:
+        with open(path, 'rb') as fobj:
+            ident = fobj.read(16)
+            if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+                return None
+            elf_class = ord(ident[4:5])
+            endian = '<' if ord(ident[5:6]) == ELFDATA2LSB else '>'
+            if elf_class == ELFCLASS64:
+                header, phdr = 'HHIQQQIHHHHHH', 'IIQQQQQQ'
+                dyn = endian + 'qQ'
+            elif elf_class == ELFCLASS32:
+                header, phdr = 'HHIIIIIHHHHHH', 'IIIIIIII'
+                dyn = endian + 'iI'
+            else:
+                return None
+
+            header = struct.Struct(str(endian + header))
+            (_, machine, _, _, phoff, _, _, _, phentsize, phnum, _, _,
+             _) = header.unpack(fobj.read(header.size))
+            if phnum > MAX_PHDRS:
+                return None
+
+            loads, dynamic, interp = [], None, None
+            phdr = struct.Struct(str(endian + phdr))
+            for idx in range(phnum):
+                fobj.seek(phoff + idx * phentsize)
+                fields = phdr.unpack(fobj.read(phdr.size))
+                if elf_class == ELFCLASS64:
+                    p_type, _, offset, vaddr, _, filesz, _, _ = fields
+                else:
+                    p_type, offset, vaddr, _, filesz, _, _, _ = fields
+
+                if p_type == PT_LOAD:
+                    loads.append((vaddr, offset, filesz))
+                elif p_type == PT_DYNAMIC:
+                    dynamic = (offset, min(filesz, MAX_DYNAMIC_SIZE))
+                elif p_type == PT_INTERP:
+                    fobj.seek(offset)
+                    interp = _decode(fobj.read(filesz).rstrip(b'\0'))
+
+            if not dynamic:
+                return ElfInfo(elf_class, machine, interp, [], [], [])
+
+            fobj.seek(dynamic[0])
+            raw = fobj.read(dynamic[1])
+            dyn = struct.Struct(str(dyn))
+            tags = []
+            for pos in range(0, len(raw) - dyn.size + 1, dyn.size):
+                tag, val = dyn.unpack(raw[pos:pos + dyn.size])
+                if tag == DT_NULL:
+                    break
+                tags.append((tag, val))
+
+            # DT_STRTAB is a virtual address which must be mapped back to a
+            # file offset via the PT_LOAD segment containing it
+            strtab = dict(tags).get(DT_STRTAB)
+            strsz = dict(tags).get(DT_STRSZ, 0)
+            if strsz > MAX_STRTAB_SIZE:
+                return None
+            for vaddr, offset, filesz in loads:
+                if strtab is not None and vaddr <= strtab < vaddr + filesz:
+                    fobj.seek(strtab - vaddr + offset)
+                    strings = fobj.read(strsz)
+                    break
+            else:
+                return None
+            if len(strings) < strsz:
+                return None
+    except (IOError, OSError, struct.error):
+        return None
+
+    def get_string(offset):
+        """Look up a string in the dynamic string table
+
+        @raises ValueError: If C{offset} doesn't point to a terminated string
+        """
+        end = strings.find(b'\0', offset)
+        if offset < 0 or end < 0:
+            raise ValueError("Bad string table offset: %d" % offset)
+        return _decode(strings[offset:end])
+
+    def get_paths(tag):
+        """Return the colon-separated search path for a tag as a list"""
+        return [x for val in (v for t, v in tags if t == tag)
+                for x in get_string(val).split(':') if x]
+
+    try:
+        return ElfInfo(elf_class, machine, interp,
+                       [get_string(v) for t, v in tags if t == DT_NEEDED],
+                       get_paths(DT_RPATH), get_paths(DT_RUNPATH))
+    except ValueError as err:
+        log.debug("Couldn't parse %s: %s", path, err)
+        return None
+
+def parse_ld_cache(path=LD_CACHE_PATH):
+    """Parse C{ld.so.cache} into a dict mapping sonames to lists of paths.
+
+    (Paths for every architecture are included. Callers must check the
+     ELF class and machine of whatever they pick.)
+    """
+    try:
+        with open(path, 'rb') as fobj:
+            data = fobj.read()
+    except (IOError, OSError):
+        log.debug("Couldn't read %s", path)
+        return {}
+
+    start = 0
+    if data.startswith(LD_CACHE_OLD_MAGIC):
+        # Skip the libc5-era table which glibc < 2.32 wrote first
+        nlibs = struct.unpack(str('=I'), data[12:16])[0]
+        start = 16 + nlibs * 12
+        start += -start % 8
+
+    if data[start:start + len(LD_CACHE_MAGIC)] != LD_CACHE_MAGIC:
+        log.warning("Unrecognized ld.so.cache format in %s", path)
+        return {}
+
+    nlibs = struct.unpack(str('=I'), data[start + 20:start + 24])[0]
+    entry = struct.Struct(str('=iIIIQ'))
+    index, pos = {}, start + 48
+    for _ in range(nlibs):
+        _, key, value, _, _ = entry.unpack(data[pos:pos + entry.size])
+        pos += entry.size
+        name = _decode(data[start + key:data.find(b'\0', start + key)])
+        index.setdefault(name, []).append(
+            _decode(data[start + value:data.find(b'\0', start + value)]))
+    return index
+
+class DependencyChecker(object):
+    """Finds missing shared libraries, caching results per file version.
+
+    Parse results are keyed on C{(st_dev, st_ino, st_mtime)}, so checking a
+    whole library re-reads only binaries and libraries which have changed.
+    """
+
+    def __init__(self, ld_cache_path=LD_CACHE_PATH):
+        self.ld_cache_path = ld_cache_path
+        self._ld_cache = None
+        self._elf_cache = {}
+
+    @property
+    def ld_cache(self):
+        """The parsed C{ld.so.cache} (loaded on first use)"""
+        if self._ld_cache is None:
+            self._ld_cache = parse_ld_cache(self.ld_cache_path)
+        return self._ld_cache
+
+    def get_info(self, path):
+        """Return the cached L{ElfInfo} for a file (or C{None})"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime)
+        if key in self._elf_cache:
+            profiling.count('elf_cache_hit')
+        else:
+            profiling.count('elf_cache_miss')
+            self._elf_cache[key] = parse_elf(path)
+        return self._elf_cache[key]
+
+    def _compatible(self, path, info):
+        """Whether the library at C{path} can be loaded by C{info}'s binary
+        """
+        lib_info = self.get_info(path)
+        return bool(lib_info and lib_info.elf_class == info.elf_class and
+                    lib_info.machine == info.machine)
+
+    def resolve(self, soname, info, origin, extra_dirs=()):
+        """Find the file C{ld.so} would load for C{soname}, if any.
+
+        @param info: The L{ElfInfo} of the file which needs it.
+        @param origin: The folder containing that file (for C{$ORIGIN})
+        @param extra_dirs: Folders to search as if they were in
+            C{LD_LIBRARY_PATH}.
+        """
+        if '/' in soname:
+            path = os.path.join(origin, soname)
+            return path if self._compatible(path, info) else None
+
+        lib = 'lib64' if info.elf_class == ELFCLASS64 else 'lib'
+
+        def expand(path):
+            """Substitute the dynamic string tokens ld.so supports"""
+            for token, value in (('$ORIGIN', origin), ('${ORIGIN}', origin),
+                                 ('$LIB', lib), ('${LIB}', lib)):
+                path = path.replace(token, value)
+            return path
+
+        search = [] if info.runpath else [expand(x) for x in info.rpath]
+        search += list(extra_dirs)
+        search += [expand(x) for x in info.runpath]
+        for folder in search:
+            path = os.path.join(folder, soname)
+            if self._compatible(path, info):
+                return path
+
+        for path in self.ld_cache.get(soname, ()):
+            if self._compatible(path, info):
+                return path
+
+        for folder in DEFAULT_LIB_DIRS:
+            path = os.path.join(folder, soname)
+            if self._compatible(path, info):
+                return path
+        return None
+
+    def find_missing(self, path, extra_dirs=()):
+        """Return the sorted list of sonames C{path} needs but can't load.
+
+        Dependencies of dependencies are followed too, since a missing
+        transitive dependency fails the launch just the same.
+
+        @param extra_dirs: Folders to search as if they were in
+            C{LD_LIBRARY_PATH}.
+        @returns: A list of sonames or C{None} if C{path} isn't an ELF file.
+        """
+        root_info = self.get_info(path)
+        if root_info is None:
+            return None
+
+        missing, seen = set(), set()
+        pending = [(os.path.realpath(path), root_info)]
+        while pending:
+            current, info = pending.pop()
+            for soname in info.needed:
+                if soname in seen:
+                    continue
+                seen.add(soname)
+
+                found = self.resolve(soname, info,
+                                     os.path.dirname(current), extra_dirs)
+                if found is None:
+                    missing.add(soname)
+                else:
+                    pending.append((os.path.realpath(found),
+                                    self.get_info(found)))
+        return sorted(missing)
+
+    def check_launcher(self, argv, base_path=None):
+        """Check the primary executable of a command line.
+
+        The first element of C{argv} which is an ELF file is checked, with
+        the usual bundled-library folders under C{base_path} (or the
+        executable's own folder) treated as C{LD_LIBRARY_PATH}.
+
+        @returns: A list of missing sonames or C{None} if nothing in C{argv}
+            could be checked (eg. a shell script)
+        """
+        for arg in argv:
+            if not os.path.isabs(arg) or self.get_info(arg) is None:
+                continue
+            root = base_path or os.path.dirname(arg)
+            dirs = [os.path.dirname(arg)]
+            dirs += [os.path.join(root, x) for x in BUNDLED_LIB_DIRS]
+            return self.find_missing(arg, dirs)
+        return None
+
+# vim: set sw=4 sts=4 expandtab :
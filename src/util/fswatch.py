@@ -0,0 +1,442 @@
+"""Routines for watching the filesystem for changes
+
+Uses Linux inotify (via ctypes, so no compiled dependencies are needed) for
+local filesystems and falls back to C{stat()}-based polling for network
+mounts, where inotify won't see changes made by other machines.
+
+Everything which touches a network mount goes through a
+L{src.util.probing.Prober} keyed on its mount point, so a dead server costs
+one bounded delay rather than hanging whichever thread is watching.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import ctypes, ctypes.util, errno, logging, os, re, select, struct, time
+
+from .probing import ProbeError, Prober
+
+log = logging.getLogger(__name__)
+
+MOUNTS_PATH = '/proc/mounts'
+
+# Filesystem types which need polling because inotify only reports changes
+# made through the local kernel
+POLLED_FSTYPES = (
+    'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs', '9p',
+    'fuse.sshfs', 'fuse.davfs2', 'davfs',
+)
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Everything which could change what a provider finds.
+# (IN_MODIFY is omitted because IN_CLOSE_WRITE covers it without producing
+#  an event for every write() while a large file is being copied in.)
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct(str('iIII'))  # wd, mask, cookie, len
+
+def _load_libc():
+    """Return a ctypes handle to libc if it provides inotify, else None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        for name in ('inotify_init1', 'inotify_add_watch', 'inotify_rm_watch'):
+            getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def _unescape_mount(path):
+    """Decode the octal escapes (eg. C{\\040}) used in C{/proc/mounts}"""
+    return re.sub(r'\\([0-7]{3})', lambda x: chr(int(x.group(1), 8)), path)
+
+def get_mounts(mounts_path=MOUNTS_PATH):
+    """Return a list of C{(mount_point, fstype)} tuples, deepest first.
+
+    (Octal escapes like C{\\040} for spaces are decoded. Returns an empty
+     list if the mount table can't be read, such as on non-Linux systems.)
+    """
+    results = []
+    try:
+        with open(mounts_path) as fobj:
+            for line in fobj:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                results.append((_unescape_mount(fields[1]), fields[2]))
+    except (IOError, OSError):
+        log.debug("Could not read %s", mounts_path)
+    results.sort(key=lambda x: len(x[0]), reverse=True)
+    return results
+
+def _find_mount(path, mounts=None):
+    """Return the C{(mount_point, fstype)} containing C{path} lexically,
+    or C{(None, None)} if it isn't in the mount table.
+    """
+    path = os.path.abspath(path)
+    for mount_point, fstype in (mounts if mounts is not None
+                                else get_mounts()):
+        if path == mount_point or path.startswith(
+                mount_point.rstrip('/') + '/'):
+            return mount_point, fstype
+    return None, None
+
+def get_fstype(path, mounts=None):
+    """Return the filesystem type for C{path} without touching C{path}.
+
+    (Resolution is purely lexical so that asking about a path on a dead
+     network mount can't block.)
+    """
+    return _find_mount(path, mounts)[1]
+
+def is_network_path(path, mounts=None):
+    """Return C{True} if C{path} lives on a filesystem inotify can't watch"""
+    return get_fstype(path, mounts) in POLLED_FSTYPES
+
+def _existing(path):
+    """Return C{path} or, if it's missing, its nearest existing ancestor"""
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def _snapshot(path):
+    """Capture enough state about C{path} to notice changes by polling.
+
+    @returns: A dict mapping child paths (or C{path} itself for files) to
+        C{(st_ino, st_size, st_mtime)} tuples.
+    """
+    result = {}
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return result
+    result[path] = (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    if os.path.isdir(path):
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return result
+        for name in names:
+            fpath = os.path.join(path, name)
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                continue
+            result[fpath] = (stat.st_ino, stat.st_size, stat.st_mtime)
+    return result
+
+class InotifyWatcher(object):
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self, libc=None):
+        self._libc = libc or _load_libc()
+        if not self._libc:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._paths = {}  # wd -> path
+        self._wds = {}    # path -> wd
+        self.dropped = set()  # Paths the kernel stopped watching by itself
+
+    def fileno(self):
+        """Allow this object to be passed to C{select()} directly"""
+        return self.fd
+
+    @property
+    def paths(self):
+        """The paths currently being watched"""
+        return list(self._wds)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Watch a directory (or file) for changes.
+
+        @returns: C{True} on success or C{False} if the path could not be
+            watched. (eg. It doesn't exist or the watch limit was reached)
+        """
+        path_b = path.encode('utf-8') if not isinstance(path, bytes) else path
+        wdesc = self._libc.inotify_add_watch(self.fd, path_b, mask)
+        if wdesc < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                log.warning("inotify watch limit reached while adding %s "
+                            "(see /proc/sys/fs/inotify/max_user_watches)",
+                            path)
+            else:
+                log.debug("Could not watch %s: %s", path, os.strerror(err))
+            return False
+        self._paths[wdesc] = path
+        self._wds[path] = wdesc
+        return True
+
+    def remove_watch(self, path):
+        """Stop watching C{path} (if it's being watched)"""
+        wdesc = self._wds.pop(path, None)
+        if wdesc is not None:
+            # (Fails harmlessly if the kernel already dropped it)
+            self._libc.inotify_rm_watch(self.fd, wdesc)
+            del self._paths[wdesc]
+
+    def read_events(self):
+        """Return the paths affected by all pending events.
+
+        An C{IN_Q_OVERFLOW} is reported as C{None} in the result set to
+        signal that the caller must fall back to a full rescan.
+        """
+        results = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wdesc, mask, _, name_len = _EVENT_HEADER.unpack_from(
+                    data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    results.add(None)
+                    continue
+
+                base = self._paths.get(wdesc)
+                if base is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._paths[wdesc]
+                    if self._wds.get(base) == wdesc:
+                        del self._wds[base]
+                        self.dropped.add(base)
+
+                if name:
+                    results.add(os.path.join(
+                        base, name.decode('utf-8', 'replace')))
+                else:
+                    results.add(base)
+        return results
+
+    def close(self):
+        """Release the inotify file descriptor"""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingWatcher(object):
+    """C{stat()}-based fallback for filesystems inotify can't watch"""
+
+    def __init__(self, interval=10, prober=None, mounts=None):
+        """
+        @param interval: Minimum number of seconds between polls.
+        @param prober: If given, a L{Prober} to do C{stat()} calls on
+            network mounts through, keyed on each path's mount point.
+        @param mounts: The mount table to look mount points up in.
+            (See L{get_mounts})
+        """
+        self.interval = interval
+        self.prober = prober
+        self._mounts = get_mounts() if mounts is None else mounts
+        self._snapshots = {}
+        self._next_poll = time.time() + interval
+
+    def probe(self, path, func, *args):
+        """Call C{func(*args)}, which will touch C{path}, through the prober
+        if there is one and C{path} is on a network mount.
+
+        (Calls are keyed on the mount point so one dead server only times
+         out once, no matter how many of its paths are being watched.)
+
+        @raises src.util.probing.ProbeError: If the probe timed out or the
+            mount is already known to be unhealthy.
+        """
+        mount_point, fstype = _find_mount(path, self._mounts)
+        if self.prober is None or fstype not in POLLED_FSTYPES:
+            return func(*args)
+        return self.prober.call(mount_point, func, *args)
+
+    def add_watch(self, path):
+        """Start polling C{path} (a directory's immediate children or a file)
+
+        If it can't be read yet (eg. its mount is unhealthy), it starts with
+        an empty snapshot so its contents are reported once it recovers.
+        """
+        try:
+            self._snapshots[path] = self.probe(path, _snapshot, path)
+        except ProbeError as err:
+            log.debug("Could not snapshot %s: %s", path, err)
+            self._snapshots[path] = {}
+        return True
+
+    def remove_watch(self, path):
+        """Stop polling C{path} (if it's being polled)"""
+        self._snapshots.pop(path, None)
+
+    @property
+    def paths(self):
+        """The paths currently being polled"""
+        return list(self._snapshots)
+
+    def time_left(self):
+        """Seconds until the next poll is due"""
+        return max(0, self._next_poll - time.time())
+
+    def read_events(self):
+        """Poll all watched paths (if due) and return those which changed"""
+        if not self.paths or self.time_left():
+            return set()
+        self._next_poll = time.time() + self.interval
+
+        results = set()
+        for path, old in list(self._snapshots.items()):
+            try:
+                new = self.probe(path, _snapshot, path)
+            except ProbeError as err:
+                log.debug("Not polling %s: %s", path, err)
+                continue
+            for fpath in set(old) | set(new):
+                if old.get(fpath) != new.get(fpath):
+                    results.add(fpath)
+            self._snapshots[path] = new
+        return results
+
+class FilesystemWatcher(object):
+    """Front-end which routes each watch to inotify or polling as appropriate
+
+    Paths which don't exist yet (eg. C{~/.scummvmrc} before ScummVM is first
+    run) are handled by watching their nearest existing ancestor.
+    """
+
+    def __init__(self, poll_interval=10, settle_time=0.1, prober=None):
+        """
+        @param poll_interval: Seconds between polls of network mounts.
+        @param settle_time: How long to wait for a burst of events (eg. an
+            archive being unpacked) to go quiet before reporting it.
+        @param prober: The L{Prober} to touch network mounts through.
+        """
+        self.settle_time = settle_time
+        self._mounts = get_mounts()
+        self.poller = PollingWatcher(poll_interval, prober or Prober(),
+                                     self._mounts)
+        self._watched = set()  # Kept up to date so add_watch() is O(1)
+
+        try:
+            self.inotify = InotifyWatcher()
+        except OSError as err:
+            log.info("Falling back to polling for all paths: %s", err)
+            self.inotify = None
+
+    def add_watch(self, path):
+        """Watch C{path}, or its nearest existing ancestor if it's missing
+
+        @returns: C{False} if C{path} couldn't be watched (eg. because its
+            network mount is unhealthy).
+        """
+        try:
+            path = self.probe(path, _existing, os.path.abspath(path))
+        except ProbeError as err:
+            log.debug("Not watching %s: %s", path, err)
+            return False
+
+        if path in self._watched:
+            return True
+
+        if not (self.inotify and not is_network_path(path, self._mounts) and
+                self.inotify.add_watch(path)):
+            if not self.poller.add_watch(path):
+                return False
+        self._watched.add(path)
+        return True
+
+    def remove_watch(self, path):
+        """Stop watching C{path} (eg. because it was deleted)"""
+        path = os.path.abspath(path)
+        self._watched.discard(path)
+        self.poller.remove_watch(path)
+        if self.inotify:
+            self.inotify.remove_watch(path)
+
+    def probe(self, path, func, *args):
+        """Call C{func(*args)}, which will touch C{path}, in a way which
+        can't hang on a dead network mount. (See L{PollingWatcher.probe})
+        """
+        return self.poller.probe(path, func, *args)
+
+    @property
+    def paths(self):
+        """All paths currently being watched by any means"""
+        return set(self._watched)
+
+    def wait(self, timeout=None):
+        """Block until something changes and return the affected paths.
+
+        @param timeout: Maximum seconds to wait, or C{None} to wait forever.
+        @returns: A set of paths, which will contain C{None} if events were
+            lost and a full rescan is needed. Empty on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        results = set()
+        while True:
+            wait_for = self.poller.time_left() if self.poller.paths else None
+            if results:
+                wait_for = self.settle_time
+            elif deadline is not None:
+                remaining = max(0, deadline - time.time())
+                wait_for = (remaining if wait_for is None
+                            else min(wait_for, remaining))
+
+            readable = []
+            fds = [self.inotify] if self.inotify else []
+            if fds:
+                readable = select.select(fds, [], [], wait_for)[0]
+            elif wait_for is not None:
+                time.sleep(wait_for)
+            else:
+                time.sleep(self.poller.interval)
+
+            new = self.poller.read_events()
+            if readable:
+                new |= self.inotify.read_events()
+                self._watched -= self.inotify.dropped
+                self.inotify.dropped.clear()
+
+            if new:
+                results |= new
+            elif results:
+                # Quiet for settle_time, so the burst is over
+                return results
+            elif deadline is not None and time.time() >= deadline:
+                return results
+
+    def close(self):
+        """Release any OS resources held by this watcher"""
+        if self.inotify:
+            self.inotify.close()
+
+# vim: set sw=4 sts=4 expandtab :
@@ -6,7 +6,9 @@ from __future__ import (absolute_import, division, print_function,
 __author__ = "Stephan Sokolow (deitarion/SSokolow)"
 __license__ = "MIT"
 
-import os, re
+import os, re, time
+from collections import OrderedDict
+from . import profiling
 from .common import multiglob_compile
 
 # Files which should be heuristically considered to identify a program's icon
@@ -23,6 +25,12 @@ ICON_EXTS = {
     '.jpeg': 1,
 }
 
+# Bounds for L{ViewportIconCache}: how many loaded icons to keep (the memory
+# ceiling, as long as it exceeds what fits on screen) and how many rows
+# beyond each edge of the viewport to load ahead of scrolling
+ICON_CACHE_CAPACITY = 512
+VIEWPORT_MARGIN = 64
+
 NON_ICON_NAMES_RE = re.compile("""
     (.*background|character|.*sheet|tile|items|terrain)\d*\..*|
     (bg|special)[_-]*\d*.*
@@ -35,18 +43,122 @@ NON_ICON_NAMES_RE = re.compile("""
 #       are changed?
 # TODO: Rework the internals of this once I've got it actually functional
 class BaseIconWrapper(object):
-
-    """
+    """Base class for wrapping a toolkit-specific icon object."""
 
     def __init__(self, raw_obj):
         self._raw = raw_obj
 
-
-
     def unwrap(self):
         """Return the raw toolkit object being wrapped."""
         return self._raw
 
+class ViewportIconCache(object):
+    """Bounded cache which only loads icons for rows in (or near) the
+    visible part of a view, so memory and load time don't scale with the
+    size of the library.
+
+    Rows outside the viewport get C{placeholder} rather than triggering a
+    load. Icons in the viewport plus C{margin} rows either side are pinned,
+    while the rest are evicted least-recently-used first once there are
+    more than C{capacity}.
+
+    Loading is done incrementally by L{load_pending}, which the frontend
+    should call from an idle callback and then refresh the affected rows.
+    """
+
+    def __init__(self, loader, placeholder=None,
+                 capacity=ICON_CACHE_CAPACITY, margin=VIEWPORT_MARGIN):
+        """
+        @param loader: Called as C{loader(key)} to load an icon. May return
+            C{None} for failures, which are cached like any other icon.
+        """
+        self.loader = loader
+        self.placeholder = placeholder
+        self.capacity = capacity
+        self.margin = margin
+
+        self._icons = OrderedDict()     # LRU order, oldest first
+        self._pending = OrderedDict()   # Ordered set of keys to load
+        self._pinned = set()
+        self.window = (0, 0)
+        self.loads = self.evictions = 0
+
+    def __len__(self):
+        return len(self._icons)
+
+    @property
+    def pending(self):
+        """Whether any icons are waiting for L{load_pending}"""
+        return bool(self._pending)
+
+    def set_viewport(self, first, last, keys_for):
+        """Tell the cache which rows are visible.
+
+        @param first: The first visible row.
+        @param last: The last visible row.
+        @param keys_for: Called as C{keys_for(start, stop)} to get the icon
+            keys of rows C{start} to C{stop - 1} (clamped by the caller).
+        """
+        start, stop = max(0, first - self.margin), last + self.margin + 1
+        self.window = (start, stop)
+
+        # Queue the visible rows first, then the margins
+        visible = list(keys_for(first, last + 1))
+        margins = list(keys_for(start, first)) + list(keys_for(last + 1,
+                                                               stop))
+        self._pinned = set(visible + margins)
+        self._pending = OrderedDict((x, None) for x in visible + margins
+                                    if x is not None and
+                                    x not in self._icons)
+        self._evict()
+
+    def get(self, key):
+        """Return the icon for C{key} if loaded, else the placeholder
+        (queueing a load if it's in the viewport).
+        """
+        if key is None:
+            return self.placeholder
+        try:
+            icon = self._icons.pop(key)
+        except KeyError:
+            profiling.count('icon_cache_miss')
+            if key in self._pinned:
+                self._pending[key] = None
+            return self.placeholder
+        profiling.count('icon_cache_hit')
+        self._icons[key] = icon
+        return icon
+
+    def load_pending(self, budget=0.016):
+        """Load queued icons for up to C{budget} seconds (at least one).
+
+        @returns: The set of keys which were loaded.
+        """
+        loaded, deadline = set(), time.time() + budget
+        while self._pending:
+            key = self._pending.popitem(last=False)[0]
+            if key not in self._icons:
+                self._icons[key] = self.loader(key)
+                self.loads += 1
+                loaded.add(key)
+            if time.time() >= deadline:
+                break
+        self._evict()
+        return loaded
+
+    def _evict(self):
+        """Drop least-recently-used unpinned icons until under capacity"""
+        excess = len(self._icons) - self.capacity
+        if excess <= 0:
+            return
+        for key in list(self._icons):
+            if key not in self._pinned:
+                del self._icons[key]
+                self.evictions += 1
+                excess -= 1
+                if not excess:
+                    break
+
 def calculate_icon_score(filename):
     # TODO: Prefer square images so we don't wind up using Time Swap's Ouya
     #       icon by mistake.
@@ -0,0 +1,190 @@
+"""Background warming of the page cache for games on slow disks
+
+When a game lives on a slow USB or NAS disk, its first launch mostly waits
+for the binary, its shared libraries, and its big asset packs to be read.
+Asking the kernel to start reading them when the game is merely I{selected}
+hides much of that latency behind the user's reaction time.
+
+Only advice is given (C{posix_fadvise(WILLNEED)}), so prefetching never
+holds memory the kernel would rather use for something else.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import logging, os, threading, time
+from .common import COMMON_DIRS
+
+try:
+    import queue
+except ImportError:  # Python 2.x
+    import Queue as queue  # pylint: disable=import-error
+
+log = logging.getLogger(__name__)
+
+# TODO: Move this and most other constants to a config.py for visibility
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+# Don't let a huge install folder turn planning into a full directory walk
+MAX_FILES_CONSIDERED = 5000
+
+# How long before the same game may be prefetched again (seconds)
+REPEAT_DELAY = 300
+
+# Chunk size for the read()-based fallback when fadvise isn't available
+READ_CHUNK = 1024 * 1024
+
+def plan_prefetch(executable, root=None, budget=DEFAULT_BUDGET):
+    """Decide which files (and how much of each) are worth prefetching.
+
+    Order of priority:
+     1. The executable itself
+     2. Files inside any C{*_Data} folder next to it (Unity games),
+        largest first
+     3. Any other files under C{root}, largest first
+
+    @param root: The game's install folder. (Defaults to the executable's
+        parent folder.)
+    @returns: A list of C{(path, length)} tuples totalling at most C{budget}
+        bytes.
+    """
+    root = root or os.path.dirname(executable)
+    exe_dir = os.path.dirname(executable)
+
+    data_files, other_files, seen = [], [], 0
+    for parent, dirs, files in os.walk(root):
+        dirs.sort()
+        rel_parent = os.path.relpath(parent, exe_dir)
+        in_data = rel_parent.split(os.sep)[0].endswith('_Data')
+        for fname in files:
+            path = os.path.join(parent, fname)
+            if path == executable:
+                continue
+            try:
+                size = os.lstat(path).st_size
+            except OSError:
+                continue
+            (data_files if in_data else other_files).append((size, path))
+            seen += 1
+        if seen >= MAX_FILES_CONSIDERED:
+            log.debug("Stopped planning prefetch of %s at %d files",
+                      root, seen)
+            break
+
+    candidates = []
+    try:
+        candidates.append((os.path.getsize(executable), executable))
+    except OSError:
+        pass
+    candidates += sorted(data_files, reverse=True)
+    candidates += sorted(other_files, reverse=True)
+
+    plan, remaining = [], budget
+    for size, path in candidates:
+        if remaining <= 0:
+            break
+        length = min(size, remaining)
+        if length:
+            plan.append((path, length))
+            remaining -= length
+    return plan
+
+def prefetch_file(path, length):
+    """Ask the kernel to start reading the first C{length} bytes of a file.
+
+    @returns: C{True} on success, C{False} if the file couldn't be opened.
+    """
+    try:
+        fdesc = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fdesc, 0, length, os.POSIX_FADV_WILLNEED)
+        else:
+            # Python < 3.3: Do the reading ourselves
+            remaining = length
+            while remaining > 0:
+                chunk = os.read(fdesc, min(READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+    finally:
+        os.close(fdesc)
+    return True
+
+class Prefetcher(object):
+    """A single background thread which prefetches the most recently
+    requested game.
+
+    Requests which haven't started yet are discarded when a newer one comes
+    in, so scrolling quickly through a list doesn't queue up gigabytes of
+    reads for games the user skipped past.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self._queue = queue.Queue()
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._thread = None
+
+    def request(self, executable, root):
+        """Queue a game for prefetching (non-blocking)
+
+        @param root: The game's install folder. Nothing is prefetched if
+            it's C{None} or a shared folder like C{/usr/games}, since that
+            would mean reading other programs' files.
+        """
+        if not executable or not os.path.isabs(executable):
+            return
+        if not root or os.path.abspath(root) in COMMON_DIRS + [os.sep]:
+            log.debug("Not prefetching %s: No install folder", executable)
+            return
+
+        now = time.time()
+        with self._lock:
+            if now - self._recent.get(executable, 0) < REPEAT_DELAY:
+                return
+            self._generation += 1
+            self._queue.put((self._generation, executable, root))
+
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run,
+                                                name='Prefetcher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def request_entry(self, entry):
+        """Queue the default launcher of a L{GameEntry} for prefetching"""
+        cmd = entry.default_launcher
+        if cmd and cmd.argv:
+            self.request(cmd.argv[0], entry.base_path)
+
+    def _run(self):
+        """Worker thread main loop"""
+        while True:
+            generation, executable, root = self._queue.get()
+            if generation != self._generation:
+                continue
+
+            start = time.time()
+            plan = plan_prefetch(executable, root, self.budget)
+            for path, length in plan:
+                if generation != self._generation:
+                    log.debug("Prefetch of %s superseded", executable)
+                    break
+                prefetch_file(path, length)
+            else:
+                with self._lock:
+                    self._recent[executable] = time.time()
+            log.debug("Prefetched %d bytes in %d files for %s in %.3fs",
+                      sum(x[1] for x in plan), len(plan), executable,
+                      time.time() - start)
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,139 @@
+"""Hang-proof filesystem probing for possibly-dead network mounts
+
+A C{stat()} on a stale NFS or CIFS mount can block in uninterruptible sleep
+for minutes, and no amount of signal handling will get the calling thread
+back. The only safe way to touch such a path is from a sacrificial thread
+which is simply abandoned if it takes too long.
+
+L{Prober} runs calls that way and wraps each path (or other key) in a
+circuit breaker: once a probe times out or fails, further calls for that
+key fail immediately until an exponentially growing backoff has passed, at
+which point a single trial call is let through to see if it's recovered.
+At most one thread per key is ever stuck, so a dead mount costs one bounded
+delay rather than a thread per scan.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import logging, threading, time
+
+from . import profiling
+
+log = logging.getLogger(__name__)
+
+# How long a probe may take before its path is considered dead (seconds)
+PROBE_TIMEOUT = 2.0
+
+# How long to wait before retrying an unhealthy path, doubling after each
+# further failure up to the maximum (seconds)
+BACKOFF_INITIAL = 30
+BACKOFF_MAX = 30 * 60
+
+class ProbeError(Exception):
+    """Raised when a probe can't be completed"""
+
+class ProbeTimeout(ProbeError):
+    """Raised when a probe took too long (and was abandoned)"""
+
+class CircuitOpen(ProbeError):
+    """Raised without trying when a key is known to be unhealthy"""
+
+class _Circuit(object):
+    """Health-tracking state for one key"""
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = None
+        self.stuck = None   # A thread which timed out and may still be hung
+
+class Prober(object):
+    """Runs calls in sacrificial threads with timeouts and per-key
+    circuit breakers.
+    """
+
+    def __init__(self, timeout=PROBE_TIMEOUT, backoff=BACKOFF_INITIAL,
+                 max_backoff=BACKOFF_MAX, clock=time.time):
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, key):
+        """Return the state for a key, creating it if needed"""
+        with self._lock:
+            return self._circuits.setdefault(key, _Circuit())
+
+    def is_healthy(self, key):
+        """Return C{False} if calls for C{key} would currently be refused"""
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            return True
+        if circuit.stuck is not None and circuit.stuck.is_alive():
+            return False
+        return circuit.retry_at is None or self.clock() >= circuit.retry_at
+
+    def reset(self, key):
+        """Forget any failures recorded for C{key}"""
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def _failed(self, key, circuit, reason):
+        """Open the circuit for C{key} with the next backoff interval"""
+        delay = min(self.backoff * 2 ** circuit.failures, self.max_backoff)
+        circuit.failures += 1
+        circuit.retry_at = self.clock() + delay
+        log.warning("%s is unhealthy (%s). Retrying in %ds.",
+                    key, reason, delay)
+
+    def call(self, key, func, *args, **kwargs):
+        """Call C{func(*args, **kwargs)} in a sacrificial thread.
+
+        @param key: What the call's health is tracked under (eg. the root
+            folder being probed).
+        @param timeout: (keyword-only) Overrides the default timeout.
+        @raises CircuitOpen: If C{key} is in backoff or its last probe is
+            still hung.
+        @raises ProbeTimeout: If the call didn't return in time.
+        @raises ProbeError: If the call raised an exception. (The original
+            is kept in its C{__cause__} attribute.)
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        circuit = self._circuit(key)
+        if not self.is_healthy(key):
+            raise CircuitOpen("Not retrying %s yet" % key)
+
+        outcome = {}
+
+        def run():
+            """Record the result or exception of the call"""
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except Exception as err:  # pylint: disable=broad-except
+                outcome['error'] = err
+
+        thread = threading.Thread(target=profiling.propagate(run),
+                                  name="probe: %s" % key)
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+
+        if thread.is_alive():
+            circuit.stuck = thread
+            self._failed(key, circuit, "timed out after %ss" % timeout)
+            raise ProbeTimeout("Probe of %s timed out" % key)
+        elif 'error' in outcome:
+            self._failed(key, circuit, outcome['error'])
+            error = ProbeError("Probe of %s failed: %s" %
+                               (key, outcome['error']))
+            error.__cause__ = outcome['error']
+            raise error
+
+        circuit.failures, circuit.retry_at, circuit.stuck = 0, None, None
+        return outcome['result']
+
+# vim: set sw=4 sts=4 expandtab :
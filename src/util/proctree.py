@@ -0,0 +1,118 @@
+"""Routines for following a launched process and everything it spawns
+
+Games are often started via wrappers which fork the real binary and then
+exit (eg. C{start.sh} -> binary, C{playonlinux --run} -> C{wine}), so the PID
+C{Popen} returns isn't enough to tell whether a game is still running.
+
+Descendants are found via C{/proc/<pid>/task/<tid>/children} (falling back
+to scanning every C{/proc/<pid>/stat} on kernels built without
+C{CONFIG_PROC_CHILDREN}) and are remembered once seen, so they remain
+tracked after being orphaned by an exiting wrapper. Start times from
+C{/proc/<pid>/stat} guard against mistaking a recycled PID for a survivor.
+
+@note: A grandchild which gets orphaned before it's ever seen (ie. a
+    wrapper which forks and exits faster than the polling interval) will
+    be missed, which is why L{ProcessTree.refresh} should be called soon
+    after launch.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import logging, os
+
+log = logging.getLogger(__name__)
+
+PROC_ROOT = '/proc'
+
+def read_stat(pid, proc_root=PROC_ROOT):
+    """Return C{(ppid, start_time)} for a process or C{None} if it's gone.
+
+    (Zombies count as gone, since they'll never run again.)
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid), 'stat'), 'rb') as fobj:
+            stat = fobj.read()
+    except (IOError, OSError):
+        return None
+
+    # The command name is parenthesized and may itself contain spaces or
+    # parentheses, so split on the last ')'
+    fields = stat[stat.rfind(b')') + 2:].split()
+    if not fields or fields[0] in (b'Z', b'X'):
+        return None
+    return int(fields[1]), int(fields[19])
+
+def get_children(pid, proc_root=PROC_ROOT):
+    """Return the set of PIDs whose parent is C{pid}"""
+    task_dir = os.path.join(proc_root, str(pid), 'task')
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return set()
+
+    children = set()
+    for tid in tids:
+        try:
+            with open(os.path.join(task_dir, tid, 'children'), 'rb') as fobj:
+                children.update(int(x) for x in fobj.read().split())
+        except (IOError, OSError):
+            break
+    else:
+        return children
+
+    # No CONFIG_PROC_CHILDREN, so fall back to checking every process
+    for name in os.listdir(proc_root):
+        if name.isdigit():
+            stat = read_stat(name, proc_root)
+            if stat and stat[0] == pid:
+                children.add(int(name))
+    return children
+
+class ProcessTree(object):
+    """A launched process and every descendant it has been seen to spawn"""
+
+    def __init__(self, root_pid, proc_root=PROC_ROOT):
+        self.root_pid = root_pid
+        self.proc_root = proc_root
+        self.known = {}
+
+        stat = read_stat(root_pid, proc_root)
+        if stat:
+            self.known[root_pid] = stat[1]
+
+    @property
+    def alive(self):
+        """Whether any process in the tree was running at the last refresh"""
+        return bool(self.known)
+
+    def refresh(self):
+        """Drop exited processes and add newly-spawned descendants.
+
+        @returns: C{True} if the set of running processes changed.
+        """
+        before = set(self.known)
+        pending = list(self.known)
+        while pending:
+            pid = pending.pop()
+            stat, expected = read_stat(pid, self.proc_root), self.known[pid]
+            if not stat or (expected is not None and stat[1] != expected):
+                self.known.pop(pid, None)
+                continue
+
+            self.known[pid] = stat[1]
+            for child in get_children(pid, self.proc_root):
+                if child not in self.known:
+                    self.known[child] = None
+                    pending.append(child)
+
+        changed = set(self.known) != before
+        if changed:
+            log.debug("Process tree for %d is now %r", self.root_pid,
+                      sorted(self.known))
+        return changed
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,213 @@
+"""Lightweight instrumentation for finding out where scan time goes"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import functools, json, os, threading, time
+from collections import OrderedDict
+
+try:
+    import builtins
+except ImportError:  # Python 2.x
+    import __builtin__ as builtins  # pylint: disable=import-error
+
+try:
+    process_time = time.process_time
+except AttributeError:  # Python < 3.3
+    process_time = time.clock  # pylint: disable=no-member
+
+# Filesystem calls to count. (os.path.isdir() and friends go through os.stat)
+FS_CALLS = ('listdir', 'scandir', 'stat', 'lstat', 'access')
+
+# The profiler counters from cache code should be reported to, if any
+_active = None
+
+def count(counter, amount=1):
+    """Increment a counter on the active L{Profiler} (if there is one).
+
+    Meant to be called from code like caches which shouldn't need to care
+    whether profiling is enabled. (eg. C{count('cache_hit')})
+    """
+    if _active:
+        _active.count(counter, amount)
+
+def propagate(func):
+    """Wrap C{func} so that, when run in another thread, it's measured as
+    part of the sections the calling thread is currently inside.
+
+    Use it on the target of worker threads and pool jobs. (Returns C{func}
+    unchanged when no L{Profiler} is active.)
+    """
+    profiler = _active
+    if not profiler:
+        return func
+    sections = list(profiler._stack)  # pylint: disable=protected-access
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+        local = profiler._local  # pylint: disable=protected-access
+        saved = getattr(local, 'stack', None)
+        local.stack = list(sections)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            local.stack = saved if saved is not None else []
+    return wrapper
+
+class Profile(object):
+    """Measurements for one named section of code"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.counters = {}
+
+    def to_dict(self):
+        """Return a JSON-serializable representation"""
+        return OrderedDict((
+            ('name', self.name),
+            ('calls', self.calls),
+            ('wall_time', self.wall_time),
+            ('cpu_time', self.cpu_time),
+            ('counters', OrderedDict(sorted(self.counters.items()))),
+        ))
+
+class Profiler(object):
+    """Collects timings and counters for nested, named sections of code.
+
+    Use as a context manager to also count filesystem calls via wrapped
+    C{os} functions and C{open()}. Counters are credited to every section
+    currently being measured, so a provider's totals include those of its
+    sub-plugins.
+
+    @note: Each thread has its own stack of sections, so calls made by
+        worker threads are only credited to sections entered in that thread
+        unless the thread's target was wrapped by L{propagate}.
+    """
+
+    def __init__(self):
+        self.profiles = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    @property
+    def _stack(self):
+        """The sections currently being measured in the calling thread"""
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def __enter__(self):
+        global _active  # pylint: disable=global-statement
+        for name in FS_CALLS:
+            if hasattr(os, name):
+                self._originals[(os, name)] = getattr(os, name)
+                setattr(os, name, self._wrap_fs(getattr(os, name), name))
+        self._originals[(builtins, 'open')] = builtins.open
+        builtins.open = self._wrap_fs(builtins.open, 'open')
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active  # pylint: disable=global-statement
+        for (module, name), func in self._originals.items():
+            setattr(module, name, func)
+        self._originals.clear()
+        _active = None
+
+    def _wrap_fs(self, func, name):
+        """Wrap a filesystem function to count calls to it"""
+        counter = 'fs_' + name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+            self.count(counter)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def count(self, counter, amount=1):
+        """Increment a counter on every section currently being measured"""
+        stack = self._stack
+        if not stack:
+            return
+        with self._lock:
+            for profile in stack:
+                profile.counters[counter] = (
+                    profile.counters.get(counter, 0) + amount)
+
+    def wrap(self, func, name, result_counter=None):
+        """Return a wrapper which measures every call to C{func}.
+
+        @param result_counter: If given, the name of a counter to increment
+            by C{len(result)} (or by 1 if the result is truthy but has no
+            length or is a dict) so things like candidate counts can be
+            tracked.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+            with self._lock:
+                profile = self.profiles.setdefault(name, Profile(name))
+                profile.calls += 1
+            self._stack.append(profile)
+            start_wall, start_cpu = time.time(), process_time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    profile.wall_time += time.time() - start_wall
+                    profile.cpu_time += process_time() - start_cpu
+                self._stack.pop()
+
+            if result_counter:
+                if isinstance(result, dict) or not hasattr(result, '__len__'):
+                    amount = 1 if result else 0
+                else:
+                    amount = len(result)
+                with self._lock:
+                    profile.counters[result_counter] = (
+                        profile.counters.get(result_counter, 0) + amount)
+            return result
+        return wrapper
+
+    def patch(self, obj, attr, name, result_counter=None):
+        """Replace C{obj.attr} with a measured wrapper until L{__exit__}"""
+        func = getattr(obj, attr)
+        self._originals.setdefault((obj, attr), func)
+        setattr(obj, attr, self.wrap(func, name, result_counter))
+
+    def to_json(self, **extra):
+        """Serialize all profiles (plus any extra top-level keys) as JSON"""
+        data = OrderedDict(sorted(extra.items()))
+        data['profiles'] = [x.to_dict() for x in self.profiles.values()]
+        return json.dumps(data, indent=2)
+
+    def report(self):
+        """Return a human-readable table of all profiles"""
+        counters = sorted(set(key for profile in self.profiles.values()
+                              for key in profile.counters))
+        headers = ['Section', 'Calls', 'Wall (s)', 'CPU (s)'] + counters
+        rows = [[x.name, str(x.calls), '%.4f' % x.wall_time,
+                 '%.4f' % x.cpu_time] +
+                [str(x.counters.get(key, 0)) for key in counters]
+                for x in self.profiles.values()]
+
+        widths = [max(len(row[idx]) for row in [headers] + rows)
+                  for idx in range(len(headers))]
+        lines = []
+        for row in [headers] + rows:
+            lines.append('  '.join(cell.ljust(width) if idx == 0
+                                   else cell.rjust(width)
+                                   for idx, (cell, width)
+                                   in enumerate(zip(row, widths))))
+        lines.insert(1, '-' * len(lines[0]))
+        return '\n'.join(lines)
+
+# vim: set sw=4 sts=4 expandtab :
@@ -0,0 +1,217 @@
+"""Supervision of launched games without one thread per child process
+
+All children's output pipes are drained by a single C{selectors} loop into
+fixed-size ring buffers, so a game which spams its log can neither grow
+memory without bound nor stall on a full pipe, and whatever it said last is
+still available to explain an unclean exit. (eg. "error while loading shared
+libraries: ...")
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "MIT"
+
+import errno, fcntl, logging, os, subprocess, time
+from collections import deque
+
+try:
+    import selectors
+except ImportError:  # Python < 3.4
+    import selectors34 as selectors  # pylint: disable=import-error
+
+log = logging.getLogger(__name__)
+
+# How much of each child's output to retain
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# Maximum bytes to read from one pipe per wakeup
+READ_SIZE = 16 * 1024
+
+class RingBuffer(object):
+    """A byte buffer which discards its oldest contents beyond C{limit}"""
+
+    def __init__(self, limit=DEFAULT_BUFFER_SIZE):
+        self.limit = limit
+        self.size = 0
+        self.dropped = 0
+        self._chunks = deque()
+
+    def append(self, data):
+        """Add bytes, discarding the oldest ones if over the size limit"""
+        if len(data) > self.limit:
+            self.dropped += len(data) - self.limit
+            data = data[-self.limit:]
+        self._chunks.append(data)
+        self.size += len(data)
+
+        while self.size > self.limit:
+            excess = self.size - self.limit
+            oldest = self._chunks[0]
+            if len(oldest) <= excess:
+                self._chunks.popleft()
+                trimmed = len(oldest)
+            else:
+                self._chunks[0] = oldest[excess:]
+                trimmed = excess
+            self.size -= trimmed
+            self.dropped += trimmed
+
+    def getvalue(self):
+        """Return everything currently retained as one bytestring"""
+        return b''.join(self._chunks)
+
+    def tail(self, lines=20):
+        """Return up to the last C{lines} lines of retained output as text"""
+        text = self.getvalue().decode('utf-8', 'replace')
+        return '\n'.join(text.rstrip('\n').split('\n')[-lines:])
+
+class Child(object):
+    """A supervised process and the output it has produced"""
+
+    def __init__(self, name, process, buffer_size=DEFAULT_BUFFER_SIZE,
+                 on_exit=None):
+        self.name = name
+        self.process = process
+        self.output = RingBuffer(buffer_size)
+        self.on_exit = on_exit
+        self.started = time.time()
+        self.ended = None
+
+    @property
+    def pid(self):
+        """The child's process ID"""
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        """The exit status (negative for signals) or C{None} if running"""
+        return self.process.returncode
+
+    @property
+    def unclean(self):
+        """Whether the child has exited with a non-zero status"""
+        return self.ended is not None and self.returncode != 0
+
+    def tail(self, lines=20):
+        """Shorthand for C{self.output.tail(lines)}"""
+        return self.output.tail(lines)
+
+    def __repr__(self):
+        return "<Child %r pid=%s returncode=%r>" % (self.name, self.pid,
+                                                   self.returncode)
+
+class Supervisor(object):
+    """Owner of launched child processes and their output pipes.
+
+    Frontends call L{poll} periodically (eg. from a C{gobject.timeout_add}
+    callback) while L{children} is non-empty. Exit callbacks run inside
+    L{poll}, so they run in whatever thread calls it.
+    """
+
+    def __init__(self, on_exit=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        @param on_exit: Called as C{on_exit(child)} when any child exits
+            (after that child's own callback, if any).
+        """
+        self.on_exit = on_exit
+        self.buffer_size = buffer_size
+        self.children = {}
+        self._selector = selectors.DefaultSelector()
+
+    def spawn(self, name, argv, cwd=None, on_exit=None, **kwargs):
+        """Start a supervised child process with stdout and stderr merged.
+
+        Extra keyword arguments are passed through to C{subprocess.Popen}.
+
+        @raises OSError: As C{subprocess.Popen} does if C{argv} can't be run.
+        @returns: A L{Child}
+        """
+        with open(os.devnull, 'rb') as devnull:
+            process = subprocess.Popen(argv, cwd=cwd, stdin=devnull,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       close_fds=True, **kwargs)
+        fdesc = process.stdout.fileno()
+        fcntl.fcntl(fdesc, fcntl.F_SETFL,
+                    fcntl.fcntl(fdesc, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        child = Child(name, process, self.buffer_size, on_exit)
+        self.children[process.pid] = child
+        self._selector.register(fdesc, selectors.EVENT_READ, child)
+        log.debug("Supervising %r", child)
+        return child
+
+    def _drain(self, child):
+        """Read whatever is waiting in a child's pipe.
+
+        @returns: C{False} if the pipe has been closed, else C{True}.
+        """
+        pipe = child.process.stdout
+        if pipe.closed:
+            return False
+        while True:
+            try:
+                data = os.read(pipe.fileno(), READ_SIZE)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                self._selector.unregister(pipe.fileno())
+                pipe.close()
+                return False
+            child.output.append(data)
+            if len(data) < READ_SIZE:
+                return True
+
+    def poll(self, timeout=0):
+        """Drain ready pipes, reap exited children, and fire exit callbacks.
+
+        @param timeout: Maximum seconds to wait for output (C{None} blocks
+            until at least one pipe has something to read)
+        @returns: A list of the L{Child} objects which exited during this call.
+        """
+        if self._selector.get_map():
+            for key, _ in self._selector.select(timeout):
+                self._drain(key.data)
+        elif timeout:
+            # Nothing left to select() on but we may still need to reap
+            time.sleep(timeout)
+
+        exited = []
+        for pid, child in list(self.children.items()):
+            if child.process.poll() is None:
+                continue
+
+            # Don't wait for EOF since a backgrounded grandchild may be
+            # holding the pipe open long after the launcher script exited.
+            if self._drain(child):
+                self._selector.unregister(child.process.stdout.fileno())
+                child.process.stdout.close()
+
+            child.ended = time.time()
+            del self.children[pid]
+            exited.append(child)
+
+            if child.unclean:
+                log.warning("%r exited uncleanly. Last output:\n%s",
+                            child, child.tail())
+            for callback in (child.on_exit, self.on_exit):
+                if callback:
+                    callback(child)
+        return exited
+
+    def close(self):
+        """Stop supervising (without killing) any remaining children"""
+        for child in self.children.values():
+            if not child.process.stdout.closed:
+                self._selector.unregister(child.process.stdout.fileno())
+                child.process.stdout.close()
+        self.children.clear()
+        self._selector.close()
+
+# vim: set sw=4 sts=4 expandtab :
@@ -1,4 +1,5 @@
-"""Common code for tests which convert a JSON test set into a numeric score"""
+"""Common code for tests: entry factories and a harness for tests which
+convert a JSON test set into a numeric score"""
 
 from __future__ import (absolute_import, division, print_function,
                         with_statement, unicode_literals)
@@ -11,6 +12,26 @@ if sys.version_info.major > 2:
     # pylint: disable=redefined-builtin,invalid-name
     basestring = str  # pragma: nocover
 
+# TODO: Decide on a name for the program and rename "src"
+from src.game_providers.common import GameLauncher, InstalledGameEntry
+
+def make_entry(name, provider="test", argv=None, base_path=None,
+               game_id=None, identity=None, **kwargs):
+    """Build a minimal launchable entry for testing
+
+    @param argv: The launcher's command. (Default: C{['/bin/true', name]})
+    @param identity: If given, assigned as the entry's identity rather than
+        leaving it to a L{src.library.store.LibraryStore}.
+    @param kwargs: Extra L{GameLauncher} fields (eg. C{categories})
+    """
+    entry = InstalledGameEntry(name=name, base_path=base_path,
+                               game_id=game_id, commands=[
+        GameLauncher(name=name, provider=provider,
+                     argv=argv or ['/bin/true', name], **kwargs)])
+    if identity is not None:
+        entry.identity = identity
+    return entry
+
 def load_json_map(json_path):
     """Load a validate a JSON definition of a set of subtests."""
     with open(json_path) as fobj:
@@ -0,0 +1,79 @@
+"""Tests for game_providers.common"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.game_providers.common import (GameEntry, GameLauncher,
+                                       InstalledGameEntry)
+
+def test_derived_values_cached():
+    """Test that summaries and friends are only recomputed when invalidated
+    """
+    entry = make_entry("Trine", "steam", ['/bin/true', 'trine'],
+                       categories=['Game', 'ActionGame'],
+                       description="Physics platformer")
+    summary = entry.summarize()
+    assert summary == ("Trine (steam)\n\nPhysics platformer\n\n"
+                       "Categories:\n- ActionGame")
+    assert entry.summarize() is summary
+    assert entry.provider is entry.provider
+
+    # In-place edits to commands need an explicit invalidation...
+    entry.commands[0].description = "Changed"
+    assert entry.summarize() is summary
+    entry.invalidate()
+    assert "Changed" in entry.summarize()
+
+    # ...but renames and library checks don't
+    entry.name = "Trine Enchanted Edition"
+    assert entry.summarize().startswith("Trine Enchanted Edition (steam)")
+
+    class FakeChecker(object):
+        """Reports a missing library for every launcher"""
+        @staticmethod
+        def check_launcher(argv, base_path=None):
+            return ['libfoo.so.1']
+    entry.check_libraries(FakeChecker)
+    assert "Missing libraries: libfoo.so.1" in entry.summarize()
+
+def test_update_invalidates():
+    """Test that merging entries refreshes their derived values"""
+    entry = make_entry("Braid", "gog", ['/bin/true', 'gog'])
+    other = make_entry("Braid", "steam", ['/bin/true', 'steam'],
+                       description="Time-bending puzzles")
+    assert entry.provider == set(['gog'])
+    assert entry.description is None
+
+    copied = entry.copy()
+    entry.update(other)
+    assert entry.provider == set(['gog', 'steam'])
+    assert entry.description == "Time-bending puzzles"
+    assert len(entry.commands) == 2
+
+    # Copies don't share caches with the original
+    assert copied.provider == set(['gog'])
+
+    base = GameEntry("Base", commands=[
+        GameLauncher(name="Base", provider="test", argv=['/bin/true'],
+                     categories=['Puzzle'])])
+    assert base.categories == ['Puzzle']
+
+def test_aliases_merge():
+    """Test that entries found via different paths to one folder merge"""
+    entry = InstalledGameEntry(name="Braid", base_path='/games/braid',
+                               aliases=['/home/me/opt/braid'])
+    other = InstalledGameEntry(name="Braid (GOG)",
+                               base_path='/home/me/opt/braid/')
+    unrelated = InstalledGameEntry(name="FTL", base_path='/games/ftl')
+    assert entry == other and other == entry
+    assert not entry == unrelated
+
+    copied = entry.copy()
+    entry.update(unrelated)
+    assert entry.aliases == set(['/home/me/opt/braid', '/games/ftl'])
+    assert copied.aliases == set(['/home/me/opt/braid'])
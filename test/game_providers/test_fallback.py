@@ -0,0 +1,253 @@
+"""Tests for game_providers.fallback against a synthetic library"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, random, shutil, tempfile, threading, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.game_providers import fallback
+from src.game_providers.fallback.dispatch import SubpluginIndex
+from src.game_providers.fallback.roots import RootPolicy, RootRegistry
+from src.util.probing import Prober
+from test.synthetic import generate_library
+
+def test_synthetic_library():
+    """Test that fallback finds the GOG and install.sh games it's given"""
+    base = tempfile.mkdtemp()
+    try:
+        manifest = generate_library(base, 40)
+        games = fallback.get_games(roots=manifest['roots'])
+        game_ids = set(x.game_id for x in games if x.game_id)
+
+        assert len([x for x in game_ids if x.startswith('gog_')]) == (
+            manifest['counts']['gog'])
+        assert len([x for x in game_ids if not x.startswith('gog_')]) == (
+            manifest['counts']['install_sh'])
+    finally:
+        shutil.rmtree(base)
+
+def test_parallel_results_deterministic():
+    """Test that parallel inspection returns the same order as serial"""
+    base = tempfile.mkdtemp()
+    try:
+        manifest = generate_library(base, 40)
+        serial = fallback.get_games(roots=manifest['roots'], max_workers=1)
+        for _ in range(3):
+            parallel = fallback.get_games(roots=manifest['roots'])
+            assert ([x.base_path for x in parallel] ==
+                    [x.base_path for x in serial])
+    finally:
+        shutil.rmtree(base)
+
+def test_per_root_limits():
+    """Test that no root ever has more candidates in flight than allowed"""
+    lock, active, peaks = threading.Lock(), {}, {}
+    rand = random.Random(0)
+    delays = dict(('/%s/%d' % (root, x), rand.random() * 0.005)
+                  for root in 'abc' for x in range(20))
+
+    def fake_inspect(candidate, max_depth):
+        """Track per-root concurrency while pretending to do slow I/O"""
+        root = candidate.split('/')[1]
+        with lock:
+            active[root] = active.get(root, 0) + 1
+            peaks[root] = max(peaks.get(root, 0), active[root])
+        time.sleep(delays[candidate])
+        with lock:
+            active[root] -= 1
+        return candidate if candidate.endswith('0') else None
+
+    original = fallback._run_subplugins
+    fallback._run_subplugins = fake_inspect
+    try:
+        limits = {'a': 1, 'b': 3, 'c': None}
+        queues = [(RootPolicy('/' + root, concurrency=limits[root]),
+                   ['/%s/%d' % (root, x) for x in range(20)])
+                  for root in 'abc']
+        results = fallback.inspect_all(queues, max_workers=6)
+    finally:
+        fallback._run_subplugins = original
+
+    assert results == [['/a/0', '/a/10'], ['/b/0', '/b/10'],
+                       ['/c/0', '/c/10']]
+    assert peaks['a'] == 1
+    assert peaks['b'] <= 3
+    assert peaks['c'] <= RootPolicy('/c').concurrency
+
+def test_root_policies():
+    """Test that slow roots go last and unmounted ones aren't touched"""
+    mounts = [('/mnt/nas', 'nfs'), ('/media/usb', 'vfat'), ('/', 'ext4')]
+    registry = RootRegistry([
+        RootPolicy('/mnt/nas/games', mounts=mounts),
+        RootPolicy('/media/usb/games', removable=True),
+        RootPolicy('/mnt/buffalo_ext/games', removable=True,
+                   mount_point='/mnt/buffalo_ext'),
+        RootPolicy('/media/usb/other', removable=True,
+                   mount_point='/media/usb/other'),
+    ])
+    nas = registry.get('/mnt/nas/games/')
+    assert nas.networked and nas.slow and nas.throttle > 0
+    assert registry.get('/mnt/nas/other', mounts).networked
+    assert not registry.get('/mnt/nas/other', []).networked
+    assert nas.concurrency < registry.get('/usr/games').concurrency
+
+    checked = []
+    original = RootPolicy.is_available
+    RootPolicy.is_available = lambda self, mounts=None, prober=None: (
+        checked.append(self.path) or self.is_mounted(mounts))
+    try:
+        plan = fallback.ScanScheduler(registry).plan(
+            ['/usr/games', '/mnt/nas/games', '/media/usb/games', '/opt',
+             '/mnt/buffalo_ext/games', '/media/usb/other'], mounts)
+    finally:
+        RootPolicy.is_available = original
+
+    assert [[x.path for x in phase] for phase in plan] == [
+        ['/opt', '/usr/games'], ['/media/usb/games'], ['/mnt/nas/games']]
+    assert not registry.get('/mnt/buffalo_ext/games').is_mounted(mounts)
+    assert not registry.get('/media/usb/other').is_mounted(mounts)
+
+def test_scan_scheduler():
+    """Test streaming by phase, rescan intervals, and symlink policies"""
+    base = tempfile.mkdtemp()
+    try:
+        manifest = generate_library(base, 20)
+        local, slow = sorted(manifest['roots'])[:2]
+        os.symlink(os.path.join(local, sorted(os.listdir(local))[0]),
+                   os.path.join(slow, 'zz_symlinked'))
+
+        clock = [0]
+        registry = RootRegistry([RootPolicy(slow, networked=True,
+                                            follow_symlinks=False,
+                                            rescan_interval=60)])
+        scheduler = fallback.ScanScheduler(registry, clock=lambda: clock[0])
+        phases = list(scheduler.scan([local, slow], mounts=[]))
+        assert [[x.path for x in phase] for phase, _ in phases] == [
+            [local], [slow]]
+        assert not any(x.base_path.startswith(slow + os.sep)
+                       for x in phases[0][1])
+        assert not any('zz_symlinked' in x.base_path for x in phases[1][1])
+
+        # Within the rescan interval, copies of the old results are reused
+        shutil.rmtree(slow)
+        os.mkdir(slow)
+        clock[0] = 30
+        cached = list(scheduler.scan([slow], mounts=[]))[0][1]
+        assert ([x.base_path for x in cached] ==
+                [x.base_path for x in phases[1][1]])
+        assert cached[0] is not phases[1][1][0]
+
+        clock[0] = 90
+        assert list(scheduler.scan([slow], mounts=[]))[0][1] == []
+    finally:
+        shutil.rmtree(base)
+
+def test_dead_root_uses_cached_results():
+    """Test that a hung root costs a bounded delay and keeps its results"""
+    base = tempfile.mkdtemp()
+    hang = threading.Event()
+    original = fallback.gather_candidates
+    list_timeout, fallback.LIST_TIMEOUT = fallback.LIST_TIMEOUT, 0.1
+    try:
+        manifest = generate_library(base, 20)
+        roots = sorted(manifest['roots'])
+        scheduler = fallback.ScanScheduler(RootRegistry(),
+                                           prober=Prober(timeout=0.1))
+        before = [x.base_path for x in
+                  fallback.get_games(roots, scheduler=scheduler)]
+        assert before
+
+        def gather_candidates(path, *args, **kwargs):
+            """Simulate a mount going stale after the first scan"""
+            if path == roots[1]:
+                hang.wait()
+            return original(path, *args, **kwargs)
+        fallback.gather_candidates = gather_candidates
+
+        for _ in range(2):
+            start = time.time()
+            after = fallback.get_games(roots, scheduler=scheduler)
+            assert time.time() - start < 1
+            assert [x.base_path for x in after] == before
+        assert not scheduler.prober.is_healthy(roots[1])
+    finally:
+        fallback.gather_candidates = original
+        fallback.LIST_TIMEOUT = list_timeout
+        hang.set()
+        shutil.rmtree(base)
+
+def test_symlinked_installs_visited_once():
+    """Test that an install reachable by two paths is inspected once"""
+    base = tempfile.mkdtemp()
+    try:
+        manifest = generate_library(base, 20)
+        games, opt = sorted(manifest['roots'])
+        target = fallback.get_games([games], max_workers=1)[0].base_path
+        alias = os.path.join(opt, 'zz_symlinked')
+        os.symlink(target, alias)
+
+        inspected = []
+        original = fallback._run_subplugins
+        def run_subplugins(candidate, *args, **kwargs):
+            """Record which candidates get inspected"""
+            inspected.append(candidate)
+            return original(candidate, *args, **kwargs)
+
+        scheduler = fallback.ScanScheduler(RootRegistry())
+        fallback._run_subplugins = run_subplugins
+        try:
+            entries = fallback.get_games([games, opt], scheduler=scheduler)
+        finally:
+            fallback._run_subplugins = original
+
+        assert target in inspected and alias not in inspected
+        assert scheduler.aliases == {alias: target}
+        entry = [x for x in entries if x.base_path == target][0]
+        assert entry.aliases == set([alias])
+        assert not any(x.base_path == alias for x in entries)
+    finally:
+        shutil.rmtree(base)
+
+def test_subplugin_index():
+    """Test that only sub-plugins whose markers are present get tried"""
+    class FakePlugin(object):
+        """Stands in for a sub-plugin module"""
+        def __init__(self, name, markers, priority):
+            self.__name__, self.MARKERS, self.PRIORITY = (
+                name, markers, priority)
+
+    gog = FakePlugin('gog', (('start.sh', 'support/gog_com.shlib'),
+                             'gameinfo'), 20)
+    install_sh = FakePlugin('install_sh', ('install.sh',), 10)
+    guesser = FakePlugin('guesser', None, 0)
+    index = SubpluginIndex([guesser, install_sh, gog])
+    assert index.subplugins == [gog, install_sh, guesser]
+
+    base = tempfile.mkdtemp()
+    try:
+        def plugins_for(*files):
+            """Make a candidate containing C{files} and look it up"""
+            path = tempfile.mkdtemp(dir=base)
+            for fname in files:
+                fpath = os.path.join(path, fname)
+                if not os.path.isdir(os.path.dirname(fpath)):
+                    os.makedirs(os.path.dirname(fpath))
+                open(fpath, 'w').close()
+            return [x.__name__ for x in index.subplugins_for(path)]
+
+        assert plugins_for() == ['guesser']
+        assert plugins_for('start.sh') == ['guesser']
+        assert plugins_for('start.sh', 'support/gog_com.shlib') == [
+            'gog', 'guesser']
+        assert plugins_for('gameinfo', 'install.sh') == [
+            'gog', 'install_sh', 'guesser']
+        assert plugins_for('support/icon.png', 'game.x86') == ['guesser']
+
+        # Candidates which are files (or gone) only get the catch-alls
+        assert [x.__name__ for x in index.subplugins_for(
+            os.path.join(base, 'missing'))] == ['guesser']
+    finally:
+        shutil.rmtree(base)
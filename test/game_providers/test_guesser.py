@@ -0,0 +1,74 @@
+"""Tests for game_providers.fallback.guesser"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile
+
+# TODO: Decide on a name for the program and rename "src"
+from src.game_providers.fallback import guesser
+from src.util.executables import Roles
+
+def touch(path, executable=False):
+    """Create a file (and its parent folders)"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fobj:
+        fobj.write(b'\x7fELF')
+    if executable:
+        os.chmod(path, 0o755)
+
+def test_prune_index():
+    """Test literal and wildcard prune patterns, case-insensitively"""
+    index = guesser.PruneIndex(('*_Data', 'Mono', 'node_modules'))
+    assert 'mono' in index.literals and index.regex
+    for name in ('Foo_Data', 'foo_data', 'MONO', 'node_modules'):
+        assert name in index
+    for name in ('Data', 'Monolith', 'bin'):
+        assert name not in index
+
+def test_nested_launchers():
+    """Test finding games a level down without wading into asset folders
+    """
+    base = tempfile.mkdtemp()
+    try:
+        # Bit.Trip-style: only an uninstaller at the top level
+        game = os.path.join(base, 'BitTripRunner')
+        touch(os.path.join(game, 'uninstall-bittrip.sh'), True)
+        touch(os.path.join(game, 'bit.trip.runner', 'bit.trip.runner'), True)
+        touch(os.path.join(game, 'bit.trip.runner', 'icon.png'))
+        touch(os.path.join(game, 'Foo_Data', 'Mono', 'run.sh'), True)
+        result = guesser.inspect(game)
+        commands = [(x.argv, x.role) for x in result['commands']]
+        assert commands == [
+            ([os.path.join(game, 'bit.trip.runner', 'bit.trip.runner')],
+             Roles.play),
+            ([os.path.join(game, 'uninstall-bittrip.sh')], Roles.uninstall)]
+        assert result['icon'] == os.path.join(game, 'bit.trip.runner',
+                                              'icon.png')
+
+        # With descent disabled, the uninstaller is all there is
+        result = guesser.inspect(game, max_depth=0)
+        assert [x.role for x in result['commands']] == [Roles.uninstall]
+
+        # Folders with no executables at all aren't searched
+        empty = os.path.join(base, 'Empty')
+        touch(os.path.join(empty, 'README'))
+        touch(os.path.join(empty, 'bin', 'game'), True)
+        assert guesser.inspect(empty) is None
+
+        # Pruned folders are never listed, however deep the search goes
+        visited = [x[0] for x in guesser.descend(game, ['Foo_Data', 'x'], 5)]
+        assert visited == []
+
+        # Searches stop once their entry budget is spent
+        for idx in range(10):
+            touch(os.path.join(game, 'deep', 'a%d' % idx, 'file'))
+        visited = [x[0] for x in guesser.descend(game, ['deep'], 5,
+                                                 max_entries=12)]
+        assert visited == ['deep', os.path.join('deep', 'a0'),
+                           os.path.join('deep', 'a1')]
+    finally:
+        shutil.rmtree(base)
@@ -0,0 +1,48 @@
+"""Tests for the game_providers package's merging of provider results"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src import game_providers
+
+class FakeProvider(object):
+    """Stands in for a provider module"""
+    def __init__(self, *phases):
+        self.phases = phases
+
+    def get_games(self):
+        return [y for x in self.phases for y in x]
+
+class FakeStreamingProvider(FakeProvider):
+    """Stands in for a provider with C{iter_games()}, like fallback"""
+    def iter_games(self):
+        for phase in self.phases:
+            yield list(phase)
+
+def test_iter_games_streams_and_merges():
+    """Test that later phases merge into entries which were already yielded
+    """
+    menu = FakeProvider([make_entry("Braid", "xdg",
+                                    base_path='/games/braid')])
+    scan = FakeStreamingProvider(
+        [make_entry("FTL", "fallback", base_path='/opt/ftl')],
+        [make_entry("Braid", "fallback", base_path='/games/braid'),
+         make_entry("Trine", "fallback", base_path='/mnt/usb/trine')])
+
+    original = game_providers.PROVIDERS
+    game_providers.PROVIDERS = [scan, menu]
+    try:
+        batches = list(game_providers.iter_games())
+    finally:
+        game_providers.PROVIDERS = original
+
+    assert [[x.name for x in y] for y in batches] == [
+        ["Braid"], ["FTL"], ["Braid", "Trine"]]
+    braid = batches[0][0]
+    assert batches[2][0] is braid
+    assert braid.provider == set(["xdg", "fallback"])
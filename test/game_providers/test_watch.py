@@ -0,0 +1,147 @@
+"""Tests for game_providers.watch"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile, threading, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.game_providers import fallback
+from src.game_providers.common import GameLauncher, InstalledGameEntry
+from src.game_providers.fallback.roots import RootPolicy, RootRegistry
+from src.game_providers.watch import IncrementalScanner
+from src.util.probing import Prober
+
+class FakeWatcher(object):
+    """Records watches instead of installing them"""
+    def __init__(self):
+        self.paths = set()
+
+    def add_watch(self, path):
+        self.paths.add(os.path.abspath(path))
+        return True
+
+    def remove_watch(self, path):
+        self.paths.discard(os.path.abspath(path))
+
+    @staticmethod
+    def probe(path, func, *args):  # pylint: disable=unused-argument
+        return func(*args)
+
+class FakeProvider(object):
+    """A granular provider which finds folders containing C{play.sh}"""
+    __name__ = 'fake'
+
+    def __init__(self, root):
+        self.WATCH_PATHS = [root]  # pylint: disable=invalid-name
+        self.full_scans = 0
+
+    def candidate_for(self, path):
+        return fallback.candidate_for(path, self.WATCH_PATHS)
+
+    def gather_candidates(self, root):
+        return set(os.path.join(root, x) for x in os.listdir(root))
+
+    def inspect_candidate(self, candidate):
+        launcher = os.path.join(candidate, 'play.sh')
+        if not os.path.exists(launcher):
+            return None
+        return InstalledGameEntry(
+            name=os.path.basename(candidate), base_path=candidate,
+            commands=[GameLauncher(name="Play", provider="fake",
+                                   argv=['/bin/true', launcher])])
+
+    def get_games(self):
+        self.full_scans += 1
+        root = self.WATCH_PATHS[0]
+        return [x for x in (self.inspect_candidate(y) for y in
+                            sorted(self.gather_candidates(root))) if x]
+
+def test_candidate_for():
+    """Test that changed paths map to the top-level folder containing them"""
+    roots = ['/games', '/home/me/opt/']
+    assert fallback.candidate_for('/games/braid/data/x.pak', roots) == (
+        '/games/braid')
+    assert fallback.candidate_for('/home/me/opt/ftl', roots) == (
+        '/home/me/opt/ftl')
+    assert fallback.candidate_for('/games', roots) is None
+    assert fallback.candidate_for('/gamesx/braid', roots) is None
+
+def test_handle_changes():
+    """Test that a game copied into a new folder is found incrementally"""
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, 'empty'))
+        provider = FakeProvider(root)
+        scanner = IncrementalScanner([provider], FakeWatcher())
+        assert scanner.scan() == []
+        assert scanner.watcher.paths == set([root,
+                                             os.path.join(root, 'empty')])
+
+        # Creating the folder comes before its contents
+        game = os.path.join(root, 'game')
+        os.mkdir(game)
+        assert scanner.handle_changes([game])
+        assert scanner.games == [] and game in scanner.watcher.paths
+
+        with open(os.path.join(game, 'play.sh'), 'w'):
+            pass
+        assert scanner.handle_changes([os.path.join(game, 'play.sh')])
+        assert [x.name for x in scanner.games] == ['game']
+        assert provider.full_scans == 1
+
+        # Changes outside the provider's paths are ignored...
+        assert not scanner.handle_changes(['/elsewhere/file'])
+
+        # ...deleting the folder drops both the game and the watch...
+        shutil.rmtree(game)
+        assert scanner.handle_changes([game])
+        assert scanner.games == [] and game not in scanner.watcher.paths
+
+        # ...and lost events force a full rescan
+        assert scanner.handle_changes([None])
+        assert provider.full_scans == 2
+    finally:
+        shutil.rmtree(root)
+
+def test_unavailable_roots():
+    """Test that unmounted or hung roots don't hold up a scan"""
+    local, hung = tempfile.mkdtemp(), tempfile.mkdtemp()
+    unmounted = os.path.join(local, 'not_mounted')
+    release = threading.Event()
+    try:
+        os.mkdir(os.path.join(local, 'game'))
+        os.mkdir(os.path.join(hung, 'game'))
+        provider = FakeProvider(local)
+        provider.WATCH_PATHS += [hung, unmounted]
+        provider.SCHEDULER = fallback.ScanScheduler(
+            RootRegistry([RootPolicy(unmounted, networked=True,
+                                     mount_point='/nowhere')]),
+            prober=Prober(timeout=0.1))
+
+        gather = provider.gather_candidates
+
+        def gather_candidates(root):
+            if root == hung:
+                release.wait()
+            return gather(root)
+        provider.gather_candidates = gather_candidates
+
+        scanner = IncrementalScanner([provider], FakeWatcher())
+        start = time.time()
+        scanner.scan()
+        assert time.time() - start < 1
+        assert scanner.watcher.paths == set([
+            local, os.path.join(local, 'game'), hung])
+
+        # The hung root is skipped entirely until its backoff expires
+        scanner.watcher.paths.clear()
+        scanner.scan()
+        assert scanner.watcher.paths == set([
+            local, os.path.join(local, 'game')])
+    finally:
+        release.set()
+        shutil.rmtree(local)
+        shutil.rmtree(hung)
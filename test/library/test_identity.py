@@ -0,0 +1,82 @@
+"""Tests for library.identity"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.identity import (IdentityResolver, identity_keys,
+                                  normalize_name)
+
+def test_normalize_name():
+    """Test that normalize_name() ignores case and punctuation"""
+    assert (normalize_name("Trine 2: Complete Story") ==
+            normalize_name("trine 2 - complete_story"))
+    assert normalize_name("Eets 2") != normalize_name("Eets Munchies")
+
+def test_identity_keys_order():
+    """Test that identity_keys() ranks game IDs above names and paths"""
+    keys = identity_keys(make_entry(
+        "Terraria", argv=['/games/terraria/start.sh'],
+        base_path="/games/terraria", game_id="gog_terraria"))
+    assert keys == ['gid:gog_terraria', 'name:terraria',
+                    'path:/games/terraria']
+
+def test_reinstall_reattaches():
+    """Test that a reinstall elsewhere finds the old record by game ID"""
+    resolver = IdentityResolver()
+    old = make_entry("Terraria", base_path="/games/terraria",
+                     game_id="gog_terraria")
+    resolver.resolve([old])
+
+    new = make_entry("Terraria v1.3", base_path="/home/user/opt/terraria",
+                     game_id="gog_terraria")
+    resolver.resolve([new])
+    assert new.identity == old.identity
+
+    # ...and the new path now leads back to the same record too
+    assert resolver.index['path:/home/user/opt/terraria'] == old.identity
+
+def test_no_shared_identities():
+    """Test that two copies of a game don't share a record"""
+    resolver = IdentityResolver()
+    first = make_entry("Race the Sun", base_path="/games/race_the_sun_1.10")
+    second = make_entry("Race the Sun", base_path="/games/race_the_sun_1.42")
+    resolver.resolve([first, second])
+    assert first.identity != second.identity
+
+    # ...and rescanning puts each copy back on its own record
+    first_again = make_entry("Race the Sun",
+                             base_path="/games/race_the_sun_1.10")
+    second_again = make_entry("Race the Sun",
+                              base_path="/games/race_the_sun_1.42")
+    resolver.resolve([second_again, first_again])
+    assert first_again.identity == first.identity
+    assert second_again.identity == second.identity
+
+def test_conflicting_ids():
+    """Test that a shared name can't merge games with different IDs, even
+    when they're resolved in separate batches
+    """
+    resolver = IdentityResolver()
+    first, second, third = [make_entry("Foo", base_path=x) for x in
+                            ('/games/a', '/games/b', '/games/c')]
+    first.provider_id, second.provider_id = 'X:a', 'Y:b'
+    resolver.resolve([first])
+    resolver.resolve([second])
+    assert first.identity == 'pid:X:a'
+    assert second.identity == 'pid:Y:b'
+
+    # ...and the shared name is no longer trusted for anything else
+    resolver.resolve([third])
+    assert third.identity not in (first.identity, second.identity)
+
+    # ...even after reloading the index (eg. from the library store)
+    reloaded = IdentityResolver(resolver.index.items())
+    again = make_entry("Foo", base_path='/games/b')
+    again.provider_id = 'Y:b'
+    reloaded.resolve([again])
+    assert again.identity == second.identity
@@ -0,0 +1,44 @@
+"""Tests for library.index"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.index import GameIndex, write_index
+
+def test_index_roundtrip():
+    """Test that the index supports prefix, exact, and casefolded lookups"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'index.bin')
+        write_index([
+            make_entry("Trine 2: Complete Story",
+                       argv=['/bin/true', 'trine2']),
+            make_entry("Trine", argv=['/bin/true', 'trine'], path='/tmp'),
+            make_entry("Escape Goat 2", argv=['/bin/true', 'goat']),
+            make_entry("Straße", argv=['/bin/true', 'strasse']),
+        ], path)
+
+        index = GameIndex(path)
+        assert len(index) == 4
+        assert [x.name for x in index.match('')] == [
+            "Escape Goat 2", "Straße", "Trine", "Trine 2: Complete Story"]
+        assert [x.name for x in index.match('TRINE')] == [
+            "Trine", "Trine 2: Complete Story"]
+
+        # Exact matches beat prefix matches
+        record = index.lookup('trine')[0]
+        assert record.argv == ['/bin/true', 'trine'] and record.cwd == '/tmp'
+        assert [x.name for x in index.lookup('trine 2')] == [
+            "Trine 2: Complete Story"]
+        assert [x.name for x in index.lookup('STRASSE')] == ["Straße"]
+        assert index.lookup('portal') == []
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
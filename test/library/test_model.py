@@ -0,0 +1,190 @@
+"""Tests for library.model"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import random, time
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.model import (CHANGE, INSERT, REMOVE, LibraryModel,
+                               ModelListener, RowBatcher)
+
+class MirrorListener(ModelListener):
+    """Keeps its own copy of the rows purely from the notifications, the
+    way a toolkit view would, checking each one is consistent.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.rows = list(model.rows)
+        self.changes = []
+
+    def rows_about_to_change(self, kind, first, count):
+        assert self.rows == self.model.rows
+        if kind == REMOVE:
+            assert first + count <= len(self.rows)
+
+    def rows_changed(self, kind, first, count):
+        if kind == INSERT:
+            self.rows[first:first] = self.model.rows[first:first + count]
+        elif kind == REMOVE:
+            del self.rows[first:first + count]
+        else:
+            self.changes.extend(self.model.rows[first:first + count])
+        assert self.rows == self.model.rows
+
+def names(rows):
+    """Shorthand for comparing rows"""
+    return [x.name for x in rows]
+
+def test_model_sorting_and_batching():
+    """Test humansorted inserts coalesced into ranges until flushed"""
+    pending = []
+    model = LibraryModel([make_entry("Trine 2")],
+                         on_pending=lambda: pending.append(True))
+    mirror = MirrorListener(model)
+    model.connect(mirror)
+    assert not pending
+
+    entries = [make_entry(x) for x in
+               ("Trine 10", "Trine", "braid", "Trine 3", "Zeno Clash")]
+    model.extend(entries)
+    assert pending == [True]
+    assert names(model.rows) == ["Trine 2"]
+
+    ops = model.flush()
+    assert names(model.rows) == ["braid", "Trine", "Trine 2", "Trine 3",
+                                 "Trine 10", "Zeno Clash"]
+    assert mirror.rows == model.rows
+    assert len(ops) < len(entries)
+    assert not model.pending
+    assert model.index(entries[3]) == 3
+
+    # Renaming moves the entry; other updates are coalesced changes
+    entries[2].name = "Aquaria"
+    model.changed(entries[2])
+    model.changed(entries[0])
+    model.changed(entries[0])
+    model.changed(entries[3])
+    ops = model.flush()
+    assert names(model.rows) == ["Aquaria", "Trine", "Trine 2", "Trine 3",
+                                 "Trine 10", "Zeno Clash"]
+    assert [x for x in ops if x[0] == CHANGE] == [(CHANGE, 3, 2)]
+    assert names(mirror.changes) == ["Trine 3", "Trine 10"]
+
+    model.remove(entries[1])
+    model.remove(entries[1])
+    model.flush()
+    assert mirror.rows == model.rows
+    assert entries[1] not in model and len(model) == 5
+    try:
+        model.index(entries[1])
+    except ValueError:
+        pass
+    else:
+        assert False, "Removed entry should not be found"
+
+def test_model_filtering():
+    """Test that filters add and remove rows in place, in ranges"""
+    model = LibraryModel([make_entry("Game %d" % x) for x in range(20)])
+    mirror = MirrorListener(model)
+    model.connect(mirror)
+
+    model.set_filter(lambda x: float(x.name.split()[1]) % 10 < 5)
+    ops = model.flush()
+    assert names(model.rows) == ["Game %d" % x for x in
+                                 (0, 1, 2, 3, 4, 10, 11, 12, 13, 14)]
+    assert ops == [(REMOVE, 5, 5), (REMOVE, 10, 5)]
+
+    # Entries added while filtered out still exist and reappear later
+    hidden = make_entry("Game 7.5")
+    model.add(hidden)
+    assert not model.pending
+    model.set_filter(None)
+    model.flush()
+    assert len(model) == 21 and model.rows[8] is hidden
+    assert mirror.rows == model.rows
+
+def test_model_random_operations():
+    """Test that the views stay consistent through arbitrary changes"""
+    rand = random.Random(0)
+    model = LibraryModel()
+    mirror = MirrorListener(model)
+    model.connect(mirror)
+
+    entries = []
+    for step in range(2000):
+        action = rand.random()
+        if action < 0.5 or not entries:
+            entries.append(make_entry("Game %d" % rand.randint(0, 500)))
+            model.add(entries[-1])
+        elif action < 0.7:
+            model.remove(entries.pop(rand.randrange(len(entries))))
+        elif action < 0.9:
+            entry = rand.choice(entries)
+            entry.name = "Game %d" % rand.randint(0, 500)
+            model.changed(entry)
+        else:
+            threshold = rand.randint(0, 500)
+            model.set_filter(rand.choice((None, lambda x, t=threshold:
+                                          int(x.name.split()[1]) < t)))
+        if step % 37 == 0:
+            model.flush()
+    model.flush()
+
+    assert mirror.rows == model.rows
+    keys = [model.sort_key(x) for x in model.rows]
+    assert keys == sorted(keys)
+
+def test_model_streaming_speed():
+    """Test that streaming entries in doesn't re-sort each time"""
+    entries = [make_entry("Game %d" % x) for x in range(10000)]
+    random.Random(0).shuffle(entries)
+    model = LibraryModel()
+
+    start = time.time()
+    for entry in entries:
+        model.add(entry)
+    ops = model.flush()
+    duration = time.time() - start
+    assert len(model) == 10000
+    assert len(ops) < 10000
+    assert duration < 1, duration
+
+def test_row_batcher():
+    """Test that rows are emitted by count, by age, and on flush"""
+    clock, batches = [0.0], []
+    batcher = RowBatcher(batches.append, max_rows=3, max_delay=0.016,
+                         clock=lambda: clock[0])
+    assert batcher.throughput is None
+
+    batcher.extend(range(7))
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+
+    # A slow trickle goes out once its first row has waited long enough
+    clock[0] = 0.010
+    batcher.add(7)
+    assert len(batches) == 2
+    clock[0] = 0.020
+    batcher.add(8)
+    assert batches[-1] == [6, 7, 8]
+
+    batcher.add(9)
+    batcher.flush()
+    batcher.flush()
+    assert batches[-1] == [9]
+    assert (batcher.rows, batcher.batches) == (10, 4)
+    assert batcher.throughput == 10 / 0.020
+
+def test_row_batcher_populate():
+    """Test that populating 5,000 rows needs only a few dozen batches"""
+    model = LibraryModel()
+    batcher = RowBatcher(model.extend)
+    batcher.extend(make_entry("Game %d" % x) for x in range(5000))
+    batcher.flush()
+    model.flush()
+    assert len(model) == 5000
+    assert batcher.batches <= 5000 // 200 + 5, batcher.batches
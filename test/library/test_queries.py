@@ -0,0 +1,164 @@
+"""Tests for library.queries"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import random
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.queries import QueryEngine, SavedQuery, parse_duration
+from src.library.store import LibraryStore
+from src.library.tags import FilterSyntaxError
+
+DAY = 86400
+NOW = 1000 * DAY
+
+def make_library():
+    """Build a store with a few games and a play history"""
+    store = LibraryStore(':memory:')
+    entries = dict((x.name, x) for x in (
+        make_entry("Braid", "gog"), make_entry("Trine", "steam"),
+        make_entry("FTL", "gog"), make_entry("Hidden Game")))
+    store.save_scan(entries.values())
+    store.set_override(entries["Hidden Game"], hidden=True)
+
+    # Braid: 2 hours, 40 days ago. Trine: 10 minutes, yesterday.
+    braid = store.start_session(entries["Braid"], started=NOW - 40 * DAY)
+    store.end_session(braid, ended=NOW - 40 * DAY + 7200)
+    trine = store.start_session(entries["Trine"], started=NOW - DAY)
+    store.end_session(trine, ended=NOW - DAY + 600)
+    store.add_tags(entries["FTL"], ['roguelike'])
+    return store, entries
+
+def test_parse_duration():
+    """Test duration units and defaults"""
+    assert parse_duration('30', 'd') == 30 * DAY
+    assert parse_duration('1.5h', 'd') == 5400
+    assert parse_duration('2w', 'h') == 14 * DAY
+    for bad in ('', 'h', '5x', '-5d'):
+        try:
+            parse_duration(bad, 'd')
+        except FilterSyntaxError:
+            pass
+        else:
+            assert False, "Should have failed: %r" % bad
+
+def test_queries():
+    """Test each kind of term and their combinations"""
+    store, entries = make_library()
+    engine = QueryEngine(store, clock=lambda: NOW)
+
+    def names(expression):
+        """Run a query and return the sorted names of the results"""
+        return sorted(store.get_name(x) for x in engine.evaluate(expression))
+
+    assert names('') == ["Braid", "FTL", "Trine"]
+    assert names('played<30d') == ["Trine"]
+    assert names('played>30d') == ["Braid", "FTL"]
+    assert names('played:never') == ["FTL"]
+    assert names('playtime>1h') == ["Braid"]
+    assert names('playtime<1h') == ["FTL", "Trine"]
+    assert names('name:RAI') == ["Braid"]
+    assert names('name:%') == []
+    assert names('provider:gog -roguelike') == ["Braid"]
+    assert names('ROGUELIKE OR played<2d') == ["FTL", "Trine"]
+
+    try:
+        SavedQuery("Broken", 'played<soon')
+    except FilterSyntaxError:
+        pass
+    else:
+        assert False, "Should have failed"
+
+def test_saved_queries_incremental():
+    """Test persistence, incremental updates, and random picks"""
+    store, entries = make_library()
+    clock = [NOW]
+    engine = QueryEngine(store, clock=lambda: clock[0])
+    engine.define("Not played recently", 'played>30d')
+    engine.define("Co-op", 'co-op')
+    assert sorted(QueryEngine(store).queries) == ["Co-op",
+                                                  "Not played recently"]
+
+    stale = engine.get("Not played recently")
+    assert sorted(stale.results) == sorted(
+        [entries["Braid"].identity, entries["FTL"].identity])
+
+    # A session ending updates just the affected entry
+    session = store.start_session(entries["FTL"], started=NOW)
+    store.end_session(session, ended=NOW + 60)
+    engine.entry_changed(entries["FTL"].identity)
+    assert stale.results == [entries["Braid"].identity]
+
+    # ...as do newly-applied tags (re-added without a re-run)
+    assert engine.results("Co-op") == []
+    store.add_tags(entries["Trine"], ['co-op'])
+    engine.entry_changed(entries["Trine"].identity)
+    assert engine.results("Co-op") == [entries["Trine"].identity]
+
+    # Time-based queries are fully re-run once they get too old
+    clock[0] = NOW + 60 * DAY
+    assert sorted(engine.results("Not played recently")) == sorted(
+        x.identity for x in (entries["Braid"], entries["FTL"],
+                             entries["Trine"]))
+
+    rand = random.Random(0)
+    picks = set(engine.pick("Not played recently", rand) for _ in range(50))
+    assert len(picks) == 3
+    assert engine.pick("Co-op") == entries["Trine"].identity
+
+    engine.delete("Co-op")
+    assert list(QueryEngine(store).queries) == ["Not played recently"]
+
+def test_saved_query_removal():
+    """Test that swap-removal keeps the materialized results consistent"""
+    query = SavedQuery("All", '')
+    for identity in 'abcde':
+        query.add(identity)
+    query.add('a')
+    for identity in 'bez':
+        query.discard(identity)
+    assert sorted(query.results) == ['a', 'c', 'd']
+    assert all(query.results[query._positions[x]] == x
+               for x in query.results)
+    assert 'c' in query and 'b' not in query and len(query) == 3
+
+def test_tag_queries():
+    """Test that tag-only queries and counts come from a synced TagIndex"""
+    store, entries = make_library()
+    store.add_tags(entries["Braid"], ['Finished', 'puzzle'])
+    store.add_tags(entries["Hidden Game"], ['puzzle'])
+    engine = QueryEngine(store, clock=lambda: NOW)
+    assert SavedQuery(None, 'puzzle -finished').tags_only
+    assert not SavedQuery(None, 'puzzle played<1d').tags_only
+
+    def names(expression):
+        """Run a query and return the sorted names of the results"""
+        return sorted(store.get_name(x) for x in engine.evaluate(expression))
+
+    assert names('puzzle OR roguelike') == ["Braid", "FTL"]
+    assert names('finished') == ["Braid"]
+    assert names('-finished') == ["FTL", "Trine"]
+    assert engine.tag_counts() == {'Finished': 1, 'puzzle': 1,
+                                   'roguelike': 1}
+    assert engine.tag_counts('provider:gog') == {'Finished': 1, 'puzzle': 1,
+                                                 'roguelike': 1}
+    assert engine.tag_counts('-finished') == {'roguelike': 1}
+
+    # Changes reach the index through entry_changed()...
+    engine.define("Puzzles", 'puzzle')
+    store.add_tags(entries["Trine"], ['puzzle'])
+    store.set_override(entries["Braid"], hidden=True)
+    for name in ("Trine", "Braid"):
+        engine.entry_changed(entries[name].identity)
+    assert engine.results("Puzzles") == [entries["Trine"].identity]
+    assert engine.tag_counts() == {'puzzle': 1, 'roguelike': 1}
+
+    # ...and a new scan reloads it
+    store.save_scan([entries["FTL"]])
+    assert names('') == ["FTL"]
+    assert engine.tag_counts() == {'roguelike': 1}
@@ -0,0 +1,136 @@
+"""Tests for library.search"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import random, time
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.search import SearchIndex, entry_keywords, tokenize
+
+def names(results):
+    """Shorthand for comparing search results"""
+    return [x.name for x in results]
+
+def test_entry_keywords():
+    """Test that XDG categories are split and the generic one dropped"""
+    entry = make_entry("Foo", categories=['Game', 'ActionGame'],
+                       keywords=['Platformer'])
+    assert entry_keywords(entry) == ['action', 'platformer']
+
+def test_search_ranking():
+    """Test name-start > word-start > substring > keyword ranking"""
+    index = SearchIndex([
+        make_entry("Trine 2"),
+        make_entry("Escape Goat 2", keywords=['puzzle']),
+        make_entry("Goat Simulator"),
+        make_entry("Scapegoat Tales"),
+        make_entry("Zany Zoo", categories=['Game', 'Simulation'],
+                   keywords=['goats']),
+    ])
+
+    for query in ("goat", "GOAT"):
+        assert names(index.search(query)) == [
+            "Goat Simulator", "Escape Goat 2", "Scapegoat Tales", "Zany Zoo"]
+
+    # Short words only match at word starts (and hit keywords)
+    assert names(index.search("s")) == [
+        "Scapegoat Tales", "Goat Simulator", "Zany Zoo"]
+    assert names(index.search("pu")) == ["Escape Goat 2"]
+    assert names(index.search("action")) == []
+    assert names(index.search("game")) == []
+
+    # Every word must match, ranked on the total
+    assert names(index.search("goat 2")) == ["Escape Goat 2"]
+    assert names(index.search("simul")) == ["Goat Simulator", "Zany Zoo"]
+    assert names(index.search("goat simul")) == [
+        "Goat Simulator", "Zany Zoo"]
+    assert index.search("") == []
+
+    assert names(index.search("goat", limit=2)) == [
+        "Goat Simulator", "Escape Goat 2"]
+    assert len(index.search("goat", limit=None)) == 4
+
+    # Word-start matches are ordered by name, not by the word they hit
+    index = SearchIndex([make_entry("Legacy Orbit zombie 123"),
+                         make_entry("Forest Hex wizard 1230")])
+    assert names(index.search("123")) == [
+        "Forest Hex wizard 1230", "Legacy Orbit zombie 123"]
+
+def test_search_recency():
+    """Test that recently-played games win ties but not better matches"""
+    entries = [make_entry(x, identity='test:' + x) for x in
+               ("Star Control", "Starbound", "Stardew Valley", "Lone Star")]
+    index = SearchIndex(entries, {entries[2].identity: 100})
+    assert names(index.search("star")) == [
+        "Stardew Valley", "Star Control", "Starbound", "Lone Star"]
+
+    index.touch(entries[1], 200)
+    index.touch(entries[3], 300)
+    assert names(index.search("star")) == [
+        "Starbound", "Stardew Valley", "Star Control", "Lone Star"]
+    assert names(index.search("star lone")) == ["Lone Star"]
+
+def test_search_incremental():
+    """Test that adds, renames, and removals take effect immediately"""
+    first, second = make_entry("Trine"), make_entry("Braid")
+    index = SearchIndex([first])
+    assert len(index) == 1
+    assert names(index.search("tr")) == ["Trine"]
+
+    index.add(second)
+    assert names(index.search("bra")) == ["Braid"]
+
+    first.name = "Trine Enchanted Edition"
+    index.update(first)
+    assert len(index) == 2
+    assert names(index.search("enchant")) == ["Trine Enchanted Edition"]
+
+    index.remove(first)
+    index.remove(first)
+    assert index.search("tr") == []
+    assert index.search("enchant") == []
+    assert names(index.search("b")) == ["Braid"]
+
+    # Nothing should leak from the postings once everything is gone
+    index.remove(second)
+    assert len(index) == 0
+    assert not (index._trigrams or index._prefixes or index._ranks or
+                index._name_starts or index._word_starts or
+                index._keyword_starts or index._name_trigrams or
+                index._keyword_trigrams)
+
+def test_search_word_speed():
+    """Test that keystrokes don't cost a pass over the whole library"""
+    rand = random.Random(0)
+    words = ["Star", "Magic", "Dark", "Quest", "Legacy", "Orbit", "Forest"]
+    entries = []
+    for num in range(10000):
+        entries.append(make_entry(
+            "%s %s %d" % (rand.choice(words), rand.choice(words), num),
+            identity='test:%d' % num,
+            categories=['Game', rand.choice(['ActionGame', 'LogicGame'])],
+            keywords=[rand.choice(['magic', 'puzzle', 'retro'])]))
+    index = SearchIndex(entries, dict((x.identity, rand.random())
+                                      for x in rand.sample(entries, 1500)))
+
+    for query in ("s", "st", "star", "123", "magic", "puzzle", "act",
+                  "star magic", "st ma", "dark q", "magic puzzle",
+                  "quest 12", "forest orbit act", "legacy retro"):
+        start = time.time()
+        for _ in range(10):
+            assert index.search(query)
+        duration = (time.time() - start) / 10
+        assert duration < 0.001, (query, duration)
+
+    # Multi-word results must match scoring everything and sorting
+    for query in ("star magic", "forest orbit act", "st st", "magic 12"):
+        words = tokenize(query)
+        scored = sorted((-index._score(index._docs[id(x)], words),
+                         index._ranks[id(x)], x.name) for x in entries
+                        if index._score(index._docs[id(x)], words))
+        assert names(index.search(query)) == [x[2] for x in scored[:50]]
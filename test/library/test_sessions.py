@@ -0,0 +1,40 @@
+"""Tests for library.sessions"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import subprocess, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library import sessions
+from src.library.sessions import SessionTracker
+from src.library.store import LibraryStore
+from .test_store import make_entries
+
+def test_session_recorded():
+    """Test that a tracked game's session is recorded once it exits"""
+    store = LibraryStore(':memory:')
+    entry = make_entries(1)[0]
+    ended = []
+    tracker = SessionTracker(store, on_end=ended.append)
+
+    proc = subprocess.Popen(['sleep', '0.3'])
+    tracker.track(entry, proc.pid)
+    assert tracker.is_running(entry)
+
+    deadline = time.time() + 5
+    while tracker.sessions and time.time() < deadline:
+        # Reap it so it doesn't linger as a zombie
+        proc.poll()
+        time.sleep(0.05)
+        tracker.poll()
+
+    assert not tracker.is_running(entry)
+    assert len(ended) == 1 and ended[0].entry is entry
+    assert 0 < store.get_playtime()[entry.identity] < 5
+
+    # Nothing changed during the last poll, so the interval backs off
+    tracker.poll()
+    assert tracker.interval > sessions.MIN_INTERVAL
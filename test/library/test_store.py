@@ -0,0 +1,96 @@
+"""Tests for library.store"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile, time
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.store import LibraryStore
+
+def make_entries(count, prefix='/games'):
+    """Build a list of minimal entries for testing"""
+    paths = [os.path.join(prefix, 'game_%d' % x) for x in range(count)]
+    return [make_entry("Game %d" % idx, base_path=path,
+                       argv=[os.path.join(path, 'start.sh')])
+            for idx, path in enumerate(paths)]
+
+def test_overrides_persist():
+    """Test that overrides survive reopening the store and rescanning"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'library.sqlite')
+        store = LibraryStore(db_path)
+        entries = make_entries(3)
+        store.save_scan(entries)
+        store.set_override(entries[0], name="Renamed")
+        store.set_override(entries[1], hidden=True)
+        store.close()
+
+        store = LibraryStore(db_path)
+        entries = make_entries(3)
+        visible = store.apply_overrides(entries)
+        assert [x.name for x in visible] == ["Renamed", "Game 2"]
+        assert entries[1].hidden
+
+        # Renaming mustn't change the key used to find the override
+        store.set_override(entries[0], name="Renamed Again")
+        visible = store.apply_overrides(make_entries(3))
+        assert visible[0].name == "Renamed Again"
+
+        assert store.get_meta('entry_count') == 3
+        assert store.conn.execute(
+            "PRAGMA journal_mode").fetchone()[0] == 'wal'
+        store.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_apply_overrides_speed():
+    """Test that applying overrides to 5,000 entries is fast"""
+    store = LibraryStore(':memory:')
+    entries = make_entries(5000)
+    store.save_scan(entries)
+    for entry in entries[::10]:
+        store.set_override(entry, name=entry.name + " (Renamed)")
+
+    entries = make_entries(5000)
+    start = time.time()
+    store.apply_overrides(entries)
+    duration = time.time() - start
+    assert entries[0].name == "Game 0 (Renamed)"
+    assert duration < 0.1, duration
+
+def test_sessions_playtime():
+    """Test that finished sessions add up into per-game play time"""
+    store = LibraryStore(':memory:')
+    entries = make_entries(2)
+    store.save_scan(entries)
+
+    first = store.start_session(entries[0], started=100)
+    store.end_session(first, ended=160)
+    second = store.start_session(entries[0], started=200)
+    store.end_session(second, ended=230)
+    store.start_session(entries[1], started=300)
+
+    assert store.get_playtime() == {entries[0].identity: 90}
+
+def test_tags_persist():
+    """Test that user tags and custom axes round-trip"""
+    store = LibraryStore(':memory:')
+    entries = make_entries(2)
+    store.save_scan(entries)
+
+    store.add_tags(entries[0], ['finished', 'co-op'])
+    store.add_tags(entries[1], ['co-op', 'co-op'])
+    store.remove_tags(entries[0], ['finished', 'never-added'])
+    assert store.get_tags() == {entries[0].identity: set(['co-op']),
+                                entries[1].identity: set(['co-op'])}
+
+    store.set_tag_axis('co-op', 'Players')
+    store.set_tag_axis('finished', 'Status')
+    store.set_tag_axis('finished', None)
+    assert store.get_tag_axes() == {'co-op': 'Players'}
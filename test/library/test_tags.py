@@ -0,0 +1,112 @@
+"""Tests for library.tags"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import random, time
+
+from ..common import make_entry
+
+# TODO: Decide on a name for the program and rename "src"
+from src.library.tags import (FilterSyntaxError, TagIndex, entry_tags,
+                              iter_bits, parse_filter)
+
+def names(entries):
+    """Shorthand for comparing filter results"""
+    return sorted(x.name for x in entries)
+
+def test_parse_filter():
+    """Test operator precedence, implied AND, negation, and errors"""
+    assert parse_filter("") is None
+    assert parse_filter("Action") == ('tag', 'action')
+    assert parse_filter('a b OR NOT c') == (
+        'or', [('and', [('tag', 'a'), ('tag', 'b')]),
+               ('not', ('tag', 'c'))])
+    assert parse_filter('a and (b or "Role  Playing") -d') == (
+        'and', [('tag', 'a'),
+                ('or', [('tag', 'b'), ('tag', 'role playing')]),
+                ('not', ('tag', 'd'))])
+    assert parse_filter('- (a)') == ('not', ('tag', 'a'))
+
+    for bad in ('(a', 'a)', 'a OR', 'NOT', '"a', 'a AND AND b'):
+        try:
+            parse_filter(bad)
+        except FilterSyntaxError:
+            pass
+        else:
+            assert False, "Should have failed: %r" % bad
+
+def test_iter_bits():
+    """Test that set bits are found lowest first"""
+    assert list(iter_bits(0)) == []
+    assert list(iter_bits(0b101001)) == [0, 3, 5]
+    assert list(iter_bits(1 << 1000 | 2)) == [1, 1000]
+
+def test_tag_filtering():
+    """Test filters, live counts, and removal with slot reuse"""
+    braid = make_entry("Braid", "gog", categories=['Game', 'Puzzle'])
+    trine = make_entry("Trine", "steam", categories=['ActionGame', 'Puzzle'])
+    ftl = make_entry("FTL", "gog", categories=['StrategyGame'])
+    assert entry_tags(braid) == set(['provider:gog', 'category:Puzzle'])
+
+    index = TagIndex()
+    for entry in (braid, trine, ftl):
+        index.add(entry, entry_tags(entry))
+    index.add(trine, ['Co-op'])
+    index.add(ftl, ['co-op', 'finished'])
+
+    assert len(index) == 3
+    assert index.tags_for(ftl) == [
+        'category:StrategyGame', 'Co-op', 'finished', 'provider:gog']
+    assert names(index.filter('')) == ["Braid", "FTL", "Trine"]
+    assert names(index.filter('CO-OP')) == ["FTL", "Trine"]
+    assert names(index.filter('co-op -finished')) == ["Trine"]
+    assert names(index.filter(
+        'category:puzzle AND (provider:gog OR finished)')) == ["Braid"]
+    assert names(index.filter('NOT provider:gog')) == ["Trine"]
+    assert index.filter('no-such-tag') == []
+
+    # How many games each tag would leave if added to the filter
+    assert index.counts(index.evaluate('provider:gog')) == {
+        'provider:gog': 2, 'category:Puzzle': 1, 'category:StrategyGame': 1,
+        'Co-op': 1, 'finished': 1}
+
+    assert index.axes({'co-op': 'Players'}) == {
+        'category': ['category:ActionGame', 'category:Puzzle',
+                     'category:StrategyGame'],
+        'provider': ['provider:gog', 'provider:steam'],
+        'Players': ['Co-op'],
+        None: ['finished']}
+
+    index.untag(ftl, ['Finished'])
+    assert 'finished' not in index.tags
+
+    index.remove(trine)
+    index.remove(trine)
+    assert trine not in index
+    assert 'provider:steam' not in index.tags
+    assert names(index.filter('co-op')) == ["FTL"]
+
+    # Freed slots are reused (and carry no stale tags)
+    index.add(trine, ['new'])
+    assert names(index.filter('new')) == ["Trine"]
+    assert names(index.filter('co-op')) == ["FTL"]
+    assert len(index) == 3
+
+def test_tag_filtering_speed():
+    """Test that multi-tag filters on a 10k library stay interactive"""
+    rand = random.Random(0)
+    tags = ['tag%d' % x for x in range(200)]
+    index = TagIndex()
+    for idx in range(10000):
+        index.add(make_entry("Game %d" % idx), rand.sample(tags, 10))
+
+    start = time.time()
+    for _ in range(10):
+        bits = index.evaluate('(tag1 OR tag2 OR tag3) -tag4 (tag5 OR tag6)')
+        index.counts(bits)
+        index.entries(bits)
+    duration = (time.time() - start) / 10
+    assert duration < 0.05, duration
@@ -0,0 +1,248 @@
+"""Generator for realistic fake game libraries to test and benchmark against
+
+(So scans can be reproduced without access to the author's own
+ C{/mnt/buffalo_ext/games})
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import base64, json, os, random
+
+# A 1x1 PNG so icon loaders have something valid to chew on
+TINY_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAj'
+    'CB0C8AAAAASUVORK5CYII=')
+
+NAME_WORDS = (
+    'ancient', 'bit', 'castle', 'cosmic', 'crimson', 'dungeon', 'escape',
+    'forest', 'goat', 'hex', 'iron', 'jazz', 'legacy', 'machine', 'moon',
+    'nuclear', 'orbit', 'paper', 'quest', 'rogue', 'runner', 'shadow', 'star',
+    'sorcerer', 'tower', 'vessel', 'wizard', 'zombie',
+)
+
+# How a library of N games is split between install types (cumulative
+# weights are computed from these)
+LAYOUT_WEIGHTS = (
+    ('gog', 35),
+    ('install_sh', 15),
+    ('unity', 20),
+    ('plain', 20),
+    ('playonlinux', 5),
+    ('scummvm', 3),
+    ('desktop', 2),
+)
+
+MENU_XML = """<!DOCTYPE Menu PUBLIC "-//freedesktop//DTD Menu 1.0//EN"
+ "http://www.freedesktop.org/standards/menu-spec/1.0/menu.dtd">
+<Menu>
+  <Name>Applications</Name>
+  <DefaultAppDirs/>
+  <Menu>
+    <Name>Games</Name>
+    <Include><Category>Game</Category></Include>
+  </Menu>
+</Menu>
+"""
+
+def _write(path, content, mode=None):
+    """Write a file, creating parent directories as needed"""
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    with open(path, 'wb') as fobj:
+        fobj.write(content.encode('utf-8')
+                   if not isinstance(content, bytes) else content)
+    if mode is not None:
+        os.chmod(path, mode)
+
+def _make_gog(root, title, slug, idx, asset_size):
+    """GOG.com tarball layout with start.sh, gameinfo, and support/"""
+    path = os.path.join(root, title)
+    game_id = 'gog_' + slug
+    _write(os.path.join(path, 'start.sh'), '\n'.join((
+        '#!/bin/bash',
+        'GAME_NAME="%s"' % title,
+        'PACKAGE_NAME="%s"' % game_id,
+        'source support/gog_com.shlib',
+        'define_option "-s" "start" "start ${game_name} [default]" '
+        '"start_game" "default"',
+        'define_option "-c" "config" "configure" "config_game" "default"',
+        '')), 0o755)
+    _write(os.path.join(path, 'gameinfo'),
+           '%s\n%s\n1.0.%d\n' % (title, game_id, idx))
+    _write(os.path.join(path, 'support', 'gog_com.shlib'), '# stub\n')
+    _write(os.path.join(path, 'support', game_id + '.png'), TINY_PNG)
+    _write(os.path.join(path, 'game', slug), b'\x7fELF', 0o755)
+    _write(os.path.join(path, 'game', 'data.pak'), b'\0' * asset_size)
+
+def _make_install_sh(root, title, slug, _, asset_size):
+    """A folder installed using ssokolow's install.sh"""
+    path = os.path.join(root, slug)
+    _write(os.path.join(path, 'install.sh'), '\n'.join((
+        '#!/bin/sh',
+        'GAME_ID="%s"' % slug,
+        'GAME_NAME="%s"' % title,
+        'GAME_SYNOPSIS="A synthetic game for benchmarking"',
+        'GAME_EXEC="%s.sh"' % slug,
+        'ICON_PATH="$GAME_ID.png"',
+        'CATEGORIES="Game;ArcadeGame;"',
+        '')), 0o755)
+    _write(os.path.join(path, slug + '.sh'), '#!/bin/sh\n', 0o755)
+    _write(os.path.join(path, slug + '.png'), TINY_PNG)
+    _write(os.path.join(path, 'data', 'assets.dat'), b'\0' * asset_size)
+
+def _make_unity(root, title, _, idx, asset_size):
+    """A Unity game with a *_Data folder holding its icon and assets"""
+    camel = title.replace(' ', '')
+    path = os.path.join(root, '%s_v1_%d_linux' % (camel, idx))
+    # (Only every other game ships a 32-bit binary)
+    if idx % 2:
+        _write(os.path.join(path, camel + '.x86'), b'\x7fELF', 0o755)
+    _write(os.path.join(path, camel + '.x86_64'), b'\x7fELF', 0o755)
+    data = os.path.join(path, camel + '_Data')
+    _write(os.path.join(data, 'Resources', 'UnityPlayer.png'), TINY_PNG)
+    _write(os.path.join(data, 'Mono', 'etc', 'config'), '<config/>\n')
+    _write(os.path.join(data, 'sharedassets0.assets'), b'\0' * asset_size)
+    _write(os.path.join(data, 'level0'), b'\0' * (asset_size // 2))
+
+def _make_plain(root, title, slug, idx, asset_size):
+    """A hand-extracted tarball with a mix of +x and -x files"""
+    path = os.path.join(root, '%s-%d.%d' % (slug, idx // 10, idx % 10))
+    _write(os.path.join(path, 'play.sh'), '#!/bin/sh\n', 0o755)
+    _write(os.path.join(path, 'icon.png'), TINY_PNG)
+    _write(os.path.join(path, 'background.png'), TINY_PNG)
+    _write(os.path.join(path, 'README.txt'), title + '\n', 0o755)
+    _write(os.path.join(path, 'uninstall.sh'), '#!/bin/sh\n', 0o755)
+    _write(os.path.join(path, 'lib', 'libfoo.so.1'), b'\x7fELF', 0o755)
+    _write(os.path.join(path, 'data.bin'), b'\0' * asset_size)
+
+def _make_playonlinux(home, title, _, idx, asset_size):
+    """A PlayOnLinux shortcut, icon, and WINEPREFIX"""
+    pol = os.path.join(home, '.PlayOnLinux')
+    prefix = os.path.join(pol, 'wineprefix', 'prefix_%d' % idx)
+    _write(os.path.join(pol, 'shortcuts', title), '\n'.join((
+        '#!/bin/bash',
+        '[ "$PLAYONLINUX" = "" ] && exit 0',
+        'source "$PLAYONLINUX/lib/sources"',
+        'export WINEPREFIX="%s"' % prefix,
+        'export WINEDEBUG="-all"',
+        'cd "%s/drive_c/Game"' % prefix,
+        'POL_Wine "Game.exe" "$@"',
+        '')), 0o755)
+    _write(os.path.join(pol, 'icones', '32', title), TINY_PNG)
+    _write(os.path.join(prefix, 'drive_c', 'Game', 'Game.exe'),
+           b'MZ' + b'\0' * asset_size)
+
+def _make_scummvm(home, title, slug, _, asset_size):
+    """A game folder plus the matching .scummvmrc section"""
+    path = os.path.join(home, 'scummvm', slug)
+    _write(os.path.join(path, 'RESOURCE.001'), b'\0' * asset_size)
+    with open(os.path.join(home, '.scummvmrc'), 'a') as fobj:
+        fobj.write('[%s]\ndescription=%s\ngameid=%s\npath=%s\n\n' % (
+            slug, title, slug.split('_')[0], path))
+
+def _make_desktop(home, title, slug, _, asset_size):
+    """A system-installed game with an XDG .desktop file"""
+    path = os.path.join(home, 'bin', slug)
+    _write(path, '#!/bin/sh\n' + '#' * asset_size, 0o755)
+    _write(os.path.join(home, '.local', 'share', 'applications',
+                        slug + '.desktop'), '\n'.join((
+        '[Desktop Entry]',
+        'Type=Application',
+        'Name=%s' % title,
+        'Comment=A synthetic game for benchmarking',
+        'Exec=%s' % path,
+        'Icon=%s' % slug,
+        'Categories=Game;ArcadeGame;',
+        'Keywords=synthetic;benchmark;',
+        '')))
+
+LAYOUTS = {
+    'gog': _make_gog,
+    'install_sh': _make_install_sh,
+    'unity': _make_unity,
+    'plain': _make_plain,
+    'playonlinux': _make_playonlinux,
+    'scummvm': _make_scummvm,
+    'desktop': _make_desktop,
+}
+
+# Layouts which live in the fake $HOME rather than a GAMES_DIRS root
+HOME_LAYOUTS = ('playonlinux', 'scummvm', 'desktop')
+
+def generate_library(base, count, seed=0, asset_size=4096):
+    """Build a fake library of C{count} games inside C{base}.
+
+    @param asset_size: Size in bytes of the larger fake asset files.
+    @returns: A manifest dict with C{home} (a fake C{$HOME}), C{roots} (for
+        C{fallback.GAMES_DIRS}), C{env} (variables to set before importing
+        the providers), and C{counts} (games generated per layout).
+    """
+    rng = random.Random(seed)
+    home = os.path.join(base, 'home')
+    roots = [os.path.join(home, 'opt'), os.path.join(base, 'games')]
+    for path in roots + [os.path.join(home, '.config', 'menus')]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    _write(os.path.join(home, '.config', 'menus', 'applications.menu'),
+           MENU_XML)
+
+    total = sum(x[1] for x in LAYOUT_WEIGHTS)
+    counts = {}
+    for idx in range(count):
+        # Deterministically interleave layouts in proportion to weights
+        pick = (idx * 7919) % total
+        for layout, weight in LAYOUT_WEIGHTS:
+            if pick < weight:
+                break
+            pick -= weight
+
+        words = rng.sample(NAME_WORDS, 2)
+        title = '%s %s %d' % (words[0].title(), words[1].title(), idx)
+        slug = '%s_%s_%d' % (words[0], words[1], idx)
+
+        target = home if layout in HOME_LAYOUTS else roots[idx % len(roots)]
+        LAYOUTS[layout](target, title, slug, idx, asset_size)
+        counts[layout] = counts.get(layout, 0) + 1
+
+    manifest = {
+        'home': home,
+        'roots': roots,
+        'count': count,
+        'counts': counts,
+        'env': {
+            'HOME': home,
+            'XDG_CONFIG_HOME': os.path.join(home, '.config'),
+            'XDG_CONFIG_DIRS': os.path.join(home, '.config'),
+            'XDG_DATA_HOME': os.path.join(home, '.local', 'share'),
+            'XDG_DATA_DIRS': os.path.join(home, '.local', 'share'),
+            'XDG_MENU_PREFIX': '',
+        },
+    }
+    with open(os.path.join(base, 'manifest.json'), 'w') as fobj:
+        json.dump(manifest, fobj, indent=2)
+    return manifest
+
+def drop_caches(path):
+    """Best-effort eviction of a tree's file contents from the page cache.
+
+    (Uses C{posix_fadvise(DONTNEED)}, which doesn't need root. Cached
+     dentries and inodes can't be dropped this way, so "cold" results are
+     only cold with respect to file contents.)
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for parent, _, files in os.walk(path):
+        for fname in files:
+            try:
+                fdesc = os.open(os.path.join(parent, fname), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fdesc, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fdesc)
@@ -0,0 +1,160 @@
+"""Tests for the library daemon and its client"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import json, os, shutil, socket, tempfile, threading
+
+# TODO: Decide on a name for the program and rename "src"
+from src.daemon import (DaemonClient, DaemonError, LibraryDaemon,
+                        ProtocolError, decode_messages, encode_message,
+                        entry_from_dict, entry_to_dict)
+from src.game_providers.watch import IncrementalScanner
+from src.library.store import LibraryStore
+from src.game_providers.common import GameLauncher, InstalledGameEntry
+
+class FakeProvider(object):
+    """Minimal stand-in for a provider module"""
+    __name__ = 'fake'
+
+    @staticmethod
+    def get_games():
+        return [InstalledGameEntry(name="Game %d" % idx,
+                                   base_path='/games/game_%d' % idx,
+                                   commands=[GameLauncher(
+                                       name="Game %d" % idx, provider="test",
+                                       argv=['/bin/true', str(idx)])])
+                for idx in range(3)]
+
+def test_framing():
+    """Test that frames survive being split and coalesced arbitrarily"""
+    data = encode_message({'cmd': 'ping'}) + encode_message([1, 'two'])
+    buf = bytearray(data[:5])
+    assert decode_messages(buf) == []
+    buf.extend(data[5:])
+    assert decode_messages(buf) == [{'cmd': 'ping'}, [1, 'two']]
+    assert not buf
+
+    try:
+        decode_messages(bytearray(b'\xff\xff\xff\xff'))
+    except ProtocolError:
+        pass
+    else:
+        assert False, "Oversized frame wasn't rejected"
+
+def test_daemon_queries():
+    """Test that a client can list, search, and get entries"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        daemon = LibraryDaemon(os.path.join(tmpdir, 'sock'),
+                               scanner=IncrementalScanner([FakeProvider]),
+                               store=LibraryStore(':memory:'),
+                               index_path=os.path.join(tmpdir, 'index.bin'))
+        daemon.listen()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            client = DaemonClient(daemon.socket_path)
+            assert client.ping() == 'pong'
+            entries = client.list()
+            assert sorted(x['name'] for x in entries) == [
+                'Game 0', 'Game 1', 'Game 2']
+            assert [x['name'] for x in client.search('game 1')] == ['Game 1']
+            assert client.get(entries[0]['identity']) == entries[0]
+
+            try:
+                client.get('nonexistent')
+            except DaemonError:
+                pass
+            else:
+                assert False, "Missing entry didn't raise DaemonError"
+            client.close()
+        finally:
+            daemon.stop()
+            thread.join()
+        assert not os.path.exists(daemon.socket_path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_daemon_search():
+    """Test that searches are ranked and follow rescans incrementally"""
+    names = ["Starbound", "Lone Star", "Braid"]
+
+    class Provider(object):
+        """A provider whose games can be renamed between scans"""
+        __name__ = 'renamable'
+
+        @staticmethod
+        def get_games():
+            return [InstalledGameEntry(name=name, base_path='/games/%d' % idx,
+                                       commands=[GameLauncher(
+                                           name=name, provider="test",
+                                           argv=['/bin/true', str(idx)])])
+                    for idx, name in enumerate(names)]
+
+    daemon = LibraryDaemon(os.devnull, scanner=IncrementalScanner([Provider]),
+                           store=LibraryStore(':memory:'), index_path=None)
+    daemon._refresh(daemon.scanner.scan())
+    assert [x['name'] for x in daemon.cmd_search('star')] == [
+        "Starbound", "Lone Star"]
+    assert len(daemon.cmd_search('star', limit=1)) == 1
+    braid = daemon._indexed[daemon.cmd_search('braid')[0]['identity']]
+
+    names[1] = "Lone Planet"
+    assert daemon.cmd_rescan() == 3
+    assert [x['name'] for x in daemon.cmd_search('star')] == ["Starbound"]
+    assert [x['name'] for x in daemon.cmd_search('planet')] == [
+        "Lone Planet"]
+
+    # Unchanged entries weren't re-indexed but results are still current
+    assert daemon._indexed[braid.identity] is braid
+    assert daemon.cmd_search('braid')[0] == entry_to_dict(
+        daemon._by_identity[braid.identity])
+
+def test_stalled_client():
+    """Test that a client which stops reading doesn't block the others"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        daemon = LibraryDaemon(os.path.join(tmpdir, 'sock'),
+                               scanner=IncrementalScanner([FakeProvider]),
+                               store=LibraryStore(':memory:'),
+                               index_path=None)
+        daemon.listen()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            # Far more responses than the socket buffers can hold
+            stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stalled.connect(daemon.socket_path)
+            stalled.sendall(encode_message({'cmd': 'list'}) * 5000)
+
+            client = DaemonClient(daemon.socket_path, timeout=5)
+            assert client.ping() == 'pong'
+            client.close()
+
+            # ...and the stalled client still gets every response in order
+            stalled.settimeout(5)
+            buf, responses = bytearray(), []
+            while len(responses) < 5000:
+                data = stalled.recv(65536)
+                assert data, "Daemon dropped the stalled client"
+                buf.extend(data)
+                responses.extend(decode_messages(buf))
+            assert all(len(x['result']) == 3 for x in responses)
+            stalled.close()
+        finally:
+            daemon.stop()
+            thread.join()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_entry_from_dict():
+    """Test that entries survive the trip through the protocol"""
+    entry = FakeProvider.get_games()[0]
+    entry.identity = 'path:/games/game_0'
+    data = entry_to_dict(entry)
+    copy = entry_from_dict(json.loads(json.dumps(data)))
+    assert entry_to_dict(copy) == data
+    assert copy.default_launcher.argv == ['/bin/true', '0']
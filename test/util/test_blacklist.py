@@ -0,0 +1,84 @@
+"""Tests for util.blacklist"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, random, shutil, tempfile
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util.blacklist import BlacklistFile, GlobMatcher, compile_globs
+from src.util.common import multiglob_compile
+
+def check_equivalent(globs, paths):
+    """Assert that GlobMatcher agrees with multiglob_compile(prefix=True)"""
+    expected = multiglob_compile(globs, prefix=True)
+    matcher = GlobMatcher(globs)
+    for path in paths:
+        assert matcher.match(path) == bool(expected.match(path)), (
+            globs, path)
+
+def test_glob_matcher_equivalence():
+    """Test that GlobMatcher keeps multiglob_compile's prefix semantics"""
+    globs = ['*/teensyduino.old', '*/firefox', '*/fennec[_-]*',
+             '/mnt/games/old', '/mnt/games/*.bak', '/mnt/games/tmp/',
+             '/opt/?ame', 'loose*', '*']
+    paths = ['/mnt/games/firefox', '/mnt/games/firefox_esr', '/firefox',
+             '/opt/teensyduino.old/bin', '/opt/fennec-10', '/opt/fennec10',
+             '/mnt/games/oldies', '/mnt/games/x.bak', '/mnt/games/tmp',
+             '/mnt/games/tmp/x', '/opt/game', '/opt/games/x', 'loose/x',
+             '/mnt/games']
+    for count in range(len(globs) + 1):
+        check_equivalent(globs[:count], paths)
+
+    # Arbitrary mixes of literal and wildcard components
+    rand = random.Random(0)
+    parts = ['opt', 'games', 'fire', 'firefox', 'x*', '*', '?y', '[ab]c', '']
+    names = ['opt', 'games', 'fire', 'firefox', 'firefox_old', 'xz', 'yy',
+             'ac', 'x*', '?y']
+    for _ in range(200):
+        globs = [rand.choice(('', '/', '*/', '*')) + '/'.join(
+            rand.choice(parts) for _ in range(rand.randint(1, 4)))
+            for _ in range(rand.randint(1, 10))]
+        paths = [rand.choice(('', '/')) + '/'.join(
+            rand.choice(names) for _ in range(rand.randint(1, 5)))
+            for _ in range(50)]
+        check_equivalent(globs, paths)
+
+def test_compile_globs_cached():
+    """Test that each distinct blacklist is only compiled once"""
+    matcher = compile_globs(['*/firefox'])
+    assert compile_globs(('*/firefox',)) is matcher
+    assert compile_globs(['*/fennec']) is not matcher
+
+def test_blacklist_file_reload():
+    """Test that the user's blacklist is re-read when its mtime changes"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'blacklist')
+        blacklist = BlacklistFile(path, ['*/firefox'])
+        assert blacklist.globs == ['*/firefox']
+        assert not blacklist.matcher().match('/opt/trine')
+
+        with open(path, 'w') as fobj:
+            fobj.write("# Broken games\n\n  */trine  \n/opt/old*\n")
+        os.utime(path, (1000, 1000))
+        assert blacklist.globs == ['*/firefox', '*/trine', '/opt/old*']
+        assert blacklist.matcher().match('/opt/trine')
+        assert blacklist.matcher().match('/opt/oldgame')
+
+        # Unchanged mtime means no re-read...
+        with open(path, 'w') as fobj:
+            fobj.write("*/braid\n")
+        os.utime(path, (1000, 1000))
+        assert blacklist.globs == ['*/firefox', '*/trine', '/opt/old*']
+
+        # ...until it changes
+        os.utime(path, (2000, 2000))
+        assert blacklist.globs == ['*/firefox', '*/braid']
+
+        os.remove(path)
+        assert blacklist.globs == ['*/firefox']
+    finally:
+        shutil.rmtree(tmpdir)
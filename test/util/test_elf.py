@@ -0,0 +1,77 @@
+"""Tests for util.elf"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util import elf
+from src.util.elf import DependencyChecker, parse_elf
+
+SAMPLE_BINARY = '/bin/ls'
+
+def test_parse_non_elf():
+    """Test that parse_elf() rejects scripts and missing files"""
+    assert parse_elf(__file__) is None
+    assert parse_elf('/nonexistent/binary') is None
+
+def test_damaged_string_table():
+    """Test that unreadable sonames fail the parse rather than reading as ''
+    """
+    info = parse_elf(SAMPLE_BINARY)
+    if not info or not info.needed:
+        return  # No dynamically-linked binary to experiment on
+    assert '' not in info.needed
+
+    tmpdir = tempfile.mkdtemp()
+    original = elf.MAX_STRTAB_SIZE
+    try:
+        # A string table over the sanity limit isn't silently truncated...
+        elf.MAX_STRTAB_SIZE = 16
+        assert parse_elf(SAMPLE_BINARY) is None
+        elf.MAX_STRTAB_SIZE = original
+
+        # ...and neither is one cut short by the end of the file
+        with open(SAMPLE_BINARY, 'rb') as fobj:
+            data = fobj.read()
+        soname = info.needed[0].encode('ascii')
+        path = os.path.join(tmpdir, 'game')
+        with open(path, 'wb') as fobj:
+            fobj.write(data[:data.index(soname + b'\0') + 1])
+        assert parse_elf(path) is None
+    finally:
+        elf.MAX_STRTAB_SIZE = original
+        shutil.rmtree(tmpdir)
+
+def test_missing_library_detected():
+    """Test that a renamed DT_NEEDED entry is reported as missing"""
+    info = parse_elf(SAMPLE_BINARY)
+    if not info or not info.needed:
+        return  # No dynamically-linked binary to experiment on
+    checker = DependencyChecker()
+    assert checker.find_missing(SAMPLE_BINARY) == []
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Corrupt the first soname without changing the string table layout
+        with open(SAMPLE_BINARY, 'rb') as fobj:
+            data = fobj.read()
+        soname = info.needed[0].encode('ascii')
+        broken = b'x' + soname[1:]
+        path = os.path.join(tmpdir, 'game')
+        with open(path, 'wb') as fobj:
+            fobj.write(data.replace(soname + b'\0', broken + b'\0'))
+
+        assert checker.find_missing(path) == [broken.decode('ascii')]
+        assert checker.check_launcher(['/bin/sh', '-c', 'true']) == []
+
+        # ...and bundling it in the game's lib folder satisfies it
+        os.mkdir(os.path.join(tmpdir, 'lib'))
+        shutil.copy(checker.resolve(info.needed[0], info, '/'),
+                    os.path.join(tmpdir, 'lib', broken.decode('ascii')))
+        assert checker.check_launcher([path], tmpdir) == []
+    finally:
+        shutil.rmtree(tmpdir)
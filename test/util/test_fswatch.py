@@ -0,0 +1,158 @@
+"""Tests for util.fswatch"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile, threading, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util import fswatch
+from src.util.fswatch import (FilesystemWatcher, PollingWatcher, get_fstype,
+                              get_mounts, is_network_path)
+from src.util.probing import Prober
+
+test_mounts = [
+    ('/mnt/buffalo_ext', 'nfs4'),
+    ('/home', 'ext4'),
+    ('/', 'ext4'),
+]
+
+def test_get_fstype():
+    """Test that get_fstype() picks the deepest matching mount point"""
+    assert get_fstype('/mnt/buffalo_ext/games', test_mounts) == 'nfs4'
+    assert get_fstype('/mnt/buffalo_ext', test_mounts) == 'nfs4'
+    assert get_fstype('/mnt/buffalo_extra', test_mounts) == 'ext4'
+    assert get_fstype('/home/user/opt', test_mounts) == 'ext4'
+    assert is_network_path('/mnt/buffalo_ext/games', test_mounts)
+    assert not is_network_path('/usr/games', test_mounts)
+
+def test_get_mounts():
+    """Test parsing the mount table, including its octal escapes"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'mounts')
+        with open(path, 'w') as fobj:
+            fobj.write("/dev/sda1 / ext4 rw 0 0\n"
+                       "nas:/games /mnt/My\\040Games nfs4 rw 0 0\n"
+                       "/dev/sdb1 /media/a\\134b vfat rw 0 0\n"
+                       "garbage\n")
+        assert get_mounts(path) == [('/mnt/My Games', 'nfs4'),
+                                    ('/media/a\\b', 'vfat'), ('/', 'ext4')]
+        assert get_mounts(os.path.join(tmpdir, 'missing')) == []
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_filesystem_watcher():
+    """Test that FilesystemWatcher reports new children of a watched dir"""
+    root = tempfile.mkdtemp()
+    watcher = FilesystemWatcher(settle_time=0.05)
+    try:
+        watcher.add_watch(root)
+        assert watcher.wait(0.05) == set()
+
+        new_path = os.path.join(root, 'new_game')
+        os.mkdir(new_path)
+        assert new_path in watcher.wait(2)
+
+        watcher.remove_watch(root)
+        assert root not in watcher.paths
+    finally:
+        watcher.close()
+        shutil.rmtree(root)
+
+def test_filesystem_watcher_rewatch():
+    """Test that a folder can be watched again after being deleted"""
+    root = tempfile.mkdtemp()
+    watcher = FilesystemWatcher(settle_time=0.05)
+    try:
+        game = os.path.join(root, 'game')
+        os.mkdir(game)
+        watcher.add_watch(root)
+        watcher.add_watch(game)
+        assert watcher.paths == set([root, game])
+
+        os.rmdir(game)
+        assert game in watcher.wait(2)
+        if watcher.inotify:
+            assert game not in watcher.paths
+
+        os.mkdir(game)
+        assert watcher.add_watch(game) and game in watcher.paths
+        watcher.wait(0.2)
+        new_path = os.path.join(game, 'play.sh')
+        with open(new_path, 'w'):
+            pass
+        assert new_path in watcher.wait(2)
+    finally:
+        watcher.close()
+        shutil.rmtree(root)
+
+def test_filesystem_watcher_missing():
+    """Test that FilesystemWatcher falls back to watching the parent"""
+    root = tempfile.mkdtemp()
+    watcher = FilesystemWatcher(settle_time=0.05)
+    try:
+        rc_path = os.path.join(root, '.scummvmrc')
+        watcher.add_watch(rc_path)
+
+        with open(rc_path, 'w') as fobj:
+            fobj.write('[scummvm]\n')
+        assert rc_path in watcher.wait(2)
+    finally:
+        watcher.close()
+        shutil.rmtree(root)
+
+def test_polling_watcher():
+    """Test that PollingWatcher notices additions and removals"""
+    root = tempfile.mkdtemp()
+    try:
+        watcher = PollingWatcher(interval=0)
+        watcher.add_watch(root)
+        assert watcher.read_events() == set()
+
+        new_path = os.path.join(root, 'new_game')
+        os.mkdir(new_path)
+        assert new_path in watcher.read_events()
+
+        os.rmdir(new_path)
+        assert new_path in watcher.read_events()
+
+        watcher.remove_watch(root)
+        os.mkdir(new_path)
+        assert watcher.read_events() == set() and not watcher.paths
+    finally:
+        shutil.rmtree(root)
+
+def test_polling_watcher_hung():
+    """Test that polling a dead network mount can't hang the caller"""
+    root = tempfile.mkdtemp()
+    release = threading.Event()
+    old_snapshot = fswatch._snapshot
+    try:
+        watcher = PollingWatcher(interval=0, prober=Prober(timeout=0.1),
+                                 mounts=[(root, 'nfs4')])
+        watcher.add_watch(root)
+
+        def hung_snapshot(path):
+            release.wait()
+            return old_snapshot(path)
+        fswatch._snapshot = hung_snapshot
+
+        start = time.time()
+        assert watcher.read_events() == set()
+        assert watcher.read_events() == set()
+        assert time.time() - start < 1
+
+        # Local paths don't pay for a thread per stat()
+        other = PollingWatcher(interval=0, prober=Prober(timeout=0.1),
+                               mounts=[('/', 'ext4')])
+        fswatch._snapshot = old_snapshot
+        other.add_watch(root)
+        assert other.probe(root, threading.current_thread) is (
+            threading.current_thread())
+    finally:
+        fswatch._snapshot = old_snapshot
+        release.set()
+        shutil.rmtree(root)
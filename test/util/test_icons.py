@@ -10,7 +10,7 @@ from os.path import join, dirname
 from ..common import json_aggregate_harness, load_json_map
 
 # TODO: Decide on a name for the program and rename "src"
-from src.util.icons import pick_icon
+from src.util.icons import ViewportIconCache, pick_icon
 
 def test_pick_icon():
     """Test that pick_icon() picks a good enough icon enough of the time"""
@@ -18,3 +18,41 @@ def test_pick_icon():
     return json_aggregate_harness(load_json_map(test_data_path),
                                   lambda x: pick_icon(*x),
                                   resolve_key_cb=json.loads)
+
+def test_viewport_icon_cache():
+    """Test that only icons near the viewport load and memory is bounded"""
+    loads = []
+    def loader(key):
+        """Record which icons get loaded"""
+        loads.append(key)
+        return key.upper()
+
+    keys = ['icon%d' % x for x in range(20000)]
+    keys_for = lambda start, stop: keys[start:stop]
+    cache = ViewportIconCache(loader, placeholder='blank', capacity=50,
+                              margin=5)
+
+    # Nothing outside the viewport is loaded, even when asked for
+    assert cache.get('icon9000') == 'blank'
+    cache.set_viewport(100, 119, keys_for)
+    assert cache.window == (95, 125)
+    assert cache.get('icon110') == 'blank'
+    assert cache.load_pending(budget=1) == set(keys[95:125])
+    assert loads[:20] == keys[100:120], "Visible rows should load first"
+    assert cache.get('icon110') == 'ICON110'
+    assert not cache.pending
+
+    # Scrolling through the whole library never exceeds the capacity
+    for first in range(0, 20000, 20):
+        cache.set_viewport(first, first + 19, keys_for)
+        cache.load_pending(budget=1)
+        assert len(cache) <= 50
+        assert cache.get(keys[first]) == keys[first].upper()
+    assert cache.evictions > 0
+    assert len(loads) < 20000 + 20000 // 2
+
+    # Evicted icons which scroll back into view are loaded again
+    cache.set_viewport(0, 19, keys_for)
+    assert cache.get('icon0') == 'blank'
+    assert cache.pending
+    assert cache.get(None) == 'blank'
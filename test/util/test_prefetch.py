@@ -0,0 +1,49 @@
+"""Tests for util.prefetch"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, shutil, tempfile
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util.prefetch import Prefetcher, plan_prefetch, prefetch_file
+
+def test_plan_prefetch_priorities():
+    """Test that plan_prefetch() orders by priority and obeys the budget"""
+    root = tempfile.mkdtemp()
+    try:
+        for path, size in (('Game.x86_64', 100),
+                           ('Game_Data/level0', 50),
+                           ('Game_Data/sharedassets0.assets', 300),
+                           ('music/track1.ogg', 400),
+                           ('README.txt', 10)):
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as fobj:
+                fobj.write(b'\0' * size)
+
+        exe = os.path.join(root, 'Game.x86_64')
+        plan = [(os.path.relpath(x, root), y)
+                for x, y in plan_prefetch(exe, root, budget=600)]
+        assert plan == [('Game.x86_64', 100),
+                        ('Game_Data/sharedassets0.assets', 300),
+                        ('Game_Data/level0', 50),
+                        ('music/track1.ogg', 150)]
+
+        assert prefetch_file(exe, 100)
+        assert not prefetch_file(os.path.join(root, 'missing'), 100)
+    finally:
+        shutil.rmtree(root)
+
+def test_prefetch_needs_install_folder():
+    """Test that games without their own folder aren't prefetched"""
+    prefetcher = Prefetcher()
+    prefetcher.request('/usr/bin/scummvm', None)
+    prefetcher.request('/usr/games/frotz', '/usr/games')
+    prefetcher.request('/usr/games/frotz', '/usr/games/')
+    prefetcher.request('/bin/sh', '/')
+    assert prefetcher._queue.empty()  # pylint: disable=protected-access
+    assert prefetcher._thread is None  # pylint: disable=protected-access
@@ -0,0 +1,62 @@
+"""Tests for util.probing"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import threading, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util.probing import CircuitOpen, ProbeError, Prober, ProbeTimeout
+
+def expect(exc_type, func, *args, **kwargs):
+    """Assert that a call raises C{exc_type}"""
+    try:
+        func(*args, **kwargs)
+    except exc_type:
+        pass
+    else:
+        assert False, "Expected %s" % exc_type.__name__
+
+def test_prober_timeout_and_backoff():
+    """Test that a hung call costs one timeout and then fails fast"""
+    clock, hang = [0], threading.Event()
+    prober = Prober(timeout=0.05, backoff=10, max_backoff=25,
+                    clock=lambda: clock[0])
+    assert prober.call('/ok', lambda x: x * 2, 21) == 42
+
+    start = time.time()
+    expect(ProbeTimeout, prober.call, '/dead', hang.wait)
+    expect(CircuitOpen, prober.call, '/dead', hang.wait)
+    assert time.time() - start < 1
+    assert not prober.is_healthy('/dead') and prober.is_healthy('/ok')
+
+    # The backoff passing doesn't help while the last probe is still stuck
+    clock[0] = 100
+    expect(CircuitOpen, prober.call, '/dead', lambda: True)
+    hang.set()
+    time.sleep(0.05)
+    assert prober.call('/dead', lambda: True)
+    assert prober.is_healthy('/dead')
+
+def test_prober_errors():
+    """Test that errors open the circuit with exponential backoff"""
+    clock = [0]
+    prober = Prober(backoff=10, max_backoff=25, clock=lambda: clock[0])
+
+    def fail():
+        """Stand in for an I/O error"""
+        raise OSError("Stale file handle")
+
+    for retry_at in (10, 30, 55, 80):
+        try:
+            prober.call('/nfs', fail)
+        except ProbeError as err:
+            assert isinstance(err.__cause__, OSError)
+        else:
+            assert False, "Should have failed"
+        expect(CircuitOpen, prober.call, '/nfs', fail)
+        clock[0] = retry_at
+    prober.reset('/nfs')
+    assert prober.is_healthy('/nfs')
@@ -0,0 +1,38 @@
+"""Tests for util.proctree"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import os, subprocess, time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util.proctree import ProcessTree, get_children, read_stat
+
+def test_read_stat_self():
+    """Test that read_stat() parses our own process's parent"""
+    assert read_stat(os.getpid())[0] == os.getppid()
+    assert read_stat(2 ** 22 + 1) is None
+
+def test_orphaned_descendant_tracked():
+    """Test that a grandchild stays tracked after its wrapper exits"""
+    wrapper = subprocess.Popen(['/bin/sh', '-c', 'sleep 1 & read _'],
+                               stdin=subprocess.PIPE)
+    tree = ProcessTree(wrapper.pid)
+    deadline = time.time() + 5
+    while len(tree.known) < 2 and time.time() < deadline:
+        time.sleep(0.02)
+        tree.refresh()
+    assert get_children(wrapper.pid)
+    grandchild = [x for x in tree.known if x != wrapper.pid][0]
+
+    # Let the wrapper exit, orphaning the sleep
+    wrapper.communicate(b'\n')
+    assert tree.refresh()
+    assert list(tree.known) == [grandchild] and tree.alive
+
+    while tree.alive and time.time() < deadline:
+        time.sleep(0.05)
+        tree.refresh()
+    assert not tree.alive
@@ -0,0 +1,72 @@
+"""Tests for util.profiling"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import json, os, threading
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util import profiling
+from src.util.blacklist import compile_globs
+from src.util.profiling import Profiler
+
+def test_profiler_counts():
+    """Test that Profiler counts fs calls and results for nested sections"""
+    def inner():
+        os.listdir('.')
+        profiling.count('cache_hit')
+        return ['a', 'b']
+
+    def outer():
+        os.stat('.')
+        return inner()
+
+    original_listdir = os.listdir
+    with Profiler() as profiler:
+        inner = profiler.wrap(inner, 'inner', 'candidates')
+        profiler.wrap(outer, 'outer')()
+
+    assert os.listdir is original_listdir, "os.listdir wasn't restored"
+    profiles = profiler.profiles
+    assert profiles['outer'].counters['fs_stat'] == 1
+    assert profiles['outer'].counters['fs_listdir'] == 1
+    assert profiles['outer'].counters['cache_hit'] == 1
+    assert 'fs_stat' not in profiles['inner'].counters
+    assert profiles['inner'].counters['candidates'] == 2
+
+    data = json.loads(profiler.to_json(version='test'))
+    assert data['version'] == 'test'
+    assert [x['name'] for x in data['profiles']] == ['outer', 'inner']
+    assert profiler.report().startswith('Section')
+
+def test_count_inactive():
+    """Test that count() is a no-op when no Profiler is active"""
+    profiling.count('cache_miss')
+
+def test_propagate():
+    """Test that worker threads are credited to the section that started
+    them, and that real caches report their hits and misses
+    """
+    def worker():
+        os.stat('.')
+        compile_globs(['*/test_propagate'])
+        compile_globs(['*/test_propagate'])
+
+    def scan(wrap):
+        thread = threading.Thread(target=wrap(worker))
+        thread.start()
+        thread.join()
+
+    with Profiler() as profiler:
+        profiler.wrap(scan, 'propagated')(profiling.propagate)
+        profiler.wrap(scan, 'plain')(lambda x: x)
+
+    assert profiler.profiles['plain'].counters == {}
+    counters = profiler.profiles['propagated'].counters
+    assert counters['fs_stat'] == 1
+    assert counters['glob_cache_miss'] == 1
+    assert counters['glob_cache_hit'] == 1
+
+    assert profiling.propagate(worker) is worker
@@ -0,0 +1,54 @@
+"""Tests for util.supervisor"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement, unicode_literals)
+
+__author__ = "Stephan Sokolow (deitarion/SSokolow)"
+__license__ = "GNU GPL 3.0 or later"
+
+import time
+
+# TODO: Decide on a name for the program and rename "src"
+from src.util.supervisor import RingBuffer, Supervisor
+
+def test_ring_buffer_bounded():
+    """Test that RingBuffer keeps only the newest bytes within its limit"""
+    buf = RingBuffer(10)
+    buf.append(b'0123456')
+    buf.append(b'789ab')
+    assert buf.getvalue() == b'23456789ab'
+    assert buf.size == 10 and buf.dropped == 2
+
+    buf.append(b'x' * 25)
+    assert buf.getvalue() == b'x' * 10
+    assert buf.dropped == 27
+
+    buf = RingBuffer(100)
+    buf.append(b'one\ntwo\nthree\n')
+    assert buf.tail(2) == 'two\nthree'
+
+def wait_for_exits(supervisor, count, timeout=10):
+    """Poll until C{count} children have exited or the timeout expires"""
+    exited, deadline = [], time.time() + timeout
+    while len(exited) < count and time.time() < deadline:
+        exited.extend(supervisor.poll(0.05))
+    return exited
+
+def test_supervisor_many_children():
+    """Test that output is captured and exits reported for many children"""
+    reported = []
+    supervisor = Supervisor(on_exit=reported.append, buffer_size=1024)
+    for idx in range(20):
+        # Each child writes far more than both the pipe and ring buffer hold
+        supervisor.spawn('game%d' % idx, ['/bin/sh', '-c',
+            'yes spam | head -c 200000; echo "bye %d" >&2; exit %d' % (
+                idx, idx % 2)])
+
+    exited = wait_for_exits(supervisor, 20)
+    supervisor.close()
+    assert len(exited) == 20 and reported == exited
+    for child in exited:
+        idx = int(child.name[4:])
+        assert child.returncode == idx % 2
+        assert child.unclean == bool(idx % 2)
+        assert child.output.size <= 1024
+        assert child.tail(1) == 'bye %d' % idx
@@ -30,11 +30,12 @@ __appname__ = "Test code to drive game providers"
 __version__ = "0.0pre0"
 __license__ = "GNU GPL 3.0 or later"
 
-import logging
+import logging, sys, time
 log = logging.getLogger(__name__)
 
 # TODO: Decide on a name for the project and rename "src"
-from src.game_providers import get_games
+from src.game_providers import get_games, instrument
+from src.util.profiling import Profiler
 
 def main():
     """The main entry point, compatible with setuptools entry points."""
@@ -47,6 +48,11 @@ def main():
         default=2, help="Increase the verbosity. Use twice for extra effect")
     parser.add_option('-q', '--quiet', action="count", dest="quiet",
         default=0, help="Decrease the verbosity. Use twice for extra effect")
+    parser.add_option('--profile', action="store_true", default=False,
+        help="Print a per-provider breakdown of where scan time went")
+    parser.add_option('--profile-json', action="store", dest="profile_json",
+        default=None, metavar="PATH", help="Write the profiling results as "
+        "JSON to PATH ('-' for stdout) for tracking regressions")
     # Reminder: %default can be used in help strings.
 
     # Allow pre-formatted descriptions
@@ -62,7 +68,26 @@ def main():
     logging.basicConfig(level=log_levels[opts.verbose],
                         format='%(levelname)s: %(message)s')
 
-    print('\n'.join(repr(x) for x in get_games()))
+    if not (opts.profile or opts.profile_json):
+        print('\n'.join(repr(x) for x in get_games()))
+        return
+
+    with Profiler() as profiler:
+        instrument(profiler)
+        games = profiler.wrap(get_games, 'get_games', 'entries')()
+
+    if opts.profile:
+        print('\n'.join(repr(x) for x in games))
+        print()
+        print(profiler.report())
+    if opts.profile_json:
+        data = profiler.to_json(version=__version__, timestamp=time.time(),
+                                python=sys.version.split()[0])
+        if opts.profile_json == '-':
+            print(data)
+        else:
+            with open(opts.profile_json, 'w') as fobj:
+                fobj.write(data)
 
 if __name__ == '__main__':
     main()
@@ -10,7 +10,7 @@ __appname__ = "Test GUI for game_launcher"
 __version__ = "0.0pre0"
 __license__ = "GNU GPL 3.0 or later"
 
-import logging, os, sys, threading
+import logging, os, sys, threading, time
 log = logging.getLogger(__name__)
 
 RES_DIR = os.path.dirname(__file__)
@@ -24,8 +24,18 @@ FALLBACK_ICON = "applications-games"
 from xml.sax.saxutils import escape as xmlescape
 
 # TODO: Decide on a name for the project and rename "src"
-from src.game_providers import get_games
-from src.util.icons import BaseIconWrapper
+from src.game_providers import get_games, iter_games
+from src.library.index import write_index
+from src.library.model import (INSERT, REMOVE, LibraryModel, ModelListener,
+                               RowBatcher)
+from src.library.queries import QueryEngine
+from src.library.search import SearchIndex
+from src.library.sessions import SessionTracker
+from src.library.store import LibraryStore
+from src.util.elf import DependencyChecker
+from src.util.icons import BaseIconWrapper, ViewportIconCache
+from src.util.prefetch import Prefetcher
+from src.util.supervisor import Supervisor
 
 try:
     import pygtk
@@ -52,6 +62,17 @@ except ImportError:
 class AsyncModelPopulate(threading.Thread):
     """Helper for offloading the heavy bits of populating the model to another
     thread.
+
+    Rows are handed to the main loop in batches (See L{RowBatcher}) rather
+    than one C{idle_add} per entry, which would flood the main loop, and as
+    each phase of the scan finishes (See L{iter_games}) so games on local
+    disks show up without waiting for slow ones.
+
+    Identifying entries and applying the user's overrides (SQLite queries
+    and C{stat()} calls) happens here too, one batch-sized chunk at a time
+    through this thread's own L{LibraryStore} connection, so each batch is
+    ready to show by the time it reaches the main loop.
+
     References used:
         - http://faq.pygtk.org/index.py?req=show&file=faq20.006.htp
         - https://docs.python.org/2/library/threading.html
@@ -60,34 +81,74 @@ class AsyncModelPopulate(threading.Thread):
         super(AsyncModelPopulate, self).__init__()
         self.app = app
         self.daemon = True
+        self.batcher = RowBatcher(
+            lambda batch: gobject.idle_add(self.app.add_entries, batch))
+
+    def shown_rows(self, store, entries):
+        """Return C{(id(entry), copy)} rows for a chunk of scanned entries,
+        where C{copy} has the user's overrides applied (or is C{None} if
+        the user has hidden it).
+
+        The scanned entries are left as they were found so they can still
+        be saved that way.
+        """
+        copies = [x.copy() for x in entries]
+        visible = set(id(x) for x in store.apply_overrides(copies))
+        return [(id(x), y if id(y) in visible else None)
+                for x, y in zip(entries, copies)]
+
+    def run(self):
+        store = LibraryStore(self.app.store.path)
+        try:
+            entries, seen = [], set()
+            for changed in iter_games():
+                for entry in changed:
+                    if id(entry) not in seen:
+                        seen.add(id(entry))
+                        entries.append(entry)
+
+                size = self.batcher.max_rows
+                for start in range(0, len(changed), size):
+                    self.batcher.extend(self.shown_rows(
+                        store, changed[start:start + size]))
+                self.batcher.flush()
+            store.save_scan(entries)
+        finally:
+            store.close()
+        gobject.idle_add(self.app.on_populate_done, self.batcher)
+
+class AsyncPreflightCheck(threading.Thread):
+    """Helper for checking every entry for missing shared libraries in a
+    background thread and refreshing the rows which turn out to be broken.
+    """
+    def __init__(self, app, checker=None):
+        super(AsyncPreflightCheck, self).__init__()
+        self.app = app
+        self.checker = checker or DependencyChecker()
+        self.daemon = True
 
-    def add_row(self, row):
-        self.app.data.append(row)
+    def refresh_row(self, entry):
+        self.app.model.library.changed(entry)
         return False
 
     def run(self):
-        entries = self.app.entries
-        if not entries:
-            entries = get_games()
-            gobject.idle_add(self.app.set_entries, entries)
-
-        for pos, entry in enumerate(entries):
-            row = (
-                GtkIconWrapper.get_scaled_icon(entry.icon, ICON_SIZE),
-                entry.name,
-                xmlescape(entry.summarize()),
-                pos
-            )
-            log.debug("Adding row: %s", row)
-            gobject.idle_add(self.add_row, row)
-
-class GtkTreeModelAdapter(gtk.GenericTreeModel):
-    """Adapter to let the frontend-agnostic data to be used as a GtkTreeModel
-    without needing to copy it.
-
-    TODO: Do batched, deferred loading of icons
-     - http://www.pygtk.org/pygtk2reference/class-gtktreemodel.html#signal-gtktreemodel--row-changed
-     - https://stackoverflow.com/questions/3164262/lazy-loaded-list-view-in-gtk
+        for entry in list(self.app.model.entries):
+            if entry.check_libraries(self.checker):
+                log.warning("%s is missing libraries: %s", entry.name,
+                            ', '.join(entry.missing_libs))
+                gobject.idle_add(self.refresh_row, entry)
+
+class GtkTreeModelAdapter(gtk.GenericTreeModel, ModelListener):
+    """Adapter to let the frontend-agnostic L{LibraryModel} be used as a
+    GtkTreeModel without needing to copy it.
+
+    Icons are only loaded for the rows around the viewport passed to
+    L{set_viewport} (in idle-time batches) and every other row gets a blank
+    placeholder, so memory use doesn't grow with the size of the library.
+
+    TODO: GtkIconView still measures every row's text when laying out, so
+          only the icons are virtualized. Fully virtualizing the grid would
+          need a custom widget.
 
     References used:
         - http://www.pygtk.org/pygtk2tutorial/sec-GenericTreeModel.html
@@ -99,10 +160,66 @@ class GtkTreeModelAdapter(gtk.GenericTreeModel):
 
     def __init__(self, entries=None):
         gtk.GenericTreeModel.__init__(self)
-        self.entries = entries or get_games()
-        # TODO: Make get_games return an iterator and rely on a sorted dict
-        #       to handle ordering incrementally loaded content.
-        # TODO: Need to humansort the results
+        self.library = LibraryModel(
+            entries if entries is not None else get_games(),
+            on_pending=lambda: gobject.idle_add(self._flush))
+        self.library.connect(self)
+
+        placeholder = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8,
+                                     ICON_SIZE, ICON_SIZE)
+        placeholder.fill(0)
+        self.icons = ViewportIconCache(
+            lambda path: GtkIconWrapper.get_scaled_icon(path, ICON_SIZE),
+            placeholder=placeholder)
+        self._loading_icons = False
+
+    @property
+    def entries(self):
+        """The entries as currently displayed"""
+        return self.library.rows
+
+    def _flush(self):
+        """Idle callback to publish batched changes from the library"""
+        self.library.flush()
+        return False
+
+    def set_viewport(self, first, last):
+        """Load icons for rows C{first} to C{last} (plus a margin) and allow
+        offscreen ones to be dropped.
+        """
+        rows = self.entries
+        self.icons.set_viewport(first, last, lambda start, stop:
+                                [x.icon for x in rows[start:stop]])
+        self._queue_icon_load()
+
+    def _queue_icon_load(self):
+        """Schedule L{_load_icons} if there are icons waiting to load"""
+        if self.icons.pending and not self._loading_icons:
+            self._loading_icons = True
+            gobject.idle_add(self._load_icons)
+
+    def _load_icons(self):
+        """Idle callback to load a frame's worth of icons and redraw the
+        rows which use them.
+        """
+        loaded = self.icons.load_pending()
+        start, stop = self.icons.window
+        for entry in self.entries[start:stop]:
+            if entry.icon in loaded:
+                self.library.changed(entry)
+        self._loading_icons = self.icons.pending
+        return self._loading_icons
+
+    def rows_changed(self, kind, first, count):
+        """Replay a range of changes from the L{LibraryModel}"""
+        for pos in range(first, first + count):
+            if kind == INSERT:
+                self.row_inserted((pos,), self.get_iter((pos,)))
+            elif kind == REMOVE:
+                # Each deletion shifts the rest of the range up into place
+                self.row_deleted((first,))
+            else:
+                self.row_changed((pos,), self.get_iter((pos,)))
 
     def get_column_names(self):
         return self.column_names[:]
@@ -127,14 +244,12 @@ class GtkTreeModelAdapter(gtk.GenericTreeModel):
     def on_get_value(self, rowref, column):
         entry = rowref[1]
         if column is 0:
-            return GtkIconWrapper.get_scaled_icon(entry.icon, ICON_SIZE)
-            #if hasattr(entry, 'icon_pixmap'):
-                #return entry.icon_pixmap
-            #else:
-                # TODO: Enqueue
-                #  entry.icon_pixmap = GtkIconWrapper.get_scaled_icon(entry.icon, ICON_SIZE)
-                #return None
+            icon = self.icons.get(entry.icon)
+            self._queue_icon_load()
+            return icon
         elif column is 1:
+            if getattr(entry, 'running', False):
+                return "%s (Running)" % entry.name
             return entry.name
         elif column is 2:
             return xmlescape(entry.summarize())
@@ -147,7 +262,7 @@ class GtkTreeModelAdapter(gtk.GenericTreeModel):
             return None
 
     def on_iter_children(self, rowref):
-        if rowref:
+        if rowref or not self.entries:
             return None
         return (0, self.entries[0])
 
@@ -172,8 +287,6 @@ class GtkTreeModelAdapter(gtk.GenericTreeModel):
 
 
 class GtkIconWrapper(BaseIconWrapper):
-    icon_cache = {}
-
     # -- Class Methods --
     @classmethod
     def init_cls(cls):
@@ -264,6 +377,8 @@ class GtkIconWrapper(BaseIconWrapper):
 
         (Employs L{_ensure_good_upscales} to minimize blurrying tiny icons)
 
+        Results aren't cached here. (See L{ViewportIconCache})
+
         @todo: Consider some kind of autocropping for things like Ultratron
                where they matted a perfectly good square icon on a rectangular
                white background.
@@ -271,10 +386,6 @@ class GtkIconWrapper(BaseIconWrapper):
         if path is None:
             return None
 
-        cache_key = (path, size)
-        if cache_key in cls.icon_cache:
-            return cls.icon_cache[cache_key]
-
         #icon = cls._from_name_direct(path, ICON_SIZE).unwrap()
 
         # Inject non-theme icon paths as builtins for consistent lookup
@@ -302,10 +413,6 @@ class GtkIconWrapper(BaseIconWrapper):
                     ICON_SIZE)
             except glib.GError as err:
                 log.error("Error while loading fallback icon: %s", err)
-
-        if result:
-            log.debug("Adding icon to cache: %s", cache_key)
-            cls.icon_cache[cache_key] = result
         return result
 
 
@@ -315,12 +422,20 @@ class Application(object):  # pylint: disable=C0111,R0902
         GtkIconWrapper.init_cls()
         self.builder = gtk.Builder()
         self.icon_theme = gtk.icon_theme_get_default()
+        self.store = LibraryStore()
+        self.supervisor = Supervisor(on_exit=self.on_game_exited)
+        self._polling_children = False
+        self.tracker = SessionTracker(self.store, on_end=self.on_game_ended)
+        self.queries = QueryEngine(self.store)
+        self.prefetcher = Prefetcher()
 
         """Parts of __init__ that should only run in the single instance."""
         # Check for some deps late enough to display a GUI error message
         self.gtkbuilder_load('testgui.glade')
 
         self.model = None
+        self.search_index = SearchIndex()
+        self._search_key, self._search_hits = None, set()
 
         self.iconview = self.builder.get_object("view_games_icons")
         # Apparently Glade won't let you set these in the XML for IconView
@@ -339,19 +454,27 @@ class Application(object):  # pylint: disable=C0111,R0902
             self.treeview.append_column(col)
 
         self.treeview.set_search_column(1)
+        self.treeview.set_search_equal_func(self._search_equal)
+
+        # Start warming the disk cache as soon as a game is selected
+        self.iconview.connect('selection-changed',
+            lambda view: self.on_selection_changed(view.get_selected_items()))
+        self.treeview.get_selection().connect('changed',
+            lambda sel: self.on_selection_changed(sel.get_selected_rows()[1]))
         #self.treeview.set_sort_column_id(1)
         #self.treeview.set_reorderable(True)
 
         self.views = [self.iconview, self.treeview]
 
-
+        # Only load icons for what's scrolled into view
+        self._viewport_queued = False
         for view in self.views:
-            pass
-            #self.data.set_sort_column_id(1, gtk.SORT_ASCENDING)
-            # TODO: Common humansort code shared between all frontends.
-            # (eg. GTK+ doesn't sort roman numerals properly.)
-            #AsyncModelPopulate(self).start()
-            #self.populate_model(self.entries)
+            view.connect('map', lambda _: self._queue_viewport_update())
+            adjustment = view.get_parent().get_vadjustment()
+            for signal in ('changed', 'value-changed'):
+                adjustment.connect(signal,
+                                   lambda _: self._queue_viewport_update())
+
 
         self.mainwin = self.builder.get_object('mainwin')
         self.mainwin.set_title('%s %s' %
@@ -361,9 +484,58 @@ class Application(object):  # pylint: disable=C0111,R0902
         gobject.idle_add(self._set_model)
 
     def _set_model(self):
-        self.model = GtkTreeModelAdapter()
+        self.model = GtkTreeModelAdapter([])
+        self._shown = {}  # id(scanned entry) -> its overridden copy
+        self.search_index = SearchIndex(last_played=
+                                        self.store.get_last_played())
         for view in self.views:
             view.set_model(self.model)
+        AsyncModelPopulate(self).start()
+        return False
+
+    def _queue_viewport_update(self):
+        """Schedule L{_update_viewport} once for a burst of scroll events"""
+        if not self._viewport_queued:
+            self._viewport_queued = True
+            gobject.idle_add(self._update_viewport)
+
+    def _update_viewport(self):
+        """Idle callback to tell the model which rows are on screen"""
+        self._viewport_queued = False
+        ranges = [view.get_visible_range() for view in self.views
+                  if view.window and view.window.is_viewable()]
+        ranges = [x for x in ranges if x]
+        if self.model and ranges:
+            self.model.set_viewport(min(x[0][0] for x in ranges),
+                                    max(x[1][0] for x in ranges))
+        return False
+
+    def add_entries(self, rows):
+        """Main-loop callback to add (or refresh) a batch of entries
+
+        @param rows: C{(key, entry)} pairs from
+            L{AsyncModelPopulate.shown_rows}, replacing whatever was last
+            shown for C{key}. (C{entry} is C{None} if it's hidden.)
+        """
+        for key, entry in rows:
+            old = self._shown.pop(key, None)
+            if old is not None:
+                self.model.library.remove(old)
+                self.search_index.remove(old)
+            if entry is not None:
+                self._shown[key] = entry
+                self.model.library.add(entry)
+                self.search_index.add(entry)
+        self._queue_viewport_update()
+        return False
+
+    def on_populate_done(self, batcher):
+        """Main-loop callback for once every scanned entry has been added
+        (and saved by L{AsyncModelPopulate})
+        """
+        batcher.log_stats("games")
+        write_index(self.model.library.entries)
+        AsyncPreflightCheck(self).start()
         return False
 
     def gtkbuilder_load(self, path):
@@ -421,7 +593,8 @@ class Application(object):  # pylint: disable=C0111,R0902
 
             # TODO: Add an "Are you sure?" dialog for install/uninstall
             item = gtk.MenuItem(name)
-            item.connect('activate', lambda _, cmd=cmd: cmd.run())
+            item.connect('activate',
+                         lambda _, cmd=cmd: self.launch(entry, cmd))
             popup.add(item)
 
             # TODO: Actually use a customizable default setting
@@ -453,20 +626,76 @@ class Application(object):  # pylint: disable=C0111,R0902
         popup.show_all()
         return popup
 
+    def launch(self, entry, cmd):
+        """Run a launcher under the supervisor and watch for it exiting"""
+        pid = cmd.run(self.supervisor, self.prefetcher, entry.base_path)
+        if not self._polling_children:
+            self._polling_children = True
+            gobject.timeout_add(100, self._poll_children)
+
+        if not self.tracker.sessions:
+            gobject.timeout_add(int(self.tracker.interval * 1000),
+                                self._poll_sessions)
+        self.tracker.track(entry, pid)
+        self.search_index.touch(entry, time.time())
+        self.queries.entry_changed(entry.identity)
+        self._set_running(entry, True)
+
+    def _poll_sessions(self):
+        """Timeout callback to follow game process trees until they exit
+
+        (Reschedules itself rather than returning True so the interval can
+         adapt to how active the process trees are.)
+        """
+        self.tracker.poll()
+        if self.tracker.sessions:
+            gobject.timeout_add(int(self.tracker.interval * 1000),
+                                self._poll_sessions)
+        return False
+
+    def _set_running(self, entry, running):
+        """Update an entry's is-running indicator"""
+        entry.running = running
+        self.model.library.changed(entry)
+
+    def on_game_ended(self, session):
+        """Clear the is-running indicator once no copies are left running"""
+        self.queries.entry_changed(session.entry.identity)
+        if not self.tracker.is_running(session.entry):
+            self._set_running(session.entry, False)
+
+    def _poll_children(self):
+        """Timeout callback to drain game output until all have exited"""
+        self.supervisor.poll()
+        self._polling_children = bool(self.supervisor.children)
+        return self._polling_children
+
+    def on_game_exited(self, child):
+        """Show the tail of a game's output if it exited uncleanly"""
+        if not child.unclean:
+            return
+
+        dialog = gtk.MessageDialog(self.mainwin,
+                                   gtk.DIALOG_DESTROY_WITH_PARENT,
+                                   gtk.MESSAGE_ERROR, gtk.BUTTONS_CLOSE,
+                                   "%s exited with status %s" % (
+                                       child.name, child.returncode))
+        dialog.format_secondary_text(child.tail() or "(No output)")
+        dialog.connect('response', lambda widget, _: widget.destroy())
+        dialog.show()
+
     def gtk_main_quit(self, widget, event):  # pylint: disable=R0201,W0613
         """Helper for Builder.connect_signals"""
         gtk.main_quit()
 
-    def set_entries(self, entries):
-        self.entries = entries
-
     def on_mi_rename_activate(self, _, pos):
         """Callback for the 'Rename...' context menu entry.
 
         (Because I don't want to force my Entrys to be GObject subclasses,
          so the model must be kept in sync manually.)
         """
-        old_name = self.data[pos][1]
+        entry = self.model.entries[pos[0]]
+        old_name = entry.name
 
         field = gtk.Entry()
         field.set_text(old_name)
@@ -479,29 +708,57 @@ class Application(object):  # pylint: disable=C0111,R0902
         dialog.show_all()
 
         if dialog.run() == gtk.RESPONSE_ACCEPT:
-            name = field.get_text()
-            self.data[pos][1] = name
-            self.entries[self.data[pos][3]].name = name
-            # TODO: Persist
+            entry.name = field.get_text()
+            self.store.set_override(entry, name=entry.name)
+            write_index(self.model.library.entries)
+            self.search_index.update(entry)
+            self.queries.entry_changed(entry.identity)
+            self.model.library.changed(entry)
         dialog.destroy()
 
     def on_mi_hide_activate(self, _, pos):
         """Callback for the 'Hide' context menu entry.
 
-        @todo: Implement this as more than a UX demo.
+        @todo: Provide some way to un-hide entries.
+        """
+        entry = self.model.entries[pos[0]]
+        self.model.library.remove(entry)
+        self.store.set_override(entry, hidden=True)
+        write_index(self.model.library.entries)
+        self.search_index.remove(entry)
+        self.queries.entry_changed(entry.identity)
+
+    def _search_equal(self, model, column, key, rowiter):
+        """Type-ahead find callback which also matches keywords and
+        categories, via L{SearchIndex}.
+
+        (GTK+ calls this for every row on each keystroke, so the hits for
+         the current key are cached. Returns C{False} for a match.)
+
+        @todo: Jump to the best-ranked hit rather than the first in the
+            model's order.
         """
-        self.data.remove(self.data.get_iter(pos))
+        if key != self._search_key:
+            self._search_key = key
+            self._search_hits = set(id(x) for x in
+                                    self.search_index.search(key, None))
+        entry = model.entries[model.get_path(rowiter)[0]]
+        return id(entry) not in self._search_hits
+
+    def on_selection_changed(self, paths):
+        """Prefetch the selected game's files in case it gets launched"""
+        if self.model and len(paths) == 1:
+            self.prefetcher.request_entry(self.model.entries[paths[0][0]])
 
     def on_view_games_item_activated(self, _, path):
         """Handler to launch games on double-click"""
-        cmd = self.model.entries[path[0]].default_launcher
+        entry = self.model.entries[path[0]]
+        cmd = entry.default_launcher
 
         if cmd:
-            cmd.run()
-        # TODO: Add some sort of is-running notification to the GUI
+            self.launch(entry, cmd)
         # TODO: Support screensaver suspension
-        # TODO: Support runtime tracking (and, later, instrument with idleness
-        #       detection) to track play time.
+        # TODO: Instrument runtime tracking with idleness detection
         # TODO: Write something which can save and restore ALL window positions
         # TODO: Hurry up and write that LD_PRELOAD hook to kill a game's
         #       ability to request fullscreen operation.
@@ -14,20 +14,62 @@ __license__ = "GNU GPL 3.0 or later"
 FALLBACK_ICON = "applications-games"
 
 
-import logging, os, sys
+import logging, os, socket, sys, threading
 log = logging.getLogger(__name__)
 
-from PyQt5.QtCore import QAbstractListModel, QSortFilterProxyModel, Qt
+from PyQt5.QtCore import (QAbstractListModel, QModelIndex,
+                          QSortFilterProxyModel, QTimer, Qt)
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtWidgets import QApplication, QListView
 from PyQt5.uic import loadUi
 
+from src.daemon import DaemonClient, entry_from_dict
 from src.game_providers import get_games
-
-class GameListModel(QAbstractListModel):
+from src.library.index import write_index
+from src.library.model import INSERT, REMOVE, LibraryModel, ModelListener
+from src.library.search import SearchIndex
+from src.library.store import LibraryStore
+from src.util.elf import DependencyChecker
+from src.util.icons import ViewportIconCache
+from src.util.prefetch import Prefetcher
+
+class GameListModel(QAbstractListModel, ModelListener):
+    """Thin adapter exposing a L{LibraryModel} to Qt views"""
     def __init__(self, data_list):
-        self.games = data_list
         super(GameListModel, self).__init__()
+        self.library = LibraryModel(data_list, on_pending=lambda:
+                                    QTimer.singleShot(0, self.library.flush))
+        self.library.connect(self)
+        self.icons = ViewportIconCache(self.load_icon)
+
+    @staticmethod
+    def load_icon(icon_name):
+        """Load the icon for an entry's C{icon} value"""
+        if not icon_name:
+            return None
+        elif os.path.isfile(icon_name):
+            return QIcon(icon_name)
+        return QIcon.fromTheme(icon_name, QIcon.fromTheme(FALLBACK_ICON))
+
+    @property
+    def games(self):
+        """The entries as currently displayed"""
+        return self.library.rows
+
+    def rows_about_to_change(self, kind, first, count):
+        if kind == INSERT:
+            self.beginInsertRows(QModelIndex(), first, first + count - 1)
+        elif kind == REMOVE:
+            self.beginRemoveRows(QModelIndex(), first, first + count - 1)
+
+    def rows_changed(self, kind, first, count):
+        if kind == INSERT:
+            self.endInsertRows()
+        elif kind == REMOVE:
+            self.endRemoveRows()
+        else:
+            self.dataChanged.emit(self.index(first),
+                                  self.index(first + count - 1))
 
     def rowCount(self, _):
         return len(self.games)
@@ -45,17 +87,117 @@ class GameListModel(QAbstractListModel):
         if role == Qt.DisplayRole:
             return self.games[index].name
         elif role == Qt.DecorationRole:
-            icon_name = self.games[index].icon
-            if not icon_name:
-                return None
-            elif os.path.isfile(icon_name):
-                return QIcon(icon_name)
-            else:
-                return QIcon.fromTheme(icon_name,
-                                       QIcon.fromTheme(FALLBACK_ICON))
+            return self.icons.get(self.games[index].icon)
         elif role == Qt.ToolTipRole:
             return self.games[index].summarize()
 
+class SearchFilterProxyModel(QSortFilterProxyModel):
+    """Sorts by name or, while a search is active, shows only the hits
+    in ranked order.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.ranks = None
+        super(SearchFilterProxyModel, self).__init__()
+
+    def set_query(self, query):
+        """Filter and rank the rows by a L{SearchIndex} query"""
+        query = query.strip()
+        self.ranks = dict((id(x), rank) for rank, x in
+                          enumerate(self.index.search(query, None))
+                          ) if query else None
+        self.invalidate()
+
+    def filterAcceptsRow(self, row, parent):
+        if self.ranks is None:
+            return True
+        return id(self.sourceModel().games[row]) in self.ranks
+
+    def lessThan(self, left, right):
+        if self.ranks is None:
+            # The source model is already humansorted
+            return left.row() < right.row()
+        games = self.sourceModel().games
+        return (self.ranks[id(games[left.row()])] <
+                self.ranks[id(games[right.row()])])
+
+def track_viewport(view, proxy):
+    """Only load icons for the rows scrolled into view (plus a margin)
+
+    (Assumes C{uniformItemSizes} so the visible range can be worked out
+     from the first visible item without asking for every row's size.)
+    """
+    model = proxy.sourceModel()
+    timers = {}
+
+    def source_entries(start, stop):
+        """Return the entries for a range of proxy rows"""
+        return [model.games[proxy.mapToSource(proxy.index(row, 0)).row()]
+                for row in range(start, min(stop, proxy.rowCount()))]
+
+    def load_icons():
+        """Load a frame's worth of icons and redraw the rows using them"""
+        loaded = model.icons.load_pending()
+        for entry in source_entries(*model.icons.window):
+            if entry.icon in loaded:
+                model.library.changed(entry)
+        if model.icons.pending:
+            timers['load'].start()
+
+    def update_viewport():
+        """Tell the icon cache which rows are on screen"""
+        rect = view.viewport().rect()
+        first = view.indexAt(rect.topLeft())
+        if not first.isValid():
+            if not proxy.rowCount():
+                return
+            first = proxy.index(0, 0)
+        item = view.visualRect(first)
+        per_row = max(1, rect.width() // max(1, item.width()))
+        rows = rect.height() // max(1, item.height()) + 2
+        model.icons.set_viewport(first.row(), first.row() + per_row * rows,
+            lambda start, stop: [x.icon for x in
+                                 source_entries(start, stop)])
+        if model.icons.pending:
+            timers['load'].start()
+
+    for name, callback in (('load', load_icons),
+                           ('viewport', update_viewport)):
+        timer = timers[name] = QTimer(view)
+        timer.setSingleShot(True)
+        timer.setInterval(0)
+        timer.timeout.connect(callback)
+
+    schedule = lambda *_: timers['viewport'].start()
+    view.verticalScrollBar().valueChanged.connect(schedule)
+    view.verticalScrollBar().rangeChanged.connect(schedule)
+    proxy.layoutChanged.connect(schedule)
+    proxy.rowsInserted.connect(schedule)
+    proxy.rowsRemoved.connect(schedule)
+    schedule()
+
+def load_entries(store):
+    """Get the library from a running L{src.daemon} if there is one (which
+    has already scanned, saved, and applied overrides) or else scan now.
+    """
+    try:
+        client = DaemonClient()
+    except socket.error:
+        log.info("No library daemon running. Scanning...")
+    else:
+        try:
+            entries = [entry_from_dict(x) for x in client.list()]
+        finally:
+            client.close()
+        log.info("Got %d entries from the library daemon", len(entries))
+        return entries
+
+    entries = get_games()
+    store.save_scan(entries)
+    entries = store.apply_overrides(entries)
+    write_index(entries)
+    return entries
+
 def main():
     """The main entry point, compatible with setuptools entry points."""
     app = QApplication(sys.argv)
@@ -63,14 +205,33 @@ def main():
     with open(os.path.join(os.path.dirname(__file__), 'testgui.ui')) as fobj:
         window = loadUi(fobj)
 
-    model = GameListModel(get_games())
-    model_sorted = QSortFilterProxyModel()
+    store = LibraryStore()
+    model = GameListModel(load_entries(store))
+
+    # Flag games with missing shared libraries (shown in their tooltips)
+    def check_libraries(entries=list(model.games)):
+        checker = DependencyChecker()
+        for entry in entries:
+            entry.check_libraries(checker)
+    preflight = threading.Thread(target=check_libraries)
+    preflight.daemon = True
+    preflight.start()
+    model_sorted = SearchFilterProxyModel(
+        SearchIndex(model.games, store.get_last_played()))
     model_sorted.setDynamicSortFilter(True)
-    model_sorted.setSortCaseSensitivity(Qt.CaseInsensitive)
     model_sorted.setSourceModel(model)
     model_sorted.sort(0, Qt.AscendingOrder)
 
     window.view_games.setModel(model_sorted)
+    window.view_games.setLayoutMode(QListView.Batched)
+    track_viewport(window.view_games, model_sorted)
+    window.search_box.textChanged.connect(model_sorted.set_query)
+
+    # Start warming the disk cache as soon as a game is selected
+    prefetcher = Prefetcher()
+    window.view_games.selectionModel().currentChanged.connect(
+        lambda current, _: current.isValid() and prefetcher.request_entry(
+            model.games[model_sorted.mapToSource(current).row()]))
     window.show()
 
     sys.exit(app.exec_())